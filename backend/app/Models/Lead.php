@@ -33,6 +33,7 @@ class Lead extends Model
         'source',
         'confidence_score',
         'last_verified_at',
+        'deregistered_at',
     ];
 
     /**
@@ -0,0 +1,84 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\DB;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * Tables that reference leads and must follow a duplicate to the lead that is kept.
+     */
+    private array $referencingTables = ['saved_leads', 'campaign_lead', 'campaign_leads', 'email_opens'];
+
+    /**
+     * Columns of a duplicate that fill in the kept lead's empty ones.
+     */
+    private array $mergedColumns = [
+        'email', 'phone_number', 'website', 'facebook', 'linkedin', 'instagram', 'twitter', 'city', 'country',
+        'industry', 'description', 'profitable', 'employee_count', 'confidence_score', 'last_verified_at',
+    ];
+
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        // The registry importer upserts on registration_number, which only works with a unique key.
+        // Earlier imports appended the register again instead, so merge the duplicates into the oldest lead first.
+        DB::statement('DROP TEMPORARY TABLE IF EXISTS lead_duplicates');
+        DB::statement('
+            CREATE TEMPORARY TABLE lead_duplicates AS
+            SELECT l.id AS duplicate_id, k.keep_id
+            FROM leads l
+            JOIN (
+                SELECT registration_number, MIN(id) AS keep_id
+                FROM leads
+                WHERE registration_number IS NOT NULL
+                GROUP BY registration_number
+                HAVING COUNT(*) > 1
+            ) k ON k.registration_number = l.registration_number AND l.id <> k.keep_id
+        ');
+
+        $assignments = implode(', ', array_map(
+            fn ($column) => "k.{$column} = COALESCE(k.{$column}, d.{$column})",
+            $this->mergedColumns
+        ));
+        DB::statement("
+            UPDATE leads k
+            JOIN lead_duplicates ld ON ld.keep_id = k.id
+            JOIN leads d ON d.id = ld.duplicate_id
+            SET {$assignments}
+        ");
+
+        foreach ($this->referencingTables as $table) {
+            if (!Schema::hasTable($table)) {
+                continue;
+            }
+            // Rows that would collide with one the kept lead already has are left to cascade with the duplicate
+            DB::statement("
+                UPDATE IGNORE {$table} t
+                JOIN lead_duplicates ld ON t.lead_id = ld.duplicate_id
+                SET t.lead_id = ld.keep_id
+            ");
+        }
+
+        DB::statement('DELETE l FROM leads l JOIN lead_duplicates ld ON l.id = ld.duplicate_id');
+        DB::statement('DROP TEMPORARY TABLE lead_duplicates');
+
+        Schema::table('leads', function (Blueprint $table) {
+            $table->unique('registration_number');
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::table('leads', function (Blueprint $table) {
+            $table->dropUnique(['registration_number']);
+        });
+    }
+};
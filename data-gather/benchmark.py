@@ -0,0 +1,700 @@
+"""
+Offline benchmark of the enrichment pipeline
+
+Replays a recorded corpus of search result pages and candidate sites from a
+local HTTP stand-in, so every run sees exactly the same web and speedups
+can be measured without touching the network:
+
+    python benchmark.py generate data/benchmark [leads] [seed]
+        write a synthetic corpus of made-up businesses and their sites
+    python benchmark.py record data/benchmark leads.csv
+        run leads.csv (name;type;regcode;expected_website) live once and
+        record every page fetched, with expected_website as the label
+    python benchmark.py run data/benchmark [engine,engine,...] [latency_ms]
+        replay the corpus through every engine and report
+
+A corpus directory holds:
+
+    leads.jsonl    one lead per line with its labelled expected_website (null if it has none)
+    pages.sqlite   every response, in the format of FetchCache
+
+The stand-in answers every URL the pipeline fetches, Bing included: the
+client's connection adapter sends the requests to the stand-in instead of
+the real host, so connection pooling, gzip, capped streaming reads and
+redirects all run as they would live. Each engine runs in a fresh process,
+which keeps their peak RSS apart, and reports:
+
+    leads/minute, per-stage latency percentiles, bytes fetched, parse CPU
+    time, peak RSS, and website accuracy against the labels
+
+New engines are added with the @benchmark_engine decorator.
+"""
+
+import contextlib
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import enrichment_pipeline
+import metrics
+import search_providers
+from domain_memo import DomainMemo
+from enrichment_pipeline import PlatformReachability, VerificationBudget, build_search_queries, run_pipeline
+from fetch_cache import FetchCache, normalize_url
+from fetcher import HttpClient, RequestScheduler
+from query_planner import QueryPlanner
+from search_providers import BingHtmlProvider
+
+LEADS_FILE = 'leads.jsonl'
+PAGES_FILE = 'pages.sqlite'
+REPORT_FILE = 'report.json'
+
+# Rate limits of the stand-in; high enough that the engines, not the scheduler, set the pace
+BENCHMARK_HOST_RATE = 1000.0
+BENCHMARK_HOST_BURST = 1000
+# Bodies from this size up are sent gzipped when the client accepts it
+GZIP_MIN_BYTES = 1024
+# Pipeline stages whose latency is measured, as functions of enrichment_pipeline
+TIMED_STAGES = ('discover_queries', 'extract_candidates', 'verify_candidates', 'select_results')
+# Parsers whose CPU time is measured, as (module, function name)
+TIMED_PARSERS = ((enrichment_pipeline, 'extract_page_features'), (search_providers, 'parse_result_links'))
+PERCENTILES = (50, 90, 99)
+
+ENGINES = {}
+
+
+def benchmark_engine(name):
+    """
+    Register an engine under a name
+
+    An engine is a function (businesses, client, provider, planner, reachability,
+    domain_memo) returning an iterable of finished LeadWork items.
+    """
+    def register(engine):
+        ENGINES[name] = engine
+        return engine
+    return register
+
+
+@benchmark_engine('sequential')
+def _sequential_engine(businesses, client, provider, planner, reachability, domain_memo):
+    # Every stage in the calling thread, one candidate page at a time
+    return run_pipeline(businesses, client=client, queue_size=0, reachability=reachability,
+                        provider=provider, planner=planner, domain_memo=domain_memo)
+
+
+@benchmark_engine('pipeline')
+def _pipeline_engine(businesses, client, provider, planner, reachability, domain_memo):
+    # Stages overlapping through bounded queues, candidates verified concurrently
+    with ThreadPoolExecutor(max_workers=16, thread_name_prefix='verify') as verify_pool:
+        yield from run_pipeline(businesses, client=client, verify_pool=verify_pool, reachability=reachability,
+                                provider=provider, planner=planner, domain_memo=domain_memo)
+
+
+@benchmark_engine('concurrent')
+def _concurrent_engine(businesses, client, provider, planner, reachability, domain_memo, workers=8):
+    # Many leads at once, like enrich_businesses_concurrently
+    with ThreadPoolExecutor(max_workers=16, thread_name_prefix='verify') as verify_pool, \
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix='lead') as lead_pool:
+        def enrich(business):
+            return next(run_pipeline([business], client=client, verify_pool=verify_pool, queue_size=0,
+                                     reachability=reachability, provider=provider, planner=planner,
+                                     domain_memo=domain_memo))
+        yield from lead_pool.map(enrich, businesses)
+
+
+class StandInAdapter(HTTPAdapter):
+    """
+    Connection adapter that sends every request to the benchmark stand-in
+
+    The original URL travels in the query string and is put back on the
+    response, so redirects, the scheduler and the scorers never notice.
+    Keeps the urllib3 responses around to count the bytes read off the wire.
+    """
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+        self.raw_responses = []
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        original_url = request.url
+        request = request.copy()
+        request.url = f"{self.base_url}/fetch?{urlencode({'url': original_url})}"
+        response = super().send(request, **kwargs)
+        response.url = original_url
+        return response
+
+    def build_response(self, req, resp):
+        with self._lock:
+            self.raw_responses.append(resp)
+        return super().build_response(req, resp)
+
+    def bytes_read(self):
+        """Body bytes read off the wire so far, compressed as they were sent"""
+        with self._lock:
+            return sum(resp.tell() for resp in self.raw_responses)
+
+
+class CorpusPages:
+    """Read-only access to the responses of a corpus, keyed like FetchCache"""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """
+        Args:
+            url (str): URL that was requested
+
+        Returns:
+            tuple: (status, headers dict, body bytes), or None if it wasn't recorded
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, headers, body FROM responses WHERE url = ?", (normalize_url(url),)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), bytes(row[2])
+
+    def close(self):
+        self._db.close()
+
+
+def make_standin_server(corpus_dir, latency=0.0, host='127.0.0.1', port=0):
+    """
+    Build the HTTP server answering /fetch?url=... with the recorded responses
+
+    Args:
+        corpus_dir (str): Corpus directory
+        latency (float): Seconds to wait before every response, to mimic a real network
+        host (str): Interface to listen on
+        port (int): Port to listen on, 0 for any free port
+
+    Returns:
+        ThreadingHTTPServer: With a requests counter; call serve_forever() on it
+    """
+    pages = CorpusPages(os.path.join(corpus_dir, PAGES_FILE))
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        # Keep-alive, as the real sites mostly allow; without Nagle's algorithm, or every
+        # response would wait for the delayed ACK of its headers before sending the body
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def handle(self):
+            try:
+                super().handle()
+            except (BrokenPipeError, ConnectionResetError):
+                # The client stopped reading at its page size cap and dropped the connection
+                pass
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            url = parse_qs(parts.query).get('url', [''])[0]
+            recorded = pages.get(url) if parts.path == '/fetch' else None
+            if latency:
+                time.sleep(latency)
+            with server.lock:
+                server.requests += 1
+
+            if recorded is None:
+                status, headers, body = 404, {'Content-Type': 'text/html'}, b'<html><body>Not found</body></html>'
+            else:
+                status, headers, body = recorded
+            headers = CaseInsensitiveDict(headers)
+            # The recorded bodies are stored decoded
+            for header in ('Content-Encoding', 'Content-Length', 'Transfer-Encoding', 'Connection'):
+                headers.pop(header, None)
+            if len(body) >= GZIP_MIN_BYTES and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = gzip.compress(body, 5)
+                headers['Content-Encoding'] = 'gzip'
+
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), StandInHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = 0
+    return server
+
+
+def load_leads(corpus_dir):
+    with open(os.path.join(corpus_dir, LEADS_FILE), encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def website_domain(url):
+    """Host of a website URL without www., for comparing against the labels"""
+    if not url:
+        return None
+    host = (urlsplit(url if '://' in url else 'https://' + url).hostname or '').lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+def score_accuracy(leads, results):
+    """
+    Compare the websites found with the labelled ones
+
+    Args:
+        leads (list): Corpus leads with expected_website
+        results (dict): Registration number to the website found, None if none was
+
+    Returns:
+        dict: Counts of correct, wrong, missed, false positive and true negative leads,
+            with accuracy, precision and recall
+    """
+    counts = {'correct': 0, 'wrong': 0, 'missed': 0, 'false_positive': 0, 'true_negative': 0}
+    for lead in leads:
+        expected = website_domain(lead.get('expected_website'))
+        found = website_domain(results.get(lead['registration_number']))
+        if expected and found:
+            counts['correct' if found == expected else 'wrong'] += 1
+        elif expected:
+            counts['missed'] += 1
+        else:
+            counts['false_positive' if found else 'true_negative'] += 1
+
+    found_any = counts['correct'] + counts['wrong'] + counts['false_positive']
+    labelled = counts['correct'] + counts['wrong'] + counts['missed']
+    counts['accuracy'] = round((counts['correct'] + counts['true_negative']) / len(leads), 4) if leads else None
+    counts['precision'] = round(counts['correct'] / found_any, 4) if found_any else None
+    counts['recall'] = round(counts['correct'] / labelled, 4) if labelled else None
+    return counts
+
+
+def percentiles(samples):
+    """p50/p90/p99/max of a list of seconds, in milliseconds"""
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    summary = {f"p{p}": round(samples[min(len(samples) - 1, len(samples) * p // 100)] * 1000, 2) for p in PERCENTILES}
+    summary['max'] = round(samples[-1] * 1000, 2)
+    return summary
+
+
+def _timed(function, samples):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+    return wrapper
+
+
+def _cpu_timed(function, cpu_seconds):
+    # thread_time only counts the calling thread, so concurrent parses don't count each other
+    def wrapper(*args, **kwargs):
+        start = time.thread_time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            cpu_seconds.append(time.thread_time() - start)
+    return wrapper
+
+
+def run_engine(name, corpus_dir, base_url):
+    """
+    Replay the corpus through one engine and measure it
+
+    Meant to run in a process of its own: the stage and parser functions
+    are wrapped with timers for the duration, and peak RSS is the process'.
+
+    Args:
+        name (str): Engine name in ENGINES
+        corpus_dir (str): Corpus directory
+        base_url (str): URL of a running stand-in server
+
+    Returns:
+        dict: The engine's measurements
+    """
+    leads = load_leads(corpus_dir)
+    stage_samples = {stage: [] for stage in TIMED_STAGES}
+    for stage in TIMED_STAGES:
+        setattr(enrichment_pipeline, stage, _timed(getattr(enrichment_pipeline, stage), stage_samples[stage]))
+    parse_cpu = []
+    for module, function in TIMED_PARSERS:
+        setattr(module, function, _cpu_timed(getattr(module, function), parse_cpu))
+
+    scheduler = RequestScheduler(default_rate=BENCHMARK_HOST_RATE, default_burst=BENCHMARK_HOST_BURST,
+                                 host_rates={}, max_per_host=64)
+    client = HttpClient(scheduler=scheduler, dns_cache_ttl=0)
+    adapter = StandInAdapter(base_url, pool_connections=4, pool_maxsize=64, max_retries=0)
+    client.session.mount('http://', adapter)
+    client.session.mount('https://', adapter)
+    provider = BingHtmlProvider(client)
+    # Same query order for every run: nothing learned beforehand, no random exploration
+    planner = QueryPlanner(path=None, explore_rate=0)
+    # Nothing remembered from earlier runs either
+    domain_memo = DomainMemo(path=None)
+    businesses = [(lead['name'], lead['reg_type'], lead['registration_number']) for lead in leads]
+
+    found = {}
+    failed = 0
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    # The pipeline narrates every lead; that costs the same as live, but isn't worth showing
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        for work in ENGINES[name](businesses, client, provider, planner, PlatformReachability(), domain_memo):
+            if work.error is not None:
+                failed += 1
+                continue
+            found[work.business[2]] = work.result['website']
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    client.close()
+
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak_rss = None
+    if resource is not None:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_rss = peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+    return {
+        'engine': name,
+        'leads': len(leads),
+        'failed': failed,
+        'seconds': round(wall, 3),
+        'leads_per_minute': round(len(leads) / wall * 60, 1) if wall else None,
+        'cpu_seconds': round(cpu, 3),
+        'parse_cpu_seconds': round(sum(parse_cpu), 3),
+        'bytes_fetched': adapter.bytes_read(),
+        'fetches': len(adapter.raw_responses),
+        'searches': provider.stats(),
+        'domain_memo': domain_memo.stats(),
+        'peak_rss_bytes': peak_rss,
+        'stage_latency_ms': {stage.split('_')[0]: percentiles(samples) for stage, samples in stage_samples.items()},
+        'span_seconds': _span_totals(metrics.get_default_metrics()),
+        'accuracy': score_accuracy(leads, found),
+    }
+
+
+def _span_totals(registry):
+    # Total seconds per instrumented span (search, fetch, parse, score, ...), summed over all threads
+    totals = {}
+    for (name, labels), (_, seconds) in registry.snapshot()['histograms'].items():
+        if name == 'span_seconds':
+            span = dict(labels)['span']
+            totals[span] = round(totals.get(span, 0.0) + seconds, 3)
+    return totals
+
+
+def _engine_process(name, corpus_dir, base_url, results):
+    try:
+        results.put(run_engine(name, corpus_dir, base_url))
+    except BaseException as e:
+        results.put({'engine': name, 'error': f"{type(e).__name__}: {e}"})
+        raise
+
+
+def run_benchmark(corpus_dir, engines=None, latency=0.0):
+    """
+    Benchmark engines against a corpus, each in a fresh process
+
+    Args:
+        corpus_dir (str): Corpus directory
+        engines (list): Engine names, every registered engine if None
+        latency (float): Seconds the stand-in waits before every response
+
+    Returns:
+        list: Measurements per engine, as returned by run_engine
+    """
+    engines = engines or list(ENGINES)
+    unknown = [name for name in engines if name not in ENGINES]
+    if unknown:
+        raise ValueError(f"Unknown engines {unknown}, choose from {sorted(ENGINES)}")
+
+    server = make_standin_server(corpus_dir, latency)
+    thread = threading.Thread(target=server.serve_forever, name='stand-in', daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    base_url = f"http://{host}:{port}"
+
+    # spawn, not fork: the engine shouldn't inherit the stand-in's threads or count its memory
+    context = multiprocessing.get_context('spawn')
+    reports = []
+    try:
+        for name in engines:
+            with server.lock:
+                server.requests = 0
+            results = context.Queue()
+            process = context.Process(target=_engine_process, args=(name, corpus_dir, base_url, results),
+                                      name=f"benchmark-{name}")
+            process.start()
+            report = results.get()
+            process.join()
+            report['latency_ms'] = latency * 1000
+            report['server_requests'] = server.requests
+            reports.append(report)
+            print_report(report)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    with open(os.path.join(corpus_dir, REPORT_FILE), 'w', encoding='utf-8') as f:
+        json.dump(reports, f, indent=2)
+    return reports
+
+
+def print_report(report):
+    print(f"\n=== {report['engine']} ===")
+    if 'error' in report:
+        print(f"Failed: {report['error']}")
+        return
+    accuracy = report['accuracy']
+    rss = report['peak_rss_bytes']
+    print(f"{report['leads']} leads in {report['seconds']:.2f}s: {report['leads_per_minute']} leads/minute"
+          f" ({report['failed']} failed)")
+    print(f"CPU {report['cpu_seconds']:.2f}s, of which parsing {report['parse_cpu_seconds']:.2f}s; peak RSS "
+          + (f"{rss / 1024 / 1024:.1f} MB" if rss else "unknown"))
+    print(f"{report['fetches']} fetches, {report['bytes_fetched'] / 1024:.0f} KB read;"
+          f" searches {report['searches']}; domain memo {report['domain_memo']}")
+    for stage, summary in report['stage_latency_ms'].items():
+        print(f"  {stage:<10} " + '  '.join(f"{key} {value:.1f}ms" for key, value in summary.items()))
+    print("Time in spans (all threads): " + ', '.join(f"{span} {seconds:.2f}s"
+                                                     for span, seconds in report['span_seconds'].items()))
+    print(f"Websites: {accuracy['correct']} correct, {accuracy['wrong']} wrong, {accuracy['missed']} missed,"
+          f" {accuracy['false_positive']} false positives, {accuracy['true_negative']} true negatives"
+          f" (accuracy {accuracy['accuracy']}, precision {accuracy['precision']}, recall {accuracy['recall']})")
+
+
+def _store(cache, url, status, body=b'', content_type='text/html; charset=utf-8', headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict({'Content-Type': content_type, **(headers or {})})
+    response._content = body.encode('utf-8') if isinstance(body, str) else body
+    cache.put(url, response)
+
+
+def _slug(name):
+    ascii_name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', '', ascii_name.lower())
+
+
+def _result_page(results):
+    items = ''.join(
+        f'<li class="b_algo"><h2><a href="{href}">{text}</a></h2><p>{text}</p></li>' for href, text in results
+    )
+    return (f'<html><head><title>Bing</title></head><body>'
+            f'<a href="https://www.bing.com/">Bing</a><a href="https://go.microsoft.com/privacy">Privacy</a>'
+            f'<ol id="b_results">{items}</ol></body></html>')
+
+
+def _filler(rng, size):
+    words = ('kvalitāte', 'pakalpojumi', 'klienti', 'projekti', 'Rīga', 'darbs', 'cena', 'piegāde', 'jaunumi')
+    sentences = []
+    total = 0
+    while total < size:
+        sentence = ' '.join(rng.choice(words) for _ in range(12)) + '.'
+        sentences.append(f"<p>{sentence}</p>")
+        total += len(sentence) + 7
+    return ''.join(sentences)
+
+
+def generate_corpus(corpus_dir, leads=200, seed=1):
+    """
+    Write a synthetic corpus: made-up businesses, their result pages and sites
+
+    Most businesses have a website that names them with their registration
+    type; the rest only have lookalike sites that mention the name. Result
+    pages mix in directory sites, social media profiles (some behind login
+    walls or blocked), PDFs, oversized pages and unrelated sites, so every
+    branch of the pipeline gets exercised.
+
+    Args:
+        corpus_dir (str): Directory to write to, existing corpus files are replaced
+        leads (int): Number of businesses
+        seed (int): Random seed, the same seed always gives the same corpus
+    """
+    rng = random.Random(seed)
+    os.makedirs(corpus_dir, exist_ok=True)
+    pages_path = os.path.join(corpus_dir, PAGES_FILE)
+    for suffix in ('', '-wal', '-shm'):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(pages_path + suffix)
+    cache = FetchCache(pages_path, ttl=None, max_bytes=1 << 40)
+
+    stems = ('Balt', 'Rīg', 'Daug', 'Vidz', 'Kurz', 'Zemgal', 'Sigul', 'Ced', 'Ozol', 'Liep', 'Jūr', 'Gauj',
+             'Vent', 'Lielup', 'Ābel', 'Saul', 'Mež', 'Lauk', 'Akmen', 'Dzint')
+    endings = ('ava', 'ija', 'ums', 'eks', 'tech', 'nams', 'serviss', 'koks', 'metāls', 'būve', 'trans', 'agro')
+    trades = ('', ' Grupa', ' Būvnieki', ' Loģistika', ' Dizains', ' Mēbeles', ' IT')
+
+    names = set()
+    labelled = []
+    while len(labelled) < leads:
+        name = rng.choice(stems) + rng.choice(endings) + rng.choice(trades)
+        if name in names:
+            continue
+        names.add(name)
+        slug = _slug(name)
+        reg_type = rng.choices(('SIA', 'AS', 'IK'), (8, 1, 1))[0]
+        registration_number = str(40003000000 + len(labelled))
+        has_website = rng.random() < 0.65
+        website = f"https://www.{slug}.lv" if has_website else None
+        labelled.append({'name': name, 'reg_type': reg_type, 'registration_number': registration_number,
+                         'expected_website': website})
+
+        if has_website:
+            # Some sites are far larger than the page size cap
+            padding = rng.choice((2_000, 20_000, 80_000, 400_000)) if rng.random() < 0.9 else 3_000_000
+            _store(cache, website, 200, (
+                f'<html><head><title>{name} | Sākums</title>'
+                f'<meta name="description" content="{name} - mūsu pakalpojumi"></head><body>'
+                f'<h1>{name}</h1><p>{reg_type} "{name}" piedāvā savus pakalpojumus kopš 2005. gada.</p>'
+                f'{_filler(rng, padding)}'
+                f'<footer class="footer">{reg_type} {name}, reģ. nr. {registration_number}</footer>'
+                f'</body></html>'
+            ))
+            _store(cache, f"{website}/kontakti", 200, (
+                f'<html><head><title>Kontakti - {name}</title></head><body>'
+                f'<div class="contact">{reg_type} "{name}", Brīvības iela {rng.randint(1, 200)}, Rīga</div>'
+                f'</body></html>'
+            ))
+            _store(cache, f"{website}/rekviziti.pdf", 200, b'%PDF-1.4 ' + bytes(rng.randrange(256) for _ in range(4096)),
+                   content_type='application/pdf')
+
+        # A review site that only mentions the name, the usual false positive
+        lookalike = f"https://{slug}-atsauksmes.com"
+        _store(cache, lookalike, 200, (
+            f'<html><head><title>Atsauksmes par {name}</title></head><body>'
+            f'<p>Lasiet atsauksmes par {name}.</p>{_filler(rng, 5_000)}</body></html>'
+        ))
+
+        facebook = f"https://www.facebook.com/{slug}"
+        if rng.random() < 0.5:
+            _store(cache, facebook, 200, (
+                f'<html><head><title>{name} | Facebook</title></head><body>'
+                f'<div>{name}. {reg_type} "{name}" oficiālā lapa.</div></body></html>'
+            ))
+        else:
+            _store(cache, facebook, 302, headers={'Location': 'https://www.facebook.com/login/'})
+        _store(cache, f"https://www.linkedin.com/company/{slug}", 403, '<html><body>Access denied</body></html>')
+        _store(cache, f"https://www.instagram.com/{slug}/", 302,
+               headers={'Location': 'https://www.instagram.com/accounts/login/'})
+
+        for (template, _), query in zip(enrichment_pipeline.QUERY_TEMPLATES,
+                                        build_search_queries(name, reg_type)):
+            results = [
+                (f"https://www.lursoft.lv/uznemums/{registration_number}", f"{name}, {reg_type} - Lursoft"),
+                (f"https://www.firmas.lv/profile/{registration_number}", f"{name} - Firmas.lv"),
+                (lookalike, f"Atsauksmes par {name}"),
+                (f"https://www.{rng.choice(stems).lower()}zinas.lv/raksts/{rng.randint(1000, 9999)}", "Jaunumi"),
+            ]
+            if has_website and template != 'social_media':
+                results.insert(rng.randint(0, 2), (website, f"{name} - Sākums"))
+                if template == 'contact':
+                    results.insert(0, (f"{website}/kontakti", f"Kontakti - {name}"))
+                    results.append((f"{website}/rekviziti.pdf", f"{name} rekvizīti"))
+            if template == 'social_media' or rng.random() < 0.3:
+                results.extend([
+                    (facebook, f"{name} | Facebook"),
+                    (f"https://www.linkedin.com/company/{slug}", f"{name} | LinkedIn"),
+                    (f"https://www.instagram.com/{slug}/", f"{name} (@{slug})"),
+                ])
+            # Directory sites stay on top, as they usually are
+            rest = results[2:]
+            rng.shuffle(rest)
+            results[2:] = rest
+            _store(cache, BingHtmlProvider().search_url(query), 200, _result_page(results))
+
+    cache.close()
+    with open(os.path.join(corpus_dir, LEADS_FILE), 'w', encoding='utf-8') as f:
+        for lead in labelled:
+            f.write(json.dumps(lead, ensure_ascii=False) + '\n')
+    print(f"Wrote {len(labelled)} leads to {corpus_dir}")
+
+
+def record_corpus(corpus_dir, leads_csv):
+    """
+    Record a corpus from the live web
+
+    Every lead is searched with all queries and a wider verification budget
+    than the pipeline's, so engines that pick other candidates still find
+    their pages in the corpus.
+
+    Args:
+        corpus_dir (str): Directory to write to
+        leads_csv (str): Semicolon separated name;type;regcode;expected_website file with a header row
+    """
+    import csv
+
+    os.makedirs(corpus_dir, exist_ok=True)
+    with open(leads_csv, encoding='utf-8', newline='') as f:
+        leads = [{
+            'name': row['name'],
+            'reg_type': row['type'],
+            'registration_number': row['regcode'],
+            'expected_website': row.get('expected_website') or None,
+        } for row in csv.DictReader(f, delimiter=';')]
+
+    cache = FetchCache(os.path.join(corpus_dir, PAGES_FILE), ttl=None, max_bytes=1 << 40)
+    client = HttpClient(cache=cache)
+    planner = QueryPlanner(path=None, early_stop=False, explore_rate=0)
+    # Pages are still parsed once, but no domain is ever excluded, so every candidate gets recorded
+    domain_memo = DomainMemo(path=None, max_confidence=-1.0)
+    businesses = [(lead['name'], lead['reg_type'], lead['registration_number']) for lead in leads]
+    for work in run_pipeline(businesses, client=client, queue_size=0, reachability=None,
+                             website_budget=VerificationBudget(10), social_budget=VerificationBudget(5),
+                             provider=BingHtmlProvider(client), planner=planner, domain_memo=domain_memo):
+        print(f"Recorded {work.business[0]}: {work.result['website'] if work.result else work.error}")
+    client.close()
+    cache.close()
+
+    with open(os.path.join(corpus_dir, LEADS_FILE), 'w', encoding='utf-8') as f:
+        for lead in leads:
+            f.write(json.dumps(lead, ensure_ascii=False) + '\n')
+    print(f"Recorded {len(leads)} leads to {corpus_dir}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ('generate', 'record', 'run'):
+        print(__doc__)
+        sys.exit(1)
+
+    command, corpus = sys.argv[1], sys.argv[2]
+    if command == 'generate':
+        generate_corpus(corpus, int(sys.argv[3]) if len(sys.argv) > 3 else 200,
+                        int(sys.argv[4]) if len(sys.argv) > 4 else 1)
+    elif command == 'record':
+        if len(sys.argv) < 4:
+            print(__doc__)
+            sys.exit(1)
+        record_corpus(corpus, sys.argv[3])
+    else:
+        run_benchmark(corpus, sys.argv[3].split(',') if len(sys.argv) > 3 else None,
+                      float(sys.argv[4]) / 1000 if len(sys.argv) > 4 else 0.0)
@@ -0,0 +1,469 @@
+"""
+Confidence scoring of candidate pages, one at a time or in batches
+
+The verifiers' confidence is a sum of fixed weights, one per signal found
+on the page (the name in the text, in the title, next to the registration
+type, ...). Scoring is split in two:
+
+- the signals of a page for a business are extracted once, as a row of
+  0/1 values (the expensive part, it runs the BusinessMatcher);
+- the weights and thresholds are applied to the rows.
+
+The pipeline scores one row at a time. A CandidateMatrix holds the rows of
+many (lead, candidate) pairs, so a whole history of candidates can be
+re-scored and re-selected with different weights without parsing or
+matching anything again. With numpy installed the weights are applied
+column by column over the whole matrix; without it, row by row. Both add
+the weights in the same order as the single-row scoring, so they give
+bit-identical confidences and selections.
+
+    python confidence_scoring.py rescore STAGE_FILE [weights.json]
+        build the website matrix of the leads in a record_stage file from
+        the domain memo and the fetch cache (nothing is fetched), then
+        compare selections under the current and the given weights
+"""
+
+import json
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# A website above this confidence wins outright...
+WEBSITE_HIGH_CONFIDENCE = 0.6
+# ...otherwise the best one is taken if it reaches at least this
+WEBSITE_MIN_CONFIDENCE = 0.2
+# Social media profiles are taken from this confidence up
+SOCIAL_MIN_CONFIDENCE = 0.4
+# Scores are capped here, so no other candidate can beat one that reaches it
+MAX_CONFIDENCE = 1.0
+
+# Website signals and their weights, in the order they are added up
+WEBSITE_WEIGHTS = {
+    'name_on_page': 0.3,
+    'partial_name_on_page': 0.2,  # At least half of the name's words, only without the full name
+    'name_in_title': 0.3,
+    'partial_name_in_title': 0.2,
+    'reg_type_near_name': 0.3,
+    'name_in_footer': 0.2,  # Footer, contact or about block naming the business with its registration type
+    'name_in_legal_block': 0.2,
+    'name_in_meta': 0.1,
+}
+# A website without any signal still gets this, unless its URL looks like an article
+WEBSITE_BASE_CONFIDENCE = 0.1
+WEBSITE_GENERIC_URL_TERMS = ('wiki', 'news', 'blog')
+
+# Social media profile signals and their weights, added to the base in this order
+SOCIAL_WEIGHTS = {
+    'name_on_page': 0.3,
+    'partial_name_on_page': 0.2,
+    'name_in_title': 0.2,
+    'reg_type_near_name': 0.1,  # In the same sentence
+}
+# A profile found for the business starts with moderate confidence
+SOCIAL_BASE_CONFIDENCE = 0.5
+
+WEBSITE_SIGNALS = tuple(WEBSITE_WEIGHTS)
+SOCIAL_SIGNALS = tuple(SOCIAL_WEIGHTS)
+
+
+def website_signals(features, url, matcher):
+    """
+    Signals of a fetched page for a business, in WEBSITE_SIGNALS order
+
+    Args:
+        features (PageFeatures): Features extracted from the page
+        url (str): URL the page was fetched from
+        matcher (BusinessMatcher): Matcher for the business
+
+    Returns:
+        tuple: (signals, generic_url): signals is a tuple of 0/1 values, generic_url
+            whether the URL looks like an article rather than a website
+    """
+    text_match = matcher.scan(features.text)
+    name_in_title = features.title is not None and matcher.has_name(features.title)
+    signals = (
+        int(text_match.full_name),
+        int(not text_match.full_name and text_match.token_coverage),
+        int(name_in_title),
+        int(not name_in_title and features.title is not None and matcher.has_token_coverage(features.title)),
+        int(text_match.reg_type_near),
+        int(any(matcher.mentions_name_and_reg_type(text) for text in features.footer_blocks)),
+        int(any(matcher.mentions_name_and_reg_type(text) for text in features.legal_blocks)),
+        int(features.meta_description is not None and matcher.has_name(features.meta_description)),
+    )
+    url = url.lower()
+    return signals, any(term in url for term in WEBSITE_GENERIC_URL_TERMS)
+
+
+def social_signals(features, matcher):
+    """
+    Signals of a fetched social media profile for a business, in SOCIAL_SIGNALS order
+
+    Args:
+        features (PageFeatures): Features extracted from the profile page
+        matcher (BusinessMatcher): Matcher for the business
+
+    Returns:
+        tuple: 0/1 values
+    """
+    page_text = features.text
+    name_on_page = matcher.has_name(page_text)
+    return (
+        int(name_on_page),
+        int(not name_on_page and matcher.has_token_coverage(page_text)),
+        int(features.title is not None and matcher.has_name(features.title)),
+        int(matcher.has_name_and_reg_type_in_sentence(page_text)),
+    )
+
+
+def _add_weights(signals, weights, start):
+    confidence = start
+    for signal, weight in zip(signals, weights):
+        if signal:
+            confidence += weight
+    return confidence
+
+
+def website_confidence(signals, generic_url, weights=WEBSITE_WEIGHTS):
+    """
+    Confidence that a page is the website of the business, from its signals
+
+    Args:
+        signals (tuple): Values returned by website_signals
+        generic_url (bool): The URL looks like an article
+        weights (dict): Weight per signal, WEBSITE_WEIGHTS by default
+
+    Returns:
+        float: A confidence score between 0 and 1
+    """
+    confidence = _add_weights(signals, weights.values(), 0.0)
+    # Prevents zero confidence for sites that might be legitimate but don't match our patterns
+    if confidence == 0.0 and not generic_url:
+        confidence = WEBSITE_BASE_CONFIDENCE
+    return min(confidence, MAX_CONFIDENCE)
+
+
+def social_confidence(signals, weights=SOCIAL_WEIGHTS):
+    """
+    Confidence that a profile belongs to the business, from its signals
+
+    Args:
+        signals (tuple): Values returned by social_signals
+        weights (dict): Weight per signal, SOCIAL_WEIGHTS by default
+
+    Returns:
+        float: A confidence score between 0 and 1
+    """
+    return min(_add_weights(signals, weights.values(), SOCIAL_BASE_CONFIDENCE), MAX_CONFIDENCE)
+
+
+class CandidateMatrix:
+    """
+    Signals of many (lead, candidate) pairs, one row per pair
+
+    Attributes:
+        kind (str): 'website' or 'social'
+        leads (list): Lead key of each row, rows of a lead in its candidate order
+        urls (list): Candidate URL of each row
+        priorities (list): Candidate priority of each row (website), or its platform (social)
+        rows (list): Signal tuples
+        generic (list): Whether each row's URL looks like an article (website)
+    """
+
+    def __init__(self, kind='website'):
+        if kind not in ('website', 'social'):
+            raise ValueError(f"Unknown candidate kind: {kind}")
+        self.kind = kind
+        self.leads = []
+        self.urls = []
+        self.priorities = []
+        self.rows = []
+        self.generic = []
+        self._arrays = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, lead, url, priority, features, matcher):
+        """
+        Extract and add the signals of one candidate page
+
+        Args:
+            lead: Key of the lead, e.g. its registration number
+            url (str): Candidate URL
+            priority: Candidate priority (website), or its platform name (social)
+            features (PageFeatures): Features extracted from the page
+            matcher (BusinessMatcher): Matcher for the lead's business
+        """
+        if self.kind == 'website':
+            signals, generic_url = website_signals(features, url, matcher)
+        else:
+            signals, generic_url = social_signals(features, matcher), False
+        self.add_signals(lead, url, priority, signals, generic_url)
+
+    def add_signals(self, lead, url, priority, signals, generic_url=False):
+        """Add a row whose signals were extracted before"""
+        self.leads.append(lead)
+        self.urls.append(url)
+        self.priorities.append(priority)
+        self.rows.append(tuple(signals))
+        self.generic.append(bool(generic_url))
+        self._arrays = None
+
+    def arrays(self):
+        """
+        The matrix as numpy arrays, built once
+
+        Returns:
+            tuple: (signals, generic, lead_codes): a rows x signals uint8 array, a bool
+                array, and the leads numbered in order of first appearance
+        """
+        if numpy is None:
+            raise RuntimeError("numpy is not installed")
+        if self._arrays is None:
+            width = len(WEBSITE_SIGNALS if self.kind == 'website' else SOCIAL_SIGNALS)
+            codes = {}
+            self._arrays = (
+                numpy.array(self.rows, dtype=numpy.uint8).reshape(len(self.rows), width),
+                numpy.array(self.generic, dtype=bool),
+                numpy.array([codes.setdefault(lead, len(codes)) for lead in self.leads], dtype=numpy.int64),
+            )
+        return self._arrays
+
+    def to_json(self, path):
+        """Save the matrix, to re-score it later without the pages"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'kind': self.kind, 'leads': self.leads, 'urls': self.urls, 'priorities': self.priorities,
+                       'rows': self.rows, 'generic': self.generic}, f, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, path):
+        with open(path, encoding='utf-8') as f:
+            saved = json.load(f)
+        matrix = cls(saved['kind'])
+        for row in zip(saved['leads'], saved['urls'], saved['priorities'], saved['rows'], saved['generic']):
+            matrix.add_signals(*row)
+        return matrix
+
+
+def score_matrix(matrix, weights=None):
+    """
+    Confidence of every row of a matrix
+
+    Args:
+        matrix (CandidateMatrix): Candidates to score
+        weights (dict): Weights to change, the others keep their WEBSITE_WEIGHTS/SOCIAL_WEIGHTS value
+
+    Returns:
+        list: Confidence per row (a float array with numpy)
+    """
+    defaults = WEBSITE_WEIGHTS if matrix.kind == 'website' else SOCIAL_WEIGHTS
+    unknown = set(weights or ()) - set(defaults)
+    if unknown:
+        raise ValueError(f"Unknown {matrix.kind} signals: {', '.join(sorted(unknown))}")
+    weights = {**defaults, **(weights or {})}
+
+    if numpy is None:
+        if matrix.kind == 'website':
+            return [website_confidence(row, generic_url, weights)
+                    for row, generic_url in zip(matrix.rows, matrix.generic)]
+        return [social_confidence(row, weights) for row in matrix.rows]
+
+    signals, generic, _ = matrix.arrays()
+    start = 0.0 if matrix.kind == 'website' else SOCIAL_BASE_CONFIDENCE
+    confidence = numpy.full(len(matrix), start)
+    # One column at a time, in the same order as the single-row sum, so the floats match it exactly
+    for column, weight in enumerate(weights.values()):
+        confidence += signals[:, column] * weight
+    if matrix.kind == 'website':
+        confidence[(confidence == 0.0) & ~generic] = WEBSITE_BASE_CONFIDENCE
+    return numpy.minimum(confidence, MAX_CONFIDENCE)
+
+
+def select_websites(matrix, confidence, minimum=WEBSITE_MIN_CONFIDENCE, window=None):
+    """
+    Choose the website of every lead, like the pipeline's verify and select stages
+
+    The pipeline stops verifying a lead's candidates at the first one above
+    WEBSITE_HIGH_CONFIDENCE, apart from the ones already in its fetch
+    window, so only those rows are considered. The best of them by
+    (confidence, priority) is taken if it is above the minimum.
+
+    Args:
+        matrix (CandidateMatrix): Website candidates
+        confidence (list): Confidence per row, from score_matrix
+        minimum (float): Confidence the best candidate must exceed
+        window (int): Candidates verified at once, the pipeline's DEFAULT_WEBSITE_BUDGET if None
+
+    Returns:
+        dict: Lead key to (url, confidence), or None if no candidate passed, in order of first appearance
+    """
+    if window is None:
+        from enrichment_pipeline import DEFAULT_WEBSITE_BUDGET
+        window = DEFAULT_WEBSITE_BUDGET.concurrency
+
+    if numpy is None:
+        positions = {}
+        last_considered = {}
+        for row, lead in enumerate(matrix.leads):
+            position = positions[lead] = positions.get(lead, -1) + 1
+            if lead not in last_considered and confidence[row] > WEBSITE_HIGH_CONFIDENCE:
+                last_considered[lead] = position + window - 1
+        positions = {}
+        best = {}
+        for row, lead in enumerate(matrix.leads):
+            position = positions[lead] = positions.get(lead, -1) + 1
+            if position > last_considered.get(lead, position):
+                continue
+            key = (confidence[row], matrix.priorities[row])
+            # The first of equal candidates wins, as with max()
+            if lead not in best or key > best[lead][0]:
+                best[lead] = (key, row)
+        return {lead: (matrix.urls[row], confidence[row]) if confidence[row] > minimum else None
+                for lead, (_, row) in best.items()}
+
+    _, _, lead_codes = matrix.arrays()
+    confidence = numpy.asarray(confidence, dtype=float)
+    priorities = numpy.asarray(matrix.priorities, dtype=float)
+    rows = numpy.arange(len(matrix))
+    # Position of every row among its lead's candidates
+    by_lead = numpy.argsort(lead_codes, kind='stable')
+    starts = numpy.ones(len(by_lead), dtype=bool)
+    starts[1:] = lead_codes[by_lead][1:] != lead_codes[by_lead][:-1]
+    start_rows = numpy.flatnonzero(starts)
+    positions = numpy.empty(len(by_lead), dtype=numpy.int64)
+    positions[by_lead] = rows - start_rows[numpy.cumsum(starts) - 1]
+    # Rows past the window of each lead's first high-confidence candidate were never verified
+    first_high = numpy.full(len(start_rows), len(matrix), dtype=numpy.int64)
+    high = confidence > WEBSITE_HIGH_CONFIDENCE
+    numpy.minimum.at(first_high, lead_codes[high], positions[high])
+    considered = numpy.flatnonzero(positions < first_high[lead_codes] + window)
+
+    codes = lead_codes[considered]
+    # Rows grouped by lead, best first within a lead, earlier rows first among equals
+    order = considered[numpy.lexsort((considered, -priorities[considered], -confidence[considered], codes))]
+    first = numpy.ones(len(order), dtype=bool)
+    first[1:] = lead_codes[order][1:] != lead_codes[order][:-1]
+    best = order[first]
+    selections = {}
+    for row, passed in zip(best.tolist(), (confidence[best] > minimum).tolist()):
+        selections[matrix.leads[row]] = (matrix.urls[row], float(confidence[row])) if passed else None
+    return selections
+
+
+def select_social(matrix, confidence, minimum=SOCIAL_MIN_CONFIDENCE):
+    """
+    Choose the profile per platform of every lead, like the pipeline's select stage
+
+    Per platform the first profile above the minimum is taken. A profile
+    whose verification failed is taken too if it comes first, with a None
+    confidence, since the top search result is the best guess then.
+
+    Args:
+        matrix (CandidateMatrix): Social media candidates, priorities holding the platform
+        confidence (list): Confidence per row, from score_matrix; None (NaN with numpy) where verification failed
+        minimum (float): Confidence a profile must exceed
+
+    Returns:
+        dict: Lead key to a dictionary of platform to (url, confidence) of the first profile that passed
+    """
+    if numpy is not None:
+        values = numpy.asarray(confidence, dtype=float)
+        failed = numpy.isnan(values)
+        passing = numpy.flatnonzero(failed | (values > minimum)).tolist()
+        confidence = numpy.where(failed, None, values).tolist()
+    else:
+        passing = [row for row, value in enumerate(confidence) if value is None or value > minimum]
+    selections = {lead: {} for lead in matrix.leads}
+    for row in passing:
+        platforms = selections[matrix.leads[row]]
+        value = confidence[row]
+        platforms.setdefault(matrix.priorities[row], (matrix.urls[row], float(value) if value is not None else None))
+    return selections
+
+
+def build_website_matrix(items, domain_memo=None, client=None):
+    """
+    Build the website matrix of recorded leads without fetching anything
+
+    Each lead's candidates are ranked as the extract stage does, and as many
+    as the pipeline verifies are kept. Pages come
+    from the domain memo, or are read and parsed from the fetch cache.
+    Candidates with neither are left out.
+
+    Args:
+        items (iterable): LeadWork items with search_results, e.g. from replay_stage
+        domain_memo (DomainMemo): Memo with parsed pages, the default one if None
+        client (HttpClient): Offline client over the fetch cache, one over the default cache if None
+
+    Returns:
+        CandidateMatrix: One row per candidate page found, keyed by registration number
+    """
+    from domain_memo import get_default_domain_memo
+    from enrichment_pipeline import DIRECTORY_SITES, MAX_WEBSITE_CANDIDATES, extract_candidates
+    from fetch_cache import FetchCache
+    from fetcher import DEFAULT_MAX_PAGE_BYTES, HttpClient, http_get_capped
+    from page_features import extract_page_features
+
+    domain_memo = domain_memo or get_default_domain_memo()
+    client = client or HttpClient(cache=FetchCache(ttl=None), offline=True)
+    matrix = CandidateMatrix('website')
+    for work in items:
+        extract_candidates(work)
+        lead = work.business[2] or work.business[0]
+        for site in work.websites[:MAX_WEBSITE_CANDIDATES]:
+            url = site['url']
+            if any(directory in url.lower() for directory in DIRECTORY_SITES):
+                continue
+            known, features = domain_memo.lookup(url)
+            if not known:
+                try:
+                    response = http_get_capped(url, DEFAULT_MAX_PAGE_BYTES, timeout=10, client=client)
+                except Exception:
+                    continue
+                if response.status_code == 200 and response.rejected is None:
+                    features = extract_page_features(response.text)
+            # Pages that failed score like an empty page, as they do when verified
+            if features is None:
+                matrix.add_signals(lead, url, site['priority'], (0,) * len(WEBSITE_SIGNALS), True)
+            else:
+                matrix.add(lead, url, site['priority'], features, work.matcher)
+    return matrix
+
+
+def _rescore(stage_file, weights_file=None):
+    from enrichment_pipeline import replay_stage
+
+    start = time.perf_counter()
+    matrix = build_website_matrix(replay_stage(stage_file))
+    print(f"Built {len(matrix)} rows from {stage_file} in {time.perf_counter() - start:.2f}s"
+          f" ({'numpy' if numpy is not None else 'pure Python'})")
+
+    weights = {}
+    if weights_file:
+        with open(weights_file, encoding='utf-8') as f:
+            weights = json.load(f)
+
+    start = time.perf_counter()
+    before = select_websites(matrix, score_matrix(matrix))
+    after = select_websites(matrix, score_matrix(matrix, weights))
+    print(f"Scored and selected twice in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    changed = [lead for lead in before if before[lead] != after[lead]]
+    print(f"{len(before)} leads, {sum(1 for v in after.values() if v)} with a website"
+          f" ({sum(1 for v in before.values() if v)} before), {len(changed)} selections changed")
+    for lead in changed:
+        old, new = before[lead], after[lead]
+        print(f"  {lead}: {old[0] if old else None} -> {new[0] if new else None}"
+              f" ({old[1] if old else 0:.2f} -> {new[1] if new else 0:.2f})")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != 'rescore':
+        print(__doc__)
+        sys.exit(1)
+    _rescore(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
@@ -6,6 +6,8 @@ This script demonstrates how to use the business online search functionality
 to find social media profiles and websites for businesses, with confidence scores.
 """
 
+import sys
+
 from leads_importer import search_business_online
 
 def main():
@@ -49,4 +51,6 @@ def main():
         print("=" * 60)
 
 if __name__ == "__main__":
+    # The ✓/✗ marks need a UTF-8 console
+    sys.stdout.reconfigure(encoding='utf-8')
     main() 
\ No newline at end of file
@@ -0,0 +1,390 @@
+"""
+Memory of candidate websites shared across leads and runs
+
+The same generic domains (aggregators, news sites, municipal pages) turn up
+as website candidates for lead after lead, and used to be downloaded,
+parsed and rejected every time. The memo keeps:
+
+- the parsed PageFeatures of every verified page, so a page that comes up
+  again for another business is only re-scored against the new name;
+- pages that couldn't be fetched or weren't HTML, for NEGATIVE_TTL;
+- per domain, how many different businesses it was a candidate for and the
+  best score it ever got. A domain that came up for GENERIC_MIN_BUSINESSES
+  businesses without ever scoring above GENERIC_MAX_CONFIDENCE is learned
+  as an exclusion: it is no longer a candidate at all, for EXCLUSION_TTL,
+  and never for a business it is named after.
+
+Pages and domains are kept in LRU order and bounded, and written to a
+small SQLite file in batches, so what was learned carries over to the next
+run and is shared by worker processes.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from fetch_cache import normalize_url
+from page_features import PageFeatures
+
+DEFAULT_MEMO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "domain_memo.sqlite")
+
+# Parsed pages kept in memory...
+MAX_MEMO_PAGES = 2000
+# ...and in the memo file
+MAX_STORED_PAGES = 20000
+# Domains whose statistics are kept
+MAX_MEMO_DOMAINS = 50000
+# Failed or rejected pages are not fetched again for this many seconds
+NEGATIVE_TTL = 24 * 3600
+# Parsed pages are trusted for as long as the fetch cache keeps the page itself
+PAGE_TTL = 7 * 24 * 3600
+# A domain that was a candidate for this many businesses...
+GENERIC_MIN_BUSINESSES = 3
+# ...and never scored above this (the pipeline's minimum website confidence) is excluded
+GENERIC_MAX_CONFIDENCE = 0.2
+# Learned exclusions expire after this many seconds, after which the domain has to earn one again
+EXCLUSION_TTL = 30 * 24 * 3600
+# Pending changes are written to the memo file after this many updates
+MEMO_FLUSH_EVERY = 100
+
+
+def website_domain(url):
+    """Domain of a website candidate: lowercased, without scheme, www. and path"""
+    domain = re.sub(r'https?://', '', url.lower())
+    domain = re.sub(r'^www\.', '', domain)
+    return re.sub(r'/.*$', '', domain)
+
+
+def _business_key(business_name):
+    # Short and stable, so a domain's businesses can be stored without their names
+    return hashlib.sha1(' '.join(business_name.casefold().split()).encode('utf-8')).hexdigest()[:12]
+
+
+def _pack_features(features):
+    return zlib.compress(json.dumps([
+        features.title, features.meta_description, features.text, features.footer_blocks, features.legal_blocks,
+    ], ensure_ascii=False).encode('utf-8'))
+
+
+def _unpack_features(blob):
+    title, meta_description, text, footer_blocks, legal_blocks = json.loads(zlib.decompress(blob))
+    return PageFeatures(title, meta_description, text, footer_blocks, legal_blocks)
+
+
+class _DomainStats:
+    __slots__ = ('businesses', 'best', 'excluded_at')
+
+    def __init__(self, businesses=(), best=0.0, excluded_at=None):
+        self.businesses = set(businesses)
+        self.best = best
+        self.excluded_at = excluded_at
+
+
+class DomainMemo:
+    """
+    Shared memo of parsed candidate pages, failed pages and learned exclusions
+
+    Safe to share between threads, and between processes using the same file.
+    """
+
+    def __init__(self, path=DEFAULT_MEMO_PATH, max_pages=MAX_MEMO_PAGES, max_stored_pages=MAX_STORED_PAGES,
+                 max_domains=MAX_MEMO_DOMAINS, negative_ttl=NEGATIVE_TTL, page_ttl=PAGE_TTL,
+                 min_businesses=GENERIC_MIN_BUSINESSES, max_confidence=GENERIC_MAX_CONFIDENCE,
+                 exclusion_ttl=EXCLUSION_TTL):
+        """
+        Args:
+            path (str): SQLite file to persist the memo in, None to keep it in memory only
+            max_pages (int): Parsed pages kept in memory
+            max_stored_pages (int): Parsed and failed pages kept in the file
+            max_domains (int): Domains whose statistics are kept
+            negative_ttl (float): Seconds a failed page is not fetched again
+            page_ttl (float): Seconds a parsed page is reused
+            min_businesses (int): Businesses a domain must have come up for before it can be excluded
+            max_confidence (float): Score a domain must never have exceeded to be excluded
+            exclusion_ttl (float): Seconds a learned exclusion lasts
+        """
+        self.path = path
+        self.max_pages = max_pages
+        self.max_stored_pages = max_stored_pages
+        self.max_domains = max_domains
+        self.negative_ttl = negative_ttl
+        self.page_ttl = page_ttl
+        self.min_businesses = min_businesses
+        self.max_confidence = max_confidence
+        self.exclusion_ttl = exclusion_ttl
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        # Normalized URL to (PageFeatures or None for a failed page, stored_at)
+        self._pages = OrderedDict()
+        self._domains = OrderedDict()
+        self._dirty_pages = {}
+        self._dirty_domains = set()
+        self._pending = 0
+        self._db = None
+        if path is not None:
+            # Worker processes share the file, so wait for each other's writes instead of failing
+            self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS memo_pages (
+                    url TEXT PRIMARY KEY,
+                    features BLOB,
+                    stored_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_memo_pages_last_used ON memo_pages (last_used)")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS memo_domains (
+                    domain TEXT PRIMARY KEY,
+                    businesses TEXT NOT NULL,
+                    best REAL NOT NULL,
+                    excluded_at REAL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            self._db.commit()
+            # Most recently used last, like the LRU
+            for domain, businesses, best, excluded_at in self._db.execute(
+                "SELECT domain, businesses, best, excluded_at FROM "
+                "(SELECT * FROM memo_domains ORDER BY last_used DESC LIMIT ?) ORDER BY last_used",
+                (max_domains,)
+            ):
+                self._domains[domain] = _DomainStats(json.loads(businesses), best, excluded_at)
+
+    def _load_exclusions(self):
+        # Caller must hold self._lock
+        for domain, businesses, best, excluded_at in self._db.execute(
+            "SELECT domain, businesses, best, excluded_at FROM memo_domains WHERE excluded_at >= ?",
+            (time.time() - self.exclusion_ttl,)
+        ):
+            stats = self._domains.get(domain)
+            if stats is None:
+                self._domains[domain] = _DomainStats(json.loads(businesses), best, excluded_at)
+            else:
+                stats.excluded_at = max(stats.excluded_at or 0.0, excluded_at)
+
+    def _excluded(self, stats, now):
+        # Caller must hold self._lock
+        return stats.excluded_at is not None and stats.excluded_at + self.exclusion_ttl >= now
+
+    def is_excluded(self, domain, matcher=None):
+        """
+        Whether a domain was learned to never be a business's own website
+
+        Args:
+            domain (str): Domain as returned by website_domain()
+            matcher (BusinessMatcher): Business being searched for; a domain named after it is never excluded
+
+        Returns:
+            bool
+        """
+        if matcher is not None and matcher.website_pattern.search(domain):
+            return False
+        with self._lock:
+            stats = self._domains.get(domain)
+            if stats is not None and self._excluded(stats, time.time()):
+                self.skipped += 1
+                return True
+            return False
+
+    def exclusions(self):
+        """Every domain currently excluded"""
+        now = time.time()
+        with self._lock:
+            return sorted(domain for domain, stats in self._domains.items() if self._excluded(stats, now))
+
+    def lookup(self, url):
+        """
+        Find what is known about a page
+
+        Args:
+            url (str): Page URL
+
+        Returns:
+            tuple: (known, features): known is False if the page must be fetched; otherwise
+                features are its PageFeatures, or None if the page couldn't be used recently
+        """
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute("SELECT features, stored_at FROM memo_pages WHERE url = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = (_unpack_features(row[0]) if row[0] is not None else None, row[1])
+                    self._remember_page(key, entry)
+            if entry is not None:
+                features, stored_at = entry
+                ttl = self.page_ttl if features is not None else self.negative_ttl
+                if stored_at + ttl >= now:
+                    self._pages.move_to_end(key)
+                    self.hits += 1
+                    return True, features
+                del self._pages[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, url, features):
+        """
+        Remember the parsed features of a page, or that it couldn't be used
+
+        Args:
+            url (str): Page URL
+            features (PageFeatures): Parsed page, None if the fetch failed or the page was rejected
+        """
+        key = normalize_url(url)
+        entry = (features, time.time())
+        with self._lock:
+            self._remember_page(key, entry)
+            self._dirty_pages[key] = entry
+            self._changed()
+
+    def _remember_page(self, key, entry):
+        # Caller must hold self._lock
+        self._pages[key] = entry
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+    def record_score(self, url, business_name, confidence):
+        """
+        Record how a page scored for a business, learning an exclusion if the domain keeps failing
+
+        Args:
+            url (str): Page URL
+            business_name (str): Business it was scored for
+            confidence (float): Its confidence score
+        """
+        domain = website_domain(url)
+        now = time.time()
+        with self._lock:
+            stats = self._domains.get(domain)
+            if stats is None or (stats.excluded_at is not None and not self._excluded(stats, now)):
+                # New, or its exclusion expired and it starts over
+                stats = self._domains[domain] = _DomainStats()
+            self._domains.move_to_end(domain)
+            if stats.excluded_at is not None:
+                return
+            # Only the first few businesses matter for the decision, so the set stays small
+            if len(stats.businesses) < self.min_businesses:
+                stats.businesses.add(_business_key(business_name))
+            stats.best = max(stats.best, confidence)
+            if len(stats.businesses) >= self.min_businesses and stats.best <= self.max_confidence:
+                stats.excluded_at = now
+                print(f"Learned exclusion: {domain} is not the website of any of {len(stats.businesses)} businesses")
+            self._dirty_domains.add(domain)
+            while len(self._domains) > self.max_domains:
+                evicted, _ = self._domains.popitem(last=False)
+                self._dirty_domains.discard(evicted)
+            self._changed()
+
+    def forget(self, domain):
+        """Drop everything learned about a domain, e.g. a wrongly learned exclusion"""
+        with self._lock:
+            self._domains.pop(domain, None)
+            self._dirty_domains.discard(domain)
+            if self._db is not None:
+                self._db.execute("DELETE FROM memo_domains WHERE domain = ?", (domain,))
+                self._db.commit()
+
+    def _changed(self):
+        # Caller must hold self._lock
+        self._pending += 1
+        if self._pending >= MEMO_FLUSH_EVERY:
+            self._flush()
+
+    def _flush(self):
+        # Caller must hold self._lock
+        self._pending = 0
+        if self._db is None:
+            self._dirty_pages.clear()
+            self._dirty_domains.clear()
+            return
+
+        now = time.time()
+        self._db.executemany(
+            "INSERT OR REPLACE INTO memo_pages (url, features, stored_at, last_used) VALUES (?, ?, ?, ?)",
+            [(key, _pack_features(features) if features is not None else None, stored_at, now)
+             for key, (features, stored_at) in self._dirty_pages.items()]
+        )
+        # Another process may have learned about the same domain; keep the union of what both know
+        for domain in self._dirty_domains:
+            stats = self._domains.get(domain)
+            if stats is None:
+                continue
+            row = self._db.execute(
+                "SELECT businesses, best, excluded_at FROM memo_domains WHERE domain = ?", (domain,)
+            ).fetchone()
+            # An expired exclusion in the file is stale, whatever else it says
+            if row is not None and (row[2] is None or row[2] + self.exclusion_ttl >= now):
+                stats.businesses.update(json.loads(row[0])[:max(0, self.min_businesses - len(stats.businesses))])
+                stats.best = max(stats.best, row[1])
+                if row[2] is not None:
+                    stats.excluded_at = max(stats.excluded_at or 0.0, row[2])
+            self._db.execute(
+                "INSERT OR REPLACE INTO memo_domains (domain, businesses, best, excluded_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (domain, json.dumps(sorted(stats.businesses)), stats.best, stats.excluded_at, now)
+            )
+        self._db.execute(
+            "DELETE FROM memo_pages WHERE url IN "
+            "(SELECT url FROM memo_pages ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_stored_pages,)
+        )
+        self._db.execute(
+            "DELETE FROM memo_domains WHERE domain IN "
+            "(SELECT domain FROM memo_domains ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_domains,)
+        )
+        self._db.commit()
+        self._dirty_pages.clear()
+        self._dirty_domains.clear()
+        # Pick up the exclusions other processes learned in the meantime
+        self._load_exclusions()
+
+    def flush(self):
+        """Write pending changes to the memo file"""
+        with self._lock:
+            self._flush()
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'skipped': self.skipped,
+                'pages': len(self._pages),
+                'domains': len(self._domains),
+                'exclusions': sum(1 for stats in self._domains.values() if self._excluded(stats, now)),
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._flush()
+                self._db.close()
+                self._db = None
+
+
+_default_memo = None
+_default_memo_lock = threading.Lock()
+
+
+def get_default_domain_memo():
+    """Return the memo persisted in DEFAULT_MEMO_PATH, shared by the importer's runs and workers"""
+    global _default_memo
+    with _default_memo_lock:
+        if _default_memo is None:
+            _default_memo = DomainMemo()
+            # Don't lose what was learned since the last flush
+            atexit.register(_default_memo.close)
+        return _default_memo
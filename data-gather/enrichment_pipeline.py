@@ -0,0 +1,1043 @@
+"""
+Staged enrichment pipeline: discover → extract → verify → select → persist
+
+Finding a business online is split into small generator stages that each
+take a stream of LeadWork items and yield them on with one more piece
+filled in:
+
+    discover_stage   runs the search queries              (network)
+    extract_stage    classifies and ranks result links    (CPU)
+    verify_stage     fetches and scores candidate pages   (network + CPU)
+    select_stage     applies the confidence thresholds    (CPU)
+    persist_stage    hands the results to a result sink   (database)
+
+run_pipeline() chains them with bounded queues in between, so searching
+for the next business overlaps with scoring the current one. Every stage
+is a plain generator, so it can also be run on its own against inputs
+saved with record_stage() and loaded back with replay_stage(). Pages are
+fetched through the HttpClient, so an offline client with a warm
+FetchCache replays the verify stage without touching the network.
+
+Every stage's time per lead is kept in LeadWork.timings and the
+stage_seconds histogram of metrics.py, next to the search, fetch, parse and
+score spans recorded further down.
+"""
+
+import json
+import queue
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+import metrics
+from confidence_scoring import (
+    MAX_CONFIDENCE, SOCIAL_MIN_CONFIDENCE, WEBSITE_HIGH_CONFIDENCE, WEBSITE_MIN_CONFIDENCE, social_confidence, social_signals,
+    website_confidence, website_signals,
+)
+from domain_memo import DomainMemo, website_domain
+from fetch_cache import cacheable
+from fetcher import DEFAULT_MAX_PAGE_BYTES, http_get_capped
+from link_classifier import SOCIAL_PLATFORMS, SOCIAL_PROFILE_RE, classify_link
+from name_matcher import BusinessMatcher
+from page_features import extract_page_features
+from query_planner import QUERY_TEMPLATES, SearchCoverage, get_default_planner
+from search_providers import BingHtmlProvider, get_default_provider
+
+# Username part of a social media profile URL
+SOCIAL_USERNAME_PATTERN = re.compile(r'(?:facebook|instagram|linkedin|twitter|x)\.com/(?:company/|in/)?([^/\?#]+)')
+
+# Number of candidates verified per lead
+MAX_WEBSITE_CANDIDATES = 5
+MAX_SOCIAL_CANDIDATES = 3
+
+# Candidate websites on company directories and registries, never a business's own website
+DIRECTORY_SITES = ['lursoft.lv', 'firmas.lv', 'company-information.service', 'companylist']
+
+# Items buffered between two pipeline stages
+STAGE_QUEUE_SIZE = 4
+
+# Where social networks send visitors they won't show a profile to
+LOGIN_WALL_PATTERN = re.compile(r'/(?:login|authwall|checkpoint|accounts/login|i/flow/login|signup)\b', re.IGNORECASE)
+# Recent profile fetches remembered per platform...
+REACHABILITY_WINDOW = 20
+# ...of which at least this many are needed before a platform can be skipped...
+REACHABILITY_MIN_SAMPLES = 5
+# ...and a platform is skipped once this share of them was blocked
+REACHABILITY_BLOCKED_SHARE = 0.8
+# One in this many skipped profiles is fetched anyway, to notice when a platform opens up again
+REACHABILITY_PROBE_EVERY = 25
+
+
+def score_website_features(features, url, matcher):
+    """
+    Score how likely a fetched page is the website of the business
+
+    Args:
+        features (PageFeatures): Features extracted from the page
+        url (str): URL the page was fetched from
+        matcher (BusinessMatcher): Matcher for the business
+
+    Returns:
+        float: A confidence score between 0 and 1, see WEBSITE_WEIGHTS for what counts
+    """
+    return website_confidence(*website_signals(features, url, matcher))
+
+
+def verify_website_ownership(url, business_name, reg_type, client=None, matcher=None):
+    """
+    Verify that a website belongs to the correct business by checking its content
+    
+    Args:
+        url (str): Website URL to verify
+        business_name (str): Business name to look for
+        reg_type (str): Registration type to look for
+        client (HttpClient): Pooled HTTP client to fetch with, the shared default if None
+        matcher (BusinessMatcher): Matcher compiled for this business, built if None
+    
+    Returns:
+        float: A confidence score between 0 and 1
+    """
+    return _check_website(url, business_name, reg_type, client, matcher)[0]
+
+
+def _check_website(url, business_name, reg_type, client=None, matcher=None, max_bytes=DEFAULT_MAX_PAGE_BYTES,
+                   domain_memo=None):
+    # verify_website_ownership, but also returns the number of bytes fetched,
+    # and with a DomainMemo reuses pages already parsed for other businesses
+    if not url:
+        return 0.0, 0
+    
+    # Exclude company directory/registry sites
+    if any(site in url.lower() for site in DIRECTORY_SITES):
+        print(f"Skipping directory/registry site: {url}")
+        return 0.0, 0
+    
+    if matcher is None:
+        matcher = BusinessMatcher(business_name, reg_type)
+
+    if domain_memo is not None:
+        if domain_memo.is_excluded(website_domain(url), matcher):
+            metrics.inc('domain_memo', result='excluded')
+            return 0.0, 0
+        known, features = domain_memo.lookup(url)
+        metrics.inc('domain_memo', result='hit' if known else 'miss')
+        if known:
+            # Only the scoring depends on the business
+            confidence = score_website_features(features, url, matcher) if features is not None else 0.0
+            domain_memo.record_score(url, business_name, confidence)
+            return confidence, 0
+    
+    try:
+        # Fetch the start of the website content, skipping anything that isn't HTML
+        response = http_get_capped(url, max_bytes, timeout=10, client=client)
+        size = len(response.content)
+        if response.status_code != 200 or response.rejected is not None:
+            # Server errors and rate limits may be gone next time, the rest is remembered
+            if domain_memo is not None and cacheable(response.status_code):
+                domain_memo.put(url, None)
+                domain_memo.record_score(url, business_name, 0.0)
+            return 0.0, size
+            
+        # Parse the HTML once and score from the extracted features
+        with metrics.span('parse', page='website'):
+            features = extract_page_features(response.text)
+        with metrics.span('score', page='website'):
+            confidence = score_website_features(features, url, matcher)
+        if domain_memo is not None:
+            domain_memo.put(url, features)
+            domain_memo.record_score(url, business_name, confidence)
+        return confidence, size
+        
+    except Exception as e:
+        print(f"Error verifying website {url}: {str(e)}")
+        # Give minimal confidence to try again later
+        return 0.1, 0
+
+
+def score_social_features(features, matcher):
+    """
+    Score how likely a fetched social media profile belongs to the business
+
+    Args:
+        features (PageFeatures): Features extracted from the profile page
+        matcher (BusinessMatcher): Matcher for the business
+
+    Returns:
+        float: A confidence score between 0 and 1, see SOCIAL_WEIGHTS for what counts
+    """
+    return social_confidence(social_signals(features, matcher))
+
+
+class PlatformReachability:
+    """
+    Memory of which social media platforms return usable profile pages
+
+    Facebook, Instagram, LinkedIn and X mostly answer scrapers with errors,
+    timeouts or login walls, which score the same fallback 0.5 as not
+    fetching at all. The outcome of recent fetches is remembered per
+    platform; once most of them were blocked, profiles on that platform are
+    no longer fetched, apart from an occasional probe. Platforms that do
+    return profile pages keep being fetched. Safe to share between threads.
+    """
+
+    def __init__(self, window=REACHABILITY_WINDOW, min_samples=REACHABILITY_MIN_SAMPLES,
+                 blocked_share=REACHABILITY_BLOCKED_SHARE, probe_every=REACHABILITY_PROBE_EVERY):
+        """
+        Args:
+            window (int): Recent fetches remembered per platform
+            min_samples (int): Fetches needed before a platform can be skipped
+            blocked_share (float): Share of blocked fetches from which a platform is skipped
+            probe_every (int): Fetch one in this many skipped profiles anyway
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self.blocked_share = blocked_share
+        self.probe_every = probe_every
+        self._outcomes = {}
+        self._skipped = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def platform_of(url):
+        match = SOCIAL_PROFILE_RE.search(url)
+        return match.lastgroup if match else None
+
+    def is_blocked(self, platform):
+        """Check whether recent fetches of a platform were mostly blocked"""
+        with self._lock:
+            outcomes = self._outcomes.get(platform)
+            if not outcomes or len(outcomes) < self.min_samples:
+                return False
+            return outcomes.count(False) >= self.blocked_share * len(outcomes)
+
+    def should_fetch(self, platform):
+        """
+        Decide whether a profile on a platform is worth fetching
+
+        Args:
+            platform (str): Platform name, e.g. 'facebook'
+
+        Returns:
+            bool: False if the platform is blocking us and this isn't a probe
+        """
+        if platform is None or not self.is_blocked(platform):
+            return True
+        with self._lock:
+            skipped = self._skipped[platform] = self._skipped.get(platform, 0) + 1
+        return skipped % self.probe_every == 0
+
+    def record(self, platform, reachable):
+        """
+        Remember the outcome of a profile fetch
+
+        Args:
+            platform (str): Platform name, e.g. 'facebook'
+            reachable (bool): The profile page came back, not an error, timeout or login wall
+        """
+        if platform is None:
+            return
+        with self._lock:
+            outcomes = self._outcomes.get(platform)
+            if outcomes is None:
+                outcomes = self._outcomes[platform] = deque(maxlen=self.window)
+            outcomes.append(reachable)
+
+    def stats(self):
+        with self._lock:
+            return {
+                platform: {'recent': len(outcomes), 'reachable': outcomes.count(True),
+                           'skipped': self._skipped.get(platform, 0)}
+                for platform, outcomes in self._outcomes.items()
+            }
+
+
+# Shared by every lead of the pipeline, so what one lead learns saves the next ones a timeout
+DEFAULT_PLATFORM_REACHABILITY = PlatformReachability()
+
+
+def verify_social_media(url, business_name, reg_type, client=None, matcher=None):
+    """
+    Verify that a social media profile belongs to the correct business
+    
+    Args:
+        url (str): Social media URL to verify
+        business_name (str): Business name to look for
+        reg_type (str): Registration type to look for
+        client (HttpClient): Pooled HTTP client to fetch with, the shared default if None
+        matcher (BusinessMatcher): Matcher compiled for this business, built if None
+    
+    Returns:
+        float: A confidence score between 0 and 1
+    """
+    return _check_social_media(url, business_name, reg_type, client, matcher)[0]
+
+
+def _check_social_media(url, business_name, reg_type, client=None, matcher=None, reachability=None,
+                        max_bytes=DEFAULT_MAX_PAGE_BYTES):
+    # verify_social_media, but also returns the number of bytes fetched,
+    # and with a PlatformReachability skips platforms that keep blocking us
+    if not url:
+        return 0.0, 0
+    
+    if matcher is None:
+        matcher = BusinessMatcher(business_name, reg_type)
+    
+    # Extract username from URL for direct matching
+    username_match = SOCIAL_USERNAME_PATTERN.search(url.lower())
+    if username_match:
+        # High confidence if the username contains significant parts of the business name,
+        # decent confidence if it matches the initials
+        username_confidence = matcher.username_score(username_match.group(1))
+        if username_confidence is not None:
+            return username_confidence, 0
+            
+    platform = None
+    if reachability is not None:
+        platform = reachability.platform_of(url)
+        if not reachability.should_fetch(platform):
+            # Same moderate confidence a blocked fetch would end up with, minus the timeout
+            return 0.5, 0
+    
+    # For social media, try accessing the page but don't require it since many platforms block scraping
+    try:
+        # Fetch the social media profile
+        response = http_get_capped(url, max_bytes, timeout=5, client=client)  # Shorter timeout for social media
+        size = len(response.content)
+        usable = response.status_code == 200 and response.rejected is None
+        if reachability is not None:
+            reachability.record(platform, usable and not LOGIN_WALL_PATTERN.search(response.url or ''))
+        if not usable:
+            # Return moderate confidence even if we can't access it
+            return 0.5, size
+            
+        # Parse the HTML once and score from the extracted features
+        with metrics.span('parse', page='social'):
+            features = extract_page_features(response.text)
+        with metrics.span('score', page='social'):
+            return score_social_features(features, matcher), size
+        
+    except Exception as e:
+        print(f"Error verifying social media {url}: {str(e)}")
+        if reachability is not None:
+            reachability.record(platform, False)
+        # For social media, we're more lenient - return moderate confidence
+        # Often social media sites block scraping
+        return 0.5, 0
+
+
+def build_search_queries(business_name, reg_type):
+    """
+    Create search queries based on business name and registration type
+
+    Args:
+        business_name (str): The name of the business
+        reg_type (str): The registration type (e.g., SIA)
+
+    Returns:
+        list: Queries, most specific first (in QUERY_TEMPLATES order)
+    """
+    return [template.format(name=business_name, reg_type=reg_type) for _, template in QUERY_TEMPLATES]
+
+
+class LeadWork:
+    """
+    One business travelling through the pipeline
+
+    Attributes:
+        business (tuple): (business_name, reg_type, registration_number)
+        matcher (BusinessMatcher): Name lookups for this business
+        queries (list): Search queries, most specific first
+        search_results (list): (query_index, links) of every query that got an answer,
+            links being (href, link text) pairs
+        websites (list): Unique website candidates, best first
+        social (dict): Platform name to unique profile candidates, best first
+        verified_websites (list): Website candidates with their confidence
+        verified_social (dict): Platform name to profiles with their confidence
+        result (dict): Selected website and social media profiles
+        error (str): Why the lead failed, None if it didn't
+        timings (dict): Stage name to the seconds the stage spent on this lead
+    """
+
+    __slots__ = ('business', 'matcher', 'queries', 'search_results', 'websites', 'social',
+                 'verified_websites', 'verified_social', 'result', 'error', 'timings')
+
+    # Everything except the matcher, which is rebuilt from the business, and the timings of this run
+    RECORD_FIELDS = ('business', 'queries', 'search_results', 'websites', 'social',
+                     'verified_websites', 'verified_social', 'result', 'error')
+
+    def __init__(self, business_name, reg_type, registration_number=None):
+        self.business = (business_name, reg_type, registration_number)
+        self.matcher = BusinessMatcher(business_name, reg_type)
+        self.queries = build_search_queries(business_name, reg_type)
+        self.search_results = None
+        self.websites = None
+        self.social = None
+        self.verified_websites = None
+        self.verified_social = None
+        self.result = None
+        self.error = None
+        self.timings = {}
+
+    def to_record(self):
+        return {field: getattr(self, field) for field in self.RECORD_FIELDS}
+
+    @classmethod
+    def from_record(cls, record):
+        work = cls(*record['business'])
+        for field in cls.RECORD_FIELDS:
+            if field != 'business' and record.get(field) is not None:
+                value = record[field]
+                setattr(work, field, [tuple(result) for result in value] if field == 'search_results' else value)
+        return work
+
+
+@contextmanager
+def timed_stage(work, stage):
+    """
+    Time a stage's work on one lead into work.timings and the stage_seconds histogram
+
+    This is also where a LeadProfiler installed with metrics.set_default_profiler() profiles the lead.
+
+    Args:
+        work (LeadWork): Lead the stage works on
+        stage (str): Stage name
+    """
+    start = time.perf_counter()
+    try:
+        with metrics.profile_lead(stage):
+            yield
+    finally:
+        seconds = time.perf_counter() - start
+        work.timings[stage] = seconds
+        metrics.observe('stage_seconds', seconds, stage=stage)
+
+
+def discover_queries(work, provider, planner):
+    """
+    Send a lead's queries in the planner's order until it is covered
+
+    Args:
+        work (LeadWork): Lead to search for
+        provider (SearchProvider): Search provider to query
+        planner (QueryPlanner): Decides the query order and when to stop
+    """
+    coverage = SearchCoverage(work.matcher, planner.required_platforms)
+    work.search_results = []
+    for query_index in planner.plan(len(work.queries)):
+        if planner.early_stop and coverage.complete:
+            planner.record_skipped(query_index)
+            continue
+
+        query = work.queries[query_index]
+        try:
+            links = provider.search(query)
+        except Exception as e:
+            print(f"Error searching for {query}: {str(e)}")
+            continue
+        if links is None:
+            continue
+
+        work.search_results.append((query_index, links))
+        website_hit, platforms_hit = coverage.add(links)
+        planner.record(query_index, website_hit, platforms_hit)
+
+    # Every search failed or was blocked: that says nothing about the lead, so retry it later instead of
+    # recording that nothing was found
+    if work.queries and not work.search_results:
+        work.error = "no search returned a result page"
+        return
+
+    # Link priorities depend on the query, keep the results in query order whatever order they were sent in
+    work.search_results.sort(key=lambda result: result[0])
+
+
+def discover_stage(items, client=None, provider=None, planner=None):
+    """
+    Run the search queries of every lead
+
+    Args:
+        items (iterable): LeadWork items
+        client (HttpClient): Pooled HTTP client for the default Bing provider, the shared default if None
+        provider (SearchProvider): Search provider to query, Bing's HTML results if None
+        planner (QueryPlanner): Orders the queries and skips unneeded ones, the shared default if None
+
+    Yields:
+        LeadWork: With search_results filled in
+    """
+    if provider is None:
+        provider = BingHtmlProvider(client) if client is not None else get_default_provider()
+    if planner is None:
+        planner = get_default_planner()
+
+    for work in items:
+        if work.error is None and work.search_results is None:
+            print(f"Searching online presence for: {work.business[0]} ({work.business[1]})")
+            with timed_stage(work, 'discover'):
+                discover_queries(work, provider, planner)
+        yield work
+
+
+def extract_candidates(work, domain_memo=None):
+    """
+    Classify the links of a lead's result pages and rank the candidates
+
+    Args:
+        work (LeadWork): Lead with search_results filled in
+        domain_memo (DomainMemo): Drops website candidates on domains it learned to exclude, None to keep all
+    """
+    matcher = work.matcher
+
+    # Store potential websites with confidence scores
+    potential_websites = []
+
+    # Store potential social media profiles
+    potential_social_media = {platform: [] for platform in SOCIAL_PLATFORMS}
+
+    for query_index, links in work.search_results:
+        # Priority depends on the search query - first query has highest priority
+        query_priority = len(work.queries) - query_index
+
+        for href, link_text in links:
+            # Classify the link once; excluded directory/registry sites come back as None
+            classification = classify_link(href, link_text, matcher)
+            if classification is None:
+                continue
+
+            for platform, full_url in classification.social.items():
+                priority = query_priority
+
+                # Higher priority if link text contains business name
+                social_link_text = link_text.lower()
+                if matcher.name in social_link_text:
+                    priority += 2
+
+                potential_social_media[platform].append({
+                    'url': full_url,
+                    'priority': priority,
+                    'link_text': social_link_text
+                })
+
+            if classification.website_tier:
+                potential_websites.append({
+                    'url': classification.website_url,
+                    'priority': classification.website_tier,
+                    'link_text': link_text
+                })
+
+    # Remove duplicate websites and sort by priority
+    work.websites = []
+    seen_domains = set()
+
+    for site in sorted(potential_websites, key=lambda x: x['priority'], reverse=True):
+        domain = website_domain(site['url'])
+
+        if domain not in seen_domains:
+            seen_domains.add(domain)
+            # Generic domains that never belonged to any business don't take up a verification slot
+            if domain_memo is not None and domain_memo.is_excluded(domain, work.matcher):
+                metrics.inc('domain_memo', result='excluded')
+                continue
+            work.websites.append(site)
+
+    print(f"Found {len(work.websites)} unique potential websites")
+
+    # Same for every social media platform
+    work.social = {}
+    for platform, profiles in potential_social_media.items():
+        unique_urls = []
+        seen_urls = set()
+
+        for profile in sorted(profiles, key=lambda x: x['priority'], reverse=True):
+            # Normalize URL for comparison
+            normalized_url = re.sub(r'https?://(www\.)?', '', profile['url'].lower())
+            normalized_url = re.sub(r'/+$', '', normalized_url)  # Remove trailing slashes
+            normalized_url = re.sub(r'\?.*$', '', normalized_url)  # Remove query parameters
+
+            if normalized_url not in seen_urls:
+                seen_urls.add(normalized_url)
+                unique_urls.append(profile)
+
+        if unique_urls:
+            print(f"Found {len(unique_urls)} unique {platform} profiles")
+            work.social[platform] = unique_urls
+
+
+def extract_stage(items, domain_memo=None):
+    """
+    Turn the result pages of every lead into ranked candidates
+
+    Args:
+        items (iterable): LeadWork items from discover_stage
+        domain_memo (DomainMemo): Drops candidates on learned exclusions, None to keep all
+
+    Yields:
+        LeadWork: With websites and social filled in
+    """
+    for work in items:
+        if work.error is None and work.websites is None:
+            try:
+                with timed_stage(work, 'extract'):
+                    extract_candidates(work, domain_memo)
+            except Exception as e:
+                work.error = f"extracting candidates failed: {e}"
+        yield work
+
+
+class VerificationBudget:
+    """
+    Limits on the candidates verified for one lead
+
+    Attributes:
+        max_candidates (int): Candidates considered, best first
+        max_bytes (int): Stop starting new fetches once this many bytes were fetched, None for no limit
+        deadline (float): Seconds after which the remaining candidates are given up, None for no limit
+        concurrency (int): Candidates fetched at the same time
+        page_bytes (int): Bytes read of each candidate page, the rest is never downloaded
+    """
+
+    def __init__(self, max_candidates, max_bytes=None, deadline=None, concurrency=2,
+                 page_bytes=DEFAULT_MAX_PAGE_BYTES):
+        self.max_candidates = max_candidates
+        self.max_bytes = max_bytes
+        self.deadline = deadline
+        self.concurrency = max(1, concurrency)
+        self.page_bytes = page_bytes
+
+
+DEFAULT_WEBSITE_BUDGET = VerificationBudget(MAX_WEBSITE_CANDIDATES, max_bytes=8 * 1024 * 1024, deadline=60)
+DEFAULT_SOCIAL_BUDGET = VerificationBudget(MAX_SOCIAL_CANDIDATES, deadline=30)
+
+
+def verify_in_priority_order(candidates, check, is_final, budget, pool, is_enough=None):
+    """
+    Verify candidates concurrently, but decide on them strictly in priority order
+
+    Up to budget.concurrency candidates are fetched at once, none further
+    than that past the first undecided one. Results are taken in the order
+    of the candidates, and as soon as one is final (nothing after it can be
+    picked any more) the outstanding fetches are cancelled and no new ones
+    are started. Once one is good enough, no new fetches are started either,
+    but the ones already under way are still decided on, since a later
+    candidate may score higher. Which candidates are decided on therefore
+    doesn't depend on timing, and select_websites() can replay it.
+
+    Args:
+        candidates (list): Candidates, best first
+        check (callable): Called with a candidate, returns (confidence, bytes fetched)
+        is_final (callable): Called with a confidence, True if that candidate ends the search
+        budget (VerificationBudget): Limits on candidates, bytes and time
+        pool (Executor): Executor to run the checks in
+        is_enough (callable): Called with a confidence, True if no further candidates need to be started,
+            None to only stop at a final one
+
+    Returns:
+        list: (candidate, confidence) for every candidate decided on, in priority order
+    """
+    candidates = candidates[:budget.max_candidates]
+    deadline = time.monotonic() + budget.deadline if budget.deadline is not None else None
+    cancelled = threading.Event()
+
+    def run(candidate):
+        # Fetches still queued in the pool when the search ends are skipped
+        if cancelled.is_set():
+            return None, 0
+        return check(candidate)
+
+    pending = {}
+    finished = {}
+    decided = []
+    next_start = 0
+    bytes_fetched = 0
+    enough = False
+    try:
+        while len(decided) < (next_start if enough else len(candidates)):
+            # Keep the window full, unless the byte budget is used up or a candidate was good enough
+            while (not enough and next_start < min(len(candidates), len(decided) + budget.concurrency)
+                   and len(pending) < budget.concurrency
+                   and (budget.max_bytes is None or bytes_fetched < budget.max_bytes)):
+                pending[next_start] = pool.submit(run, candidates[next_start])
+                next_start += 1
+
+            index = len(decided)
+            if index not in finished:
+                if index not in pending:
+                    print(f"Verification byte budget used up after {bytes_fetched} bytes")
+                    break
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                done, _ = wait(pending.values(), timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    print(f"Verification deadline reached with {len(candidates) - index} candidates left")
+                    break
+                for i, future in list(pending.items()):
+                    if future.done():
+                        finished[i] = future.result()
+                        bytes_fetched += finished[i][1]
+                        del pending[i]
+                continue
+
+            confidence, _ = finished.pop(index)
+            decided.append((candidates[index], confidence))
+            if is_final(confidence):
+                break
+            if is_enough is not None and is_enough(confidence):
+                enough = True
+    finally:
+        cancelled.set()
+        for future in pending.values():
+            future.cancel()
+
+    return decided
+
+
+def verify_candidates(work, client=None, verify_pool=None, website_budget=None, social_budget=None,
+                      reachability=DEFAULT_PLATFORM_REACHABILITY, domain_memo=None):
+    """
+    Fetch and score the top candidates of a lead
+
+    Candidates are fetched concurrently in priority order. Per platform the
+    first social media profile above SOCIAL_MIN_CONFIDENCE ends the search,
+    and the remaining fetches are cancelled. The first website above
+    WEBSITE_HIGH_CONFIDENCE stops new website fetches, but the ones already
+    under way are still scored, so select_results() can take the best of
+    them; only a website at MAX_CONFIDENCE cancels them.
+
+    Args:
+        work (LeadWork): Lead with websites and social filled in
+        client (HttpClient): Pooled HTTP client to fetch with, the shared default if None
+        verify_pool (Executor): Executor to fetch candidates in, a small one per lead if None
+        website_budget (VerificationBudget): Limits for the websites, DEFAULT_WEBSITE_BUDGET if None
+        social_budget (VerificationBudget): Limits per social media platform, DEFAULT_SOCIAL_BUDGET if None
+        reachability (PlatformReachability): Skips profile fetches on platforms that keep blocking us,
+            None to always fetch
+        domain_memo (DomainMemo): Reuses website pages parsed for earlier leads, None to always fetch
+    """
+    business_name, reg_type, _ = work.business
+    matcher = work.matcher
+    website_budget = website_budget or DEFAULT_WEBSITE_BUDGET
+    social_budget = social_budget or DEFAULT_SOCIAL_BUDGET
+
+    def check_website(site):
+        return _check_website(site['url'], business_name, reg_type, client, matcher, website_budget.page_bytes,
+                              domain_memo)
+
+    def check_profile(profile):
+        try:
+            return _check_social_media(profile['url'], business_name, reg_type, client, matcher, reachability,
+                                       social_budget.page_bytes)
+        except Exception as e:
+            print(f"Error verifying profile {profile['url']}: {str(e)}")
+            # No confidence means the verification itself failed
+            return None, 0
+
+    pool = verify_pool
+    if pool is None:
+        pool = ThreadPoolExecutor(max_workers=max(website_budget.concurrency, social_budget.concurrency))
+    try:
+        verified = verify_in_priority_order(
+            work.websites, check_website, lambda confidence: confidence >= MAX_CONFIDENCE, website_budget, pool,
+            is_enough=lambda confidence: confidence > WEBSITE_HIGH_CONFIDENCE
+        )
+        work.verified_websites = []
+        for i, (site, confidence) in enumerate(verified):
+            print(f"Verified website {i+1}/{min(len(work.websites), website_budget.max_candidates)}: {site['url']}")
+            print(f"  Link text: {site['link_text']}")
+            print(f"  Confidence: {confidence:.2f}")
+            work.verified_websites.append({
+                'url': site['url'],
+                'confidence': confidence,
+                'priority': site['priority']
+            })
+
+        work.verified_social = {}
+        for platform, profiles in work.social.items():
+            verified = verify_in_priority_order(
+                profiles, check_profile, lambda confidence: confidence is None or confidence > SOCIAL_MIN_CONFIDENCE,
+                social_budget, pool
+            )
+            work.verified_social[platform] = []
+            for i, (profile, confidence) in enumerate(verified):
+                print(f"Checked {platform} profile {i+1}/{min(len(profiles), social_budget.max_candidates)}: {profile['url']}")
+                print(f"  Link text: {profile['link_text']}")
+                if confidence is not None:
+                    print(f"  Confidence: {confidence:.2f}")
+                work.verified_social[platform].append({'url': profile['url'], 'confidence': confidence})
+    finally:
+        if verify_pool is None:
+            pool.shutdown(wait=False)
+
+
+def verify_stage(items, client=None, verify_pool=None, website_budget=None, social_budget=None,
+                 reachability=DEFAULT_PLATFORM_REACHABILITY, domain_memo=None):
+    """
+    Fetch and score the candidates of every lead
+
+    Args:
+        items (iterable): LeadWork items from extract_stage
+        client (HttpClient): Pooled HTTP client to fetch with, the shared default if None
+        verify_pool (Executor): Optional executor used to verify candidates concurrently
+        website_budget (VerificationBudget): Limits for the websites of each lead
+        social_budget (VerificationBudget): Limits per social media platform of each lead
+        reachability (PlatformReachability): Platforms to skip profile fetches on, None to always fetch
+        domain_memo (DomainMemo): Reuses website pages parsed for earlier leads, None to always fetch
+
+    Yields:
+        LeadWork: With verified_websites and verified_social filled in
+    """
+    for work in items:
+        if work.error is None and work.verified_websites is None:
+            try:
+                with timed_stage(work, 'verify'):
+                    verify_candidates(work, client, verify_pool, website_budget, social_budget, reachability,
+                                      domain_memo)
+            except Exception as e:
+                work.error = f"verifying candidates failed: {e}"
+        yield work
+
+
+def select_results(work):
+    """
+    Choose the website and social media profiles of a lead from its verified candidates
+
+    Args:
+        work (LeadWork): Lead with verified_websites and verified_social filled in
+
+    Returns:
+        dict: A dictionary containing found social media profiles and website URL, the
+            confidence of the lead: that of its website, or of its best profile without one,
+            and whether the search was conclusive: every query was sent and returned results,
+            so finding nothing means there is nothing to find
+    """
+    results = {
+        'website': None,
+        'social_media': {},
+        'confidence': 0.0,
+        'conclusive': (bool(work.search_results) and len(work.search_results) == len(work.queries)
+                       and all(links for _, links in work.search_results)),
+    }
+
+    # Choose the best website based on verification score and priority
+    verified_websites = work.verified_websites
+    if verified_websites:
+        # First check if any site has high confidence
+        high_confidence_sites = [site for site in verified_websites if site['confidence'] > WEBSITE_HIGH_CONFIDENCE]
+        if high_confidence_sites:
+            best_site = max(high_confidence_sites, key=lambda x: (x['confidence'], x['priority']))
+            results['website'] = best_site['url']
+            results['confidence'] = best_site['confidence']
+            print(f"Selected website with high confidence {best_site['confidence']:.2f}: {best_site['url']}")
+        else:
+            # Fall back to highest scoring site if it has minimum confidence
+            best_site = max(verified_websites, key=lambda x: (x['confidence'], x['priority']))
+            if best_site['confidence'] > WEBSITE_MIN_CONFIDENCE:
+                results['website'] = best_site['url']
+                results['confidence'] = best_site['confidence']
+                print(f"Selected website with moderate confidence {best_site['confidence']:.2f}: {best_site['url']}")
+            else:
+                print("No website passed the minimum confidence threshold")
+
+    for platform, profiles in work.verified_social.items():
+        for profile in profiles:
+            if profile['confidence'] is None:
+                # Default to using the top profile if verification fails
+                results['social_media'][platform] = profile['url']
+                print(f"Selected {platform} profile (verification failed)")
+                break
+            if profile['confidence'] > SOCIAL_MIN_CONFIDENCE:
+                results['social_media'][platform] = profile['url']
+                if results['website'] is None:
+                    results['confidence'] = max(results['confidence'], profile['confidence'])
+                print(f"Selected {platform} profile with confidence {profile['confidence']:.2f}")
+                break
+
+    # Clean up social media URLs - make sure they have proper http prefix
+    for platform, url in results['social_media'].items():
+        if not url.startswith('http'):
+            results['social_media'][platform] = 'https://' + url
+
+    return results
+
+
+def select_stage(items):
+    """
+    Apply the confidence thresholds to every lead
+
+    Args:
+        items (iterable): LeadWork items from verify_stage
+
+    Yields:
+        LeadWork: With result filled in
+    """
+    for work in items:
+        if work.error is None and work.result is None:
+            with timed_stage(work, 'select'):
+                work.result = select_results(work)
+        yield work
+
+
+def persist_stage(items, sink):
+    """
+    Hand every finished lead to a result sink
+
+    Args:
+        items (iterable): LeadWork items from select_stage
+        sink (EnrichmentResultSink): Sink to add the results to
+
+    Yields:
+        LeadWork: Unchanged, after its result was added
+    """
+    for work in items:
+        if work.error is None and work.business[2] is not None:
+            with timed_stage(work, 'persist'):
+                sink.add(work.business[2], work.result)
+        yield work
+
+
+def buffered(items, maxsize=STAGE_QUEUE_SIZE):
+    """
+    Run a stage in a background thread, buffering up to maxsize of its items
+
+    The stage keeps producing while the consumer works on earlier items, so
+    a network-bound stage overlaps with a CPU-bound one downstream.
+    Exceptions raised by the stage are re-raised in the consumer.
+
+    Args:
+        items (iterable): Items produced by the stage
+        maxsize (int): Maximum number of items waiting for the consumer
+
+    Yields:
+        The items of the stage, in order
+    """
+    buffer = queue.Queue(maxsize)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        # Give up once the consumer went away instead of blocking forever
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_StageFailure(e))
+        finally:
+            put(done)
+
+    thread = threading.Thread(target=produce, name='pipeline-stage', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                break
+            if isinstance(item, _StageFailure):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+
+
+class _StageFailure:
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+
+def run_pipeline(businesses, client=None, verify_pool=None, sink=None, queue_size=STAGE_QUEUE_SIZE,
+                 website_budget=None, social_budget=None, reachability=DEFAULT_PLATFORM_REACHABILITY,
+                 provider=None, planner=None, domain_memo=None):
+    """
+    Find the online presence of many businesses through all stages
+
+    Args:
+        businesses (iterable): (business_name, reg_type, registration_number) tuples or LeadWork items
+        client (HttpClient): Pooled HTTP client to fetch with, the shared default if None
+        verify_pool (Executor): Optional executor used to verify candidates concurrently
+        sink (EnrichmentResultSink): Sink to persist results to, None to only yield them
+        queue_size (int): Items buffered between stages, 0 to run every stage in the calling thread
+        website_budget (VerificationBudget): Limits for the websites of each lead, DEFAULT_WEBSITE_BUDGET if None
+        social_budget (VerificationBudget): Limits per social media platform, DEFAULT_SOCIAL_BUDGET if None
+        reachability (PlatformReachability): Platforms to skip profile fetches on, None to always fetch
+        provider (SearchProvider): Search provider to discover candidates with, Bing's HTML results if None
+        planner (QueryPlanner): Orders each lead's queries and skips unneeded ones, the shared default if None
+        domain_memo (DomainMemo): Website pages and exclusions shared across leads, a new in-memory one if None;
+            pass get_default_domain_memo() to keep them across runs
+
+    Yields:
+        LeadWork: Finished leads in input order; failed ones have error set. Each one is
+            counted in the leads metric and logged as a 'lead' event with its stage timings
+    """
+    items = (business if isinstance(business, LeadWork) else LeadWork(*business) for business in businesses)
+
+    if domain_memo is None:
+        domain_memo = DomainMemo(path=None)
+
+    items = discover_stage(items, client, provider, planner)
+    if queue_size:
+        items = buffered(items, queue_size)
+    items = extract_stage(items, domain_memo)
+    items = verify_stage(items, client, verify_pool, website_budget, social_budget, reachability, domain_memo)
+    if queue_size:
+        items = buffered(items, queue_size)
+    items = select_stage(items)
+    if sink is not None:
+        items = persist_stage(items, sink)
+
+    for work in items:
+        if work.error is not None:
+            outcome = 'error'
+        else:
+            outcome = 'found' if work.result['website'] or work.result['social_media'] else 'not_found'
+        metrics.inc('leads', outcome=outcome)
+        metrics.log_event(
+            'lead', business=work.business[0], registration_number=work.business[2], outcome=outcome,
+            website=work.result['website'] if work.result else None, error=work.error,
+            seconds={stage: round(seconds, 4) for stage, seconds in work.timings.items()},
+        )
+        yield work
+
+
+def record_stage(items, path):
+    """
+    Save every item passing through to a JSON lines file
+
+    Args:
+        items (iterable): LeadWork items
+        path (str): File to write to
+
+    Yields:
+        LeadWork: Unchanged
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        for work in items:
+            f.write(json.dumps(work.to_record(), ensure_ascii=False) + '\n')
+            f.flush()
+            yield work
+
+
+def replay_stage(path):
+    """
+    Load items saved by record_stage, to feed them to any later stage
+
+    Args:
+        path (str): File written by record_stage
+
+    Yields:
+        LeadWork: Items in the order they were recorded
+    """
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield LeadWork.from_record(json.loads(line))
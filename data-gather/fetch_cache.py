@@ -0,0 +1,202 @@
+"""
+Persistent on-disk cache for search result and page fetches
+
+Entries are stored in a SQLite file keyed by normalized URL, together with
+the status, headers and fetch time of the response. Expired entries are
+ignored and the least recently used entries are evicted once the cache
+grows past its size limit. Reruns, and replays of cached pages while tuning
+the confidence heuristics, can then be served without touching the network.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "fetch_cache.sqlite")
+# Cached pages are refetched after a week
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Statuses that say more about us (rate limits, bot blocking, timeouts) than about the page
+TRANSIENT_STATUSES = frozenset({401, 403, 408, 429})
+
+
+def normalize_url(url):
+    """
+    Normalize a URL for use as a cache key
+
+    Lowercases the scheme and host, drops the fragment, default ports and a
+    trailing slash, and sorts the query parameters.
+
+    Args:
+        url (str): URL to normalize
+
+    Returns:
+        str: Normalized URL
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and not ((scheme == 'http' and parts.port == 80) or (scheme == 'https' and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip('/')
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ''))
+
+
+def cache_key(url, variant=None):
+    """Cache key of a URL, or of a variant of its response such as a truncated body"""
+    key = normalize_url(url)
+    return f"{key} {variant}" if variant else key
+
+
+def cacheable(status_code):
+    """Only keep responses that won't change if we simply ask again later"""
+    return status_code < 500 and status_code not in TRANSIENT_STATUSES
+
+
+class FetchCache:
+    """
+    SQLite-backed response cache with TTL expiry and size-based LRU eviction
+
+    Safe to share between threads, and between processes using the same file.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Args:
+            path (str): SQLite file to store entries in
+            ttl (float): Seconds an entry stays valid, None to never expire
+            max_bytes (int): Total body size above which old entries are evicted
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Worker processes share the file, so wait for each other's writes instead of failing
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                fetched_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)")
+        self._db.commit()
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, url, variant=None):
+        """
+        Look up a cached response
+
+        Args:
+            url (str): URL that was requested
+            variant (str): Variant of the response it was stored as, None for the full response
+
+        Returns:
+            requests.Response: Rebuilt response, or None if missing or expired
+        """
+        key = cache_key(url, variant)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, headers, body, fetched_at FROM responses WHERE url = ?", (key,)
+            ).fetchone()
+            if row is None or (self.ttl is not None and row[3] + self.ttl < now):
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET last_access = ? WHERE url = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+
+        status, headers, body, fetched_at = row
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(json.loads(headers))
+        response._content = bytes(body)
+        response.url = url
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.from_cache = True
+        response.fetched_at = fetched_at
+        return response
+
+    def put(self, url, response, variant=None):
+        """
+        Store a response if its status is worth caching
+
+        Args:
+            url (str): URL that was requested
+            response (requests.Response): Fully read response
+            variant (str): Store it as this variant of the response, e.g. a truncated body, None if it is complete
+        """
+        if not cacheable(response.status_code):
+            return
+
+        key = cache_key(url, variant)
+        body = response.content
+        headers = json.dumps(dict(response.headers))
+        now = time.time()
+        with self._lock:
+            old = self._db.execute("SELECT size FROM responses WHERE url = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (url, status, headers, body, fetched_at, last_access, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, response.status_code, headers, body, now, now, len(body))
+            )
+            self._total_bytes += len(body) - (old[0] if old else 0)
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        # Caller must hold self._lock
+        if self._total_bytes <= self.max_bytes:
+            return
+
+        # Drop expired entries first, then the least recently used ones
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM responses WHERE fetched_at < ?", (time.time() - self.ttl,))
+        # Other processes may have written to the file too, so recount instead of trusting our estimate
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+        target = self.max_bytes * 0.9
+        rows = self._db.execute("SELECT url, size FROM responses ORDER BY last_access")
+        evicted = []
+        for url, size in rows:
+            if self._total_bytes <= target:
+                break
+            evicted.append((url,))
+            self._total_bytes -= size
+        self._db.executemany("DELETE FROM responses WHERE url = ?", evicted)
+
+    def delete(self, url, variant=None):
+        """Drop a cached response, e.g. one that turned out to be a block page"""
+        key = cache_key(url, variant)
+        with self._lock:
+            row = self._db.execute("SELECT size FROM responses WHERE url = ?", (key,)).fetchone()
+            if row is not None:
+                self._db.execute("DELETE FROM responses WHERE url = ?", (key,))
+                self._db.commit()
+                self._total_bytes -= row[0]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+            self._total_bytes = 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,540 @@
+"""
+Shared HTTP fetching for the enrichment code
+
+All outbound requests made by leads_importer.py go through an HttpClient,
+which pools keep-alive connections, answers repeat requests from a
+FetchCache and sends every request through a RequestScheduler, so every
+worker shares the same per-host rate limits instead of sleeping for a fixed
+time between every request.
+"""
+
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+import metrics
+from fetch_cache import FetchCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+# Requests per second and burst size allowed per host, unless overridden per host
+DEFAULT_HOST_RATE = 2.0
+DEFAULT_HOST_BURST = 4
+# Search engines get a much slower pace than company websites
+DEFAULT_HOST_RATES = {
+    'www.bing.com': (0.5, 1),
+}
+
+# Status codes that mean the host wants us to slow down
+BACKOFF_STATUS_CODES = (429, 503)
+# Backoff used when a throttling response has no usable Retry-After header
+BASE_BACKOFF = 5.0
+MAX_BACKOFF = 300.0
+# Never slow a host below this many requests per second
+MIN_HOST_RATE = 0.05
+
+# Candidate pages are cut off after this many (decompressed) bytes; the
+# title, meta tags and usually the footer are well within the first part
+DEFAULT_MAX_PAGE_BYTES = 256 * 1024
+# Content types a capped fetch reads, anything else is rejected from its headers
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+# Bodies starting like this are binary files served without a usable content type
+BINARY_SIGNATURES = (b'%PDF', b'PK\x03\x04', b'\x89PNG', b'\xff\xd8\xff', b'GIF8')
+CAPPED_CHUNK_SIZE = 16 * 1024
+
+
+def host_of(url):
+    """Return the lowercased host part of a URL"""
+    return (urlsplit(url).hostname or '').lower()
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header value
+
+    Args:
+        value (str): Either a number of seconds or an HTTP date
+
+    Returns:
+        float: Seconds to wait, or None if the value can't be parsed
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """Token bucket that hands out future start times instead of blocking"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def reserve(self, now):
+        """Take one token and return how many seconds the caller must wait for it"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class _HostState:
+    def __init__(self, rate, burst, max_concurrent):
+        self.configured_rate = rate
+        self.bucket = TokenBucket(rate, burst)
+        self.semaphore = threading.BoundedSemaphore(max_concurrent)
+        self.blocked_until = 0.0
+        self.consecutive_backoffs = 0
+
+
+class RequestScheduler:
+    """
+    Central scheduler for outbound requests, with one token bucket per host
+
+    Each host gets its own rate and concurrency limit, so a slow or strict host
+    (like the search engine) never holds up requests to unrelated hosts. When a
+    host answers 429 or 503 the scheduler pauses it for the Retry-After period
+    (or an exponential backoff) and halves its rate, then gradually restores the
+    configured rate as requests succeed again.
+    """
+
+    def __init__(self, default_rate=DEFAULT_HOST_RATE, default_burst=DEFAULT_HOST_BURST,
+                 host_rates=None, max_per_host=4, budget_share=1.0):
+        """
+        Args:
+            default_rate (float): Requests per second for hosts without their own rate
+            default_burst (int): Burst size for hosts without their own rate
+            host_rates (dict): Host to (rate, burst), DEFAULT_HOST_RATES if None
+            max_per_host (int): Maximum concurrent requests per host
+            budget_share (float): Fraction of every rate this scheduler may use, for
+                splitting one rate-limit budget between several worker processes
+        """
+        self.default_rate = default_rate * budget_share
+        self.default_burst = default_burst
+        host_rates = DEFAULT_HOST_RATES if host_rates is None else host_rates
+        self.host_rates = {host: (rate * budget_share, burst) for host, (rate, burst) in host_rates.items()}
+        self.max_per_host = max_per_host
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _state(self, host):
+        # Caller must hold self._lock
+        if host not in self._hosts:
+            rate, burst = self.host_rates.get(host, (self.default_rate, self.default_burst))
+            self._hosts[host] = _HostState(rate, burst, self.max_per_host)
+        return self._hosts[host]
+
+    def _reserve_start(self, host):
+        with self._lock:
+            state = self._state(host)
+            now = time.monotonic()
+            delay = state.bucket.reserve(now)
+            return max(delay, state.blocked_until - now)
+
+    @contextmanager
+    def slot(self, url):
+        """Hold a request slot for the host of `url` for the duration of the block"""
+        host = host_of(url)
+        with self._lock:
+            semaphore = self._state(host).semaphore
+        with semaphore:
+            delay = self._reserve_start(host)
+            if delay > 0:
+                time.sleep(delay)
+            yield
+
+    def record_response(self, url, status_code, headers=None):
+        """
+        Adapt the host's pace to a response
+
+        Args:
+            url (str): URL that was requested
+            status_code (int): HTTP status of the response
+            headers (dict): Response headers, used for Retry-After
+
+        Returns:
+            bool: True if the host asked us to back off
+        """
+        host = host_of(url)
+        with self._lock:
+            state = self._state(host)
+            bucket = state.bucket
+
+            if status_code not in BACKOFF_STATUS_CODES:
+                if state.consecutive_backoffs or bucket.rate < state.configured_rate:
+                    state.consecutive_backoffs = 0
+                    # Additive increase back towards the configured rate
+                    bucket.rate = min(state.configured_rate, bucket.rate + state.configured_rate * 0.1)
+                return False
+
+            state.consecutive_backoffs += 1
+            retry_after = parse_retry_after((headers or {}).get('Retry-After'))
+            if retry_after is None:
+                retry_after = BASE_BACKOFF * 2 ** (state.consecutive_backoffs - 1)
+            retry_after = min(retry_after, MAX_BACKOFF)
+
+            state.blocked_until = max(state.blocked_until, time.monotonic() + retry_after)
+            # Multiplicative decrease so we settle below the host's limit
+            bucket.rate = max(MIN_HOST_RATE, bucket.rate / 2)
+            bucket.tokens = min(bucket.tokens, 0.0)
+
+        print(f"{host} responded {status_code}, backing off for {retry_after:.0f}s")
+        return True
+
+
+class DnsCache:
+    """
+    Process-wide cache for socket.getaddrinfo lookups
+
+    Enrichment keeps resolving the same handful of hosts (the search engine,
+    social networks), so resolved addresses are reused for `ttl` seconds.
+    """
+
+    def __init__(self, ttl=300, max_entries=4096):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._original_getaddrinfo = None
+
+    def getaddrinfo(self, *args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+
+        result = self._original_getaddrinfo(*args, **kwargs)
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = (now + self.ttl, result)
+        return result
+
+    def install(self):
+        """Route socket.getaddrinfo through this cache"""
+        if self._original_getaddrinfo is None:
+            self._original_getaddrinfo = socket.getaddrinfo
+            socket.getaddrinfo = self.getaddrinfo
+
+
+class HttpClient:
+    """
+    Shared HTTP client for all scraping and download requests
+
+    Holds a pooled keep-alive requests.Session so batch runs reuse connections
+    across thousands of businesses, and keeps the headers, timeouts, retry
+    policy and RequestScheduler in one place. The client is safe to share
+    between worker threads.
+    """
+
+    def __init__(self, scheduler=None, timeout=10, pool_connections=64, pool_maxsize=32,
+                 max_retries=2, backoff_factor=0.5, headers=None, dns_cache_ttl=300, http2=False,
+                 cache=None, offline=False):
+        """
+        Args:
+            scheduler (RequestScheduler): Per-host rate limits, a new one if None
+            timeout (float): Default request timeout in seconds
+            pool_connections (int): Number of hosts to keep connection pools for
+            pool_maxsize (int): Connections kept open per host
+            max_retries (int): Retries for connection errors and 502/504 responses
+            backoff_factor (float): Backoff between those retries
+            headers (dict): Extra default headers merged over DEFAULT_HEADERS
+            dns_cache_ttl (float): Seconds to cache DNS lookups, 0 to disable
+            http2 (bool): Use HTTP/2 where urllib3 and the h2 package support it
+            cache (FetchCache): Cache consulted before non-streaming requests, None to disable
+            offline (bool): Only serve responses from the cache, failing on a cache miss
+        """
+        self.scheduler = scheduler or RequestScheduler()
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+
+        if dns_cache_ttl:
+            _install_dns_cache(dns_cache_ttl)
+        if http2:
+            _enable_http2()
+
+        # 429/503 are left to the scheduler, which knows about the host's backoff
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update(DEFAULT_HEADERS)
+        if headers:
+            self.session.headers.update(headers)
+
+    def get(self, url, timeout=None, headers=None, retries=2, cache=True, **kwargs):
+        """
+        GET a URL from the cache, or through the scheduler on a pooled connection
+
+        Args:
+            url (str): URL to fetch
+            timeout (float): Request timeout in seconds, the client default if None
+            headers (dict): Extra headers for this request
+            retries (int): How many times to retry after a 429/503 response
+            cache (bool): Whether the response may be served from and stored in the cache
+
+        Returns:
+            requests.Response
+        """
+        if timeout is None:
+            timeout = self.timeout
+
+        # Streamed downloads (the registry files) are never cached
+        use_cache = self.cache is not None and cache and not kwargs.get('stream')
+        if use_cache:
+            cached = self.cache.get(url)
+            metrics.inc('fetch_cache', result='miss' if cached is None else 'hit')
+            if cached is not None:
+                return cached
+        if self.offline:
+            raise requests.ConnectionError(f"{url} is not in the fetch cache and the client is offline")
+
+        with metrics.span('fetch', mode='stream' if kwargs.get('stream') else 'full'):
+            response = self._fetch(url, timeout, headers, retries, **kwargs)
+        if not kwargs.get('stream'):
+            metrics.inc('fetched_bytes', len(response.content))
+        if use_cache:
+            self.cache.put(url, response)
+        return response
+
+    def get_capped(self, url, max_bytes=DEFAULT_MAX_PAGE_BYTES, content_types=HTML_CONTENT_TYPES,
+                   timeout=None, headers=None, retries=2):
+        """
+        GET an HTML page, reading at most max_bytes of it
+
+        The body is streamed and decompressed chunk by chunk, and the download
+        stops once max_bytes were read, so a huge page costs no more memory or
+        bandwidth than a small one. Responses whose Content-Type isn't one of
+        content_types, or whose body starts like a binary file, are rejected
+        without reading the rest.
+
+        The returned response has two extra attributes: truncated (the body was
+        cut off at max_bytes) and rejected (the reason the body was dropped,
+        None if it wasn't).
+
+        Args:
+            url (str): URL to fetch
+            max_bytes (int): Maximum decompressed body size to read
+            content_types (tuple): Accepted content types, None to accept any
+            timeout (float): Request timeout in seconds, the client default if None
+            headers (dict): Extra headers for this request
+            retries (int): How many times to retry after a 429/503 response
+
+        Returns:
+            requests.Response
+        """
+        if timeout is None:
+            timeout = self.timeout
+
+        # A truncated body is stored apart from the full response get() serves, keyed by its cap
+        capped_variant = f"capped:{max_bytes}"
+        if self.cache is not None:
+            cached = self.cache.get(url)
+            from_variant = False
+            if cached is None:
+                cached = self.cache.get(url, capped_variant)
+                from_variant = cached is not None
+            metrics.inc('fetch_cache', result='miss' if cached is None else 'hit')
+            if cached is not None:
+                response = _cap_response(cached, max_bytes, content_types)
+                # The stored body was cut off at this very cap
+                response.truncated = response.truncated or from_variant
+                return response
+        if self.offline:
+            raise requests.ConnectionError(f"{url} is not in the fetch cache and the client is offline")
+
+        with metrics.span('fetch', mode='capped'):
+            response = self._fetch(url, timeout, headers, retries, stream=True)
+            try:
+                rejected = _rejected_content_type(response, content_types)
+                chunks = []
+                size = 0
+                truncated = False
+                if rejected is None:
+                    # iter_content decompresses gzip/deflate as the chunks arrive
+                    for chunk in response.iter_content(CAPPED_CHUNK_SIZE):
+                        if not chunks and chunk.startswith(BINARY_SIGNATURES):
+                            rejected = 'binary content'
+                            break
+                        chunks.append(chunk)
+                        size += len(chunk)
+                        if size >= max_bytes:
+                            truncated = True
+                            break
+            finally:
+                # Stops the download; a cut-off connection is simply not reused
+                response.close()
+
+        response._content = b''.join(chunks)[:max_bytes] if rejected is None else b''
+        response._content_consumed = True
+        response.truncated = truncated
+        response.rejected = rejected
+        metrics.inc('fetched_bytes', len(response._content))
+        if rejected is not None:
+            metrics.inc('fetch_rejected', reason=rejected.split()[0])
+        if self.cache is not None and rejected is None:
+            self.cache.put(url, response, capped_variant if truncated else None)
+        return response
+
+    def _fetch(self, url, timeout, headers, retries, **kwargs):
+        host = metrics.host_label(host_of(url))
+        for attempt in range(retries + 1):
+            waiting = time.perf_counter()
+            with self.scheduler.slot(url):
+                # Time spent held back by the host's rate limit, apart from the request itself
+                metrics.observe('span_seconds', time.perf_counter() - waiting, span='rate_limit_wait', outcome='ok')
+                try:
+                    response = self.session.get(url, headers=headers, timeout=timeout, **kwargs)
+                except requests.Timeout:
+                    metrics.inc('http_timeouts', host=host)
+                    raise
+                except requests.RequestException as e:
+                    metrics.inc('http_errors', host=host, error=type(e).__name__)
+                    raise
+            metrics.inc('http_requests', host=host, status=str(response.status_code))
+            backed_off = self.scheduler.record_response(url, response.status_code, response.headers)
+            if not backed_off or attempt == retries:
+                return response
+            # The scheduler delays the retry until the host's backoff has passed
+            response.close()
+
+    def close(self):
+        self.session.close()
+
+
+def _rejected_content_type(response, content_types):
+    if content_types is None:
+        return None
+    content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+    # Many small sites send no content type at all, those get the benefit of the doubt
+    if content_type and content_type not in content_types:
+        return f"content type {content_type}"
+    return None
+
+
+def _cap_response(response, max_bytes, content_types):
+    # Apply the same limits to a response served from the cache
+    response.rejected = _rejected_content_type(response, content_types)
+    if response.rejected is None and response.content.startswith(BINARY_SIGNATURES):
+        response.rejected = 'binary content'
+    response.truncated = len(response.content) > max_bytes
+    if response.rejected is not None:
+        response._content = b''
+    elif response.truncated:
+        response._content = response.content[:max_bytes]
+    return response
+
+
+_dns_cache = None
+_dns_cache_lock = threading.Lock()
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def _install_dns_cache(ttl):
+    global _dns_cache
+    with _dns_cache_lock:
+        if _dns_cache is None:
+            _dns_cache = DnsCache(ttl)
+            _dns_cache.install()
+
+
+def _enable_http2():
+    try:
+        import urllib3.http2
+        urllib3.http2.inject_into_urllib3()
+    except ImportError:
+        print("HTTP/2 support needs urllib3>=2.3 and the h2 package, using HTTP/1.1")
+
+
+def get_default_client():
+    """Return the HttpClient shared by every fetch that isn't given one explicitly"""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HttpClient(cache=FetchCache())
+        return _default_client
+
+
+def set_default_client(client):
+    """Replace the shared default client, e.g. with one configured for a worker process"""
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
+
+
+def http_get(url, timeout=None, client=None, headers=None, cache=True, **kwargs):
+    """
+    GET a URL through an HttpClient
+
+    Args:
+        url (str): URL to fetch
+        timeout (float): Request timeout in seconds, the client default if None
+        client (HttpClient): Client to use, the shared default client if None
+        headers (dict): Extra headers for this request
+        cache (bool): Whether the response may be served from and stored in the cache
+
+    Returns:
+        requests.Response
+    """
+    if client is None:
+        client = get_default_client()
+    return client.get(url, timeout=timeout, headers=headers, cache=cache, **kwargs)
+
+
+def http_get_capped(url, max_bytes=DEFAULT_MAX_PAGE_BYTES, timeout=None, client=None, headers=None,
+                    content_types=HTML_CONTENT_TYPES):
+    """
+    GET an HTML page through an HttpClient, reading at most max_bytes of it
+
+    Args:
+        url (str): URL to fetch
+        max_bytes (int): Maximum decompressed body size to read
+        timeout (float): Request timeout in seconds, the client default if None
+        client (HttpClient): Client to use, the shared default client if None
+        headers (dict): Extra headers for this request
+        content_types (tuple): Accepted content types, None to accept any
+
+    Returns:
+        requests.Response: With truncated and rejected set, see HttpClient.get_capped
+    """
+    if client is None:
+        client = get_default_client()
+    return client.get_capped(url, max_bytes, content_types, timeout=timeout, headers=headers)
@@ -1,5 +1,4 @@
 import hashlib
-import requests
 import pymysql
 from dotenv import load_dotenv
 import traceback
@@ -7,13 +6,29 @@ import os
 import sys
 import io
 import csv
+import multiprocessing
+import queue as queue_module
 from io import StringIO
-from bs4 import BeautifulSoup
-import re
 import time
-import random
-
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+import socket
+import sqlite3
+import threading
+import uuid
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+import metrics
+from fetch_cache import FetchCache
+from register_snapshot import RegisterSnapshot, build_snapshot
+from search_providers import BingHtmlProvider
+from fetcher import HttpClient, RequestScheduler, http_get, set_default_client
+from domain_memo import DomainMemo, get_default_domain_memo
+from enrichment_pipeline import LeadWork, run_pipeline
+# Re-exported for scripts that imported the verification helpers from here before they moved
+from enrichment_pipeline import (  # noqa: F401
+    VerificationBudget, score_social_features, score_website_features, verify_social_media, verify_website_ownership,
+)
 
 REGISTRY_URL = "https://data.gov.lv/dati/dataset/4de9697f-850b-45ec-8bba-61fa09ce932f/resource/25e80bf3-f107-4ab4-89ef-251b5b9374e9/download/register.csv"
 BENEFICIAL_OWNERS_URL = "https://data.gov.lv/dati/dataset/b7848ab9-7886-4df0-8bc6-70052a8d9e1a/resource/20a9b26d-d056-4dbb-ae18-9ff23c87bdee/download/beneficial_owners.csv"
@@ -27,464 +42,1214 @@ DB_CONFIG = {
 }
 
 
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# MD5 of the last register file that was synced
+REGISTRY_CHECKSUM_FILE = os.path.join(DATA_DIR, "registry_checksum.txt")
+# HTTP validators and per-row hashes (keyed by regcode) of the last synced register
+REGISTRY_STATE_DB = os.path.join(DATA_DIR, "registry_state.sqlite")
+REGISTRY_DOWNLOAD_FILE = os.path.join(DATA_DIR, "register.csv.part")
+# Refuse to delete more than this share of known rows in one sync (guards against truncated downloads)
+SYNC_MAX_DELETE_FRACTION = 0.05
+
+# Number of rows sent to MySQL per multi-row INSERT in the streaming import
+IMPORT_BATCH_SIZE = 1000
+# Commit after this many batches so a failed run keeps most of its progress
+IMPORT_COMMIT_EVERY = 10
+
+# Columnar copy of the register for re-processing without re-downloading it
+REGISTER_SNAPSHOT_DIR = os.path.join(DATA_DIR, "register_snapshot")
+
+# Same kind of sync state for the beneficial owners dataset
+OWNERS_CHECKSUM_FILE = os.path.join(DATA_DIR, "owners_checksum.txt")
+OWNERS_STATE_DB = os.path.join(DATA_DIR, "owners_state.sqlite")
+OWNERS_DOWNLOAD_FILE = os.path.join(DATA_DIR, "beneficial_owners.csv.part")
+
+BENEFICIAL_OWNERS_TABLE = """
+    CREATE TABLE IF NOT EXISTS beneficial_owners (
+        id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        registration_number VARCHAR(255) NOT NULL,
+        owner_id VARCHAR(64) NULL,
+        forename VARCHAR(255) NULL,
+        surname VARCHAR(255) NULL,
+        nationality VARCHAR(8) NULL,
+        residence VARCHAR(8) NULL,
+        birth_date DATE NULL,
+        registered_on DATE NULL,
+        INDEX idx_beneficial_owners_registration_number (registration_number)
+    )
+"""
+
+BENEFICIAL_OWNERS_INSERT_QUERY = """
+    INSERT INTO beneficial_owners
+        (registration_number, owner_id, forename, surname, nationality, residence, birth_date, registered_on)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+# Upserts on registration_number, which needs its unique key (see require_registry_schema)
+REGISTRY_INSERT_QUERY = """
+    INSERT INTO leads (business_name, reg_type, registration_number, address, founded_date)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        business_name = VALUES(business_name),
+        reg_type = VALUES(reg_type),
+        registration_number = VALUES(registration_number),
+        address = VALUES(address),
+        founded_date = VALUES(founded_date),
+        deregistered_at = NULL
+"""
+
+
+def require_registry_schema(cursor):
+    """
+    Make sure the leads table can take registry upserts
+
+    Without a unique key on registration_number, ON DUPLICATE KEY UPDATE never
+    fires and every import would append the whole register again. Companies
+    that drop out of the register are marked in deregistered_at.
+
+    Raises:
+        RuntimeError: If the unique key or the deregistered_at column is missing
+    """
+    cursor.execute("SHOW INDEX FROM leads WHERE Column_name = 'registration_number' AND Non_unique = 0")
+    if cursor.fetchone() is None:
+        raise RuntimeError(
+            "leads.registration_number has no unique key, so imports would duplicate every lead. "
+            "Run the backend migrations (add_unique_registration_number_to_leads_table) or update_db_table.sql first."
+        )
+    cursor.execute("SHOW COLUMNS FROM leads LIKE 'deregistered_at'")
+    if cursor.fetchone() is None:
+        raise RuntimeError(
+            "leads.deregistered_at is missing. "
+            "Run the backend migrations (add_deregistered_at_to_leads_table) or update_db_table.sql first."
+        )
+
+
 def download_csv_data():
-    response = requests.get(REGISTRY_URL)
+    # The whole register would otherwise end up in the fetch cache
+    response = http_get(REGISTRY_URL, timeout=60, cache=False)
     response.raise_for_status()
     return StringIO(response.content.decode("utf-8"))
 
 
-def verify_website_ownership(url, business_name, reg_type):
+@contextmanager
+def open_registry_stream(source=REGISTRY_URL):
     """
-    Verify that a website belongs to the correct business by checking its content
-    
+    Open the registry CSV as a text stream without loading it into memory
+
     Args:
-        url (str): Website URL to verify
-        business_name (str): Business name to look for
-        reg_type (str): Registration type to look for
-    
+        source (str): URL of the register or path to a local copy of it
+
+    Yields:
+        A text file object that decodes the body incrementally
+    """
+    if not source.startswith(('http://', 'https://')):
+        with open(source, encoding='utf-8', newline='') as f:
+            yield f
+        return
+
+    with http_get(source, timeout=60, stream=True, cache=False) as response:
+        response.raise_for_status()
+        # Let urllib3 undo any gzip/deflate transfer encoding as we read
+        response.raw.decode_content = True
+        # Keep the raw stream open at EOF so the text wrapper can finish reading
+        response.raw.auto_close = False
+        yield io.TextIOWrapper(response.raw, encoding='utf-8', newline='')
+
+
+def registry_row_values(row):
+    """
+    Convert a registry CSV row into the values inserted into the leads table
+
+    Args:
+        row (dict): Row from csv.DictReader over the register
+
     Returns:
-        float: A confidence score between 0 and 1
+        tuple: (name, reg_type, reg_nr, address, founded_date), or None if the
+        row has no name or registration number
     """
-    if not url:
-        return 0.0
-    
-    # Exclude company directory/registry sites
-    excluded_sites = ['lursoft.lv', 'firmas.lv', 'company-information.service', 'companylist']
-    if any(site in url.lower() for site in excluded_sites):
-        print(f"Skipping directory/registry site: {url}")
-        return 0.0
-    
+    name = row.get("name_in_quotes")
+    reg_type = row.get("type")
+    reg_nr = row.get("regcode")
+    address = row.get("address")
+    raw_founded_date = row.get("registered")
+    founded_date = raw_founded_date if raw_founded_date else None
+
+    if not name or not reg_nr:
+        return None
+
+    return (name, reg_type, reg_nr, address, founded_date)
+
+
+def registry_row_digest(values):
+    """
+    Hash the imported fields of a registry row so changed rows can be detected
+
+    Args:
+        values (tuple): Values returned by registry_row_values()
+
+    Returns:
+        str: Hex digest of the row
+    """
+    joined = "\x1f".join("" if value is None else str(value) for value in values)
+    return hashlib.md5(joined.encode("utf-8")).hexdigest()
+
+
+def open_sync_state(path=REGISTRY_STATE_DB):
+    """
+    Open (and create if needed) the local SQLite file holding the registry sync state
+
+    Args:
+        path (str): Path to the state database
+
+    Returns:
+        sqlite3.Connection: Connection with the meta and row_hashes tables
+    """
+    state = sqlite3.connect(path)
+    state.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    state.execute("CREATE TABLE IF NOT EXISTS row_hashes (regcode TEXT PRIMARY KEY, digest TEXT NOT NULL)")
+    state.commit()
+    return state
+
+
+def _get_state_value(state, key):
+    row = state.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_state_value(state, key, value):
+    state.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def read_registry_checksum(path=REGISTRY_CHECKSUM_FILE):
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_registry_checksum(checksum, path=REGISTRY_CHECKSUM_FILE):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(checksum)
+
+
+def download_registry_if_changed(state, url=REGISTRY_URL, dest_path=REGISTRY_DOWNLOAD_FILE):
+    """
+    Download the register only if the server reports it changed since the last sync
+
+    Sends the stored ETag/Last-Modified as a conditional request and streams the
+    body to disk while hashing it.
+
+    Args:
+        state (sqlite3.Connection): Sync state from open_sync_state()
+        url (str): Registry URL
+        dest_path (str): Where to write the downloaded file
+
+    Returns:
+        dict: {'checksum', 'etag', 'last_modified'} for the downloaded file,
+        or None if the server answered 304 Not Modified
+    """
+    headers = {}
+    etag = _get_state_value(state, "etag")
+    last_modified = _get_state_value(state, "last_modified")
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    with http_get(url, timeout=60, headers=headers, stream=True, cache=False) as response:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+
+        digest = hashlib.md5()
+        with open(dest_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                digest.update(chunk)
+                f.write(chunk)
+
+        return {
+            "checksum": digest.hexdigest(),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
         }
-        
-        # Fetch the website content
-        response = requests.get(url, headers=headers, timeout=10)
-        if response.status_code != 200:
-            return 0.0
-            
-        # Parse the HTML
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Get the text content of the page
-        page_text = soup.get_text().lower()
-        
-        # Initialize confidence score
-        confidence = 0.0
-        
-        # Prepare business name for comparison - strip special characters and extra whitespace
-        clean_business_name = re.sub(r'[^\w\s]', '', business_name.lower()).strip()
-        words_in_name = clean_business_name.split()
-        
-        # Basic presence check - at least give some confidence if business name appears on page
-        if clean_business_name in page_text:
-            confidence += 0.3
-        # Also check for partial match (at least half of the words)
-        elif sum(1 for word in words_in_name if len(word) > 3 and word in page_text) >= len(words_in_name) / 2:
-            confidence += 0.2
-        
-        # Check for business name in the title (very strong indicator)
-        if soup.title:
-            title_text = soup.title.text.lower()
-            if clean_business_name in title_text:
-                confidence += 0.3
-            # Partial match in title
-            elif sum(1 for word in words_in_name if len(word) > 3 and word in title_text) >= len(words_in_name) / 2:
-                confidence += 0.2
-        
-        # Check for proximity of business name and registration type
-        normalized_text = ' '.join(page_text.split())
-        # Try different separators and formats for business name + reg type
-        patterns = [
-            rf"{re.escape(clean_business_name)}\s*[,.-]?\s*{re.escape(reg_type.lower())}",
-            rf"{re.escape(reg_type.lower())}\s*[,.-]?\s*{re.escape(clean_business_name)}",
-            rf"{re.escape(clean_business_name)}\s+{re.escape(reg_type.lower())}"
-        ]
-        for pattern in patterns:
-            if re.search(pattern, normalized_text):
-                confidence += 0.3
-                break
-            
-        # Check for registration number if it exists in footers, contacts, or about pages
-        footer_elements = soup.find_all(['footer', 'div'], class_=lambda c: c and ('footer' in str(c).lower() or 'contact' in str(c).lower() or 'about' in str(c).lower()))
-        for element in footer_elements:
-            element_text = element.get_text().lower()
-            if clean_business_name in element_text and reg_type.lower() in element_text:
-                confidence += 0.2
-                break
-        
-        # Look for contact info, legal notices, etc. which often include registration info
-        legal_elements = soup.find_all(['div', 'section', 'p'], class_=lambda c: c and ('legal' in str(c).lower() or 'contact' in str(c).lower()))
-        for element in legal_elements:
-            text = element.get_text().lower()
-            if clean_business_name in text and reg_type.lower() in text:
-                confidence += 0.2
-                break
-        
-        # Check metadata
-        meta_desc = soup.find('meta', attrs={'name': 'description'})
-        if meta_desc and clean_business_name in meta_desc.get('content', '').lower():
-            confidence += 0.1
-            
-        # Give some base confidence if we've reached this point
-        # This prevents zero confidence for sites that might be legitimate but don't match our patterns
-        if confidence == 0.0 and not any(term in url.lower() for term in ['wiki', 'news', 'blog']):
-            confidence = 0.1
-        
-        # Cap confidence at 1.0
-        return min(confidence, 1.0)
-        
-    except Exception as e:
-        print(f"Error verifying website {url}: {str(e)}")
-        # Give minimal confidence to try again later
-        return 0.1
 
 
-def verify_social_media(url, business_name, reg_type):
+def _flush_sync_batch(cursor, state, batch):
+    cursor.executemany(REGISTRY_INSERT_QUERY, [values for values, _ in batch])
+    state.executemany(
+        "INSERT OR REPLACE INTO row_hashes (regcode, digest) VALUES (?, ?)",
+        [(values[2], digest) for values, digest in batch]
+    )
+
+
+def sync_registry(url=REGISTRY_URL, batch_size=IMPORT_BATCH_SIZE, commit_every=IMPORT_COMMIT_EVERY):
     """
-    Verify that a social media profile belongs to the correct business
-    
+    Incrementally sync the leads table with the register
+
+    The register is only downloaded when the server reports a change, and only
+    processed when its checksum differs from the last synced file. Each row is
+    hashed and compared with the stored hash for its regcode, so only inserted,
+    changed and removed rows are written to the leads table. Leads that are no
+    longer in the register are kept, since users may have saved them or used
+    them in campaigns, and get deregistered_at set instead; a lead that comes
+    back has it cleared.
+
     Args:
-        url (str): Social media URL to verify
-        business_name (str): Business name to look for
-        reg_type (str): Registration type to look for
-    
+        url (str): Registry URL
+        batch_size (int): Number of rows per multi-row INSERT
+        commit_every (int): Number of batches between commits
+
     Returns:
-        float: A confidence score between 0 and 1
+        dict: Counts of 'inserted', 'changed', 'deregistered' and 'unchanged' rows
     """
-    if not url:
-        return 0.0
-    
-    # Clean business name for matching
-    clean_business_name = re.sub(r'[^\w\s]', '', business_name.lower()).strip()
-    words_in_name = clean_business_name.split()
-    
-    # Extract username from URL for direct matching
-    username_match = re.search(r'(?:facebook|instagram|linkedin|twitter|x)\.com/(?:company/|in/)?([^/\?#]+)', url.lower())
-    if username_match:
-        username = username_match.group(1)
-        
-        # Check if username contains significant parts of the business name
-        name_parts_in_username = sum(1 for word in words_in_name if len(word) > 3 and word in username)
-        if name_parts_in_username >= max(1, len(words_in_name) / 3):
-            return 0.7  # High confidence based on URL pattern alone
-        
-        # Check for initials or abbreviation
-        if len(username) >= 2 and all(username.startswith(word[0]) for word in words_in_name[:len(username)]):
-            return 0.6  # Decent confidence for initial match
-            
-    # For social media, try accessing the page but don't require it since many platforms block scraping
+    stats = {"inserted": 0, "changed": 0, "deregistered": 0, "unchanged": 0}
+    state = open_sync_state(REGISTRY_STATE_DB)
+
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        # Fetch the social media profile
-        response = requests.get(url, headers=headers, timeout=5)  # Shorter timeout for social media
-        if response.status_code != 200:
-            # Return moderate confidence even if we can't access it
-            return 0.5
-            
-        # Parse the HTML
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Get the text content
-        page_text = soup.get_text().lower()
-        
-        # Initialize confidence score
-        confidence = 0.5  # Start with moderate confidence
-        
-        # Check for business name in the profile
-        if clean_business_name in page_text:
-            confidence += 0.3
-        elif sum(1 for word in words_in_name if len(word) > 3 and word in page_text) >= len(words_in_name) / 2:
-            confidence += 0.2
-        
-        # Check if business name is in title or metadata
-        if soup.title and clean_business_name in soup.title.text.lower():
-            confidence += 0.2
-        
-        # Check for reg type near business name
-        if reg_type.lower() in page_text:
-            sentences = re.split(r'[.!?]', page_text)
-            for sentence in sentences:
-                if clean_business_name in sentence and reg_type.lower() in sentence:
-                    confidence += 0.1
-                    break
-        
-        # Cap confidence at 1.0
-        return min(confidence, 1.0)
-        
-    except Exception as e:
-        print(f"Error verifying social media {url}: {str(e)}")
-        # For social media, we're more lenient - return moderate confidence
-        # Often social media sites block scraping
-        return 0.5
+        download = download_registry_if_changed(state, url, REGISTRY_DOWNLOAD_FILE)
+        if download is None:
+            print("Registry not modified since last sync.")
+            return stats
+
+        has_row_hashes = state.execute("SELECT 1 FROM row_hashes LIMIT 1").fetchone() is not None
+        if has_row_hashes and download["checksum"] == read_registry_checksum(REGISTRY_CHECKSUM_FILE):
+            print("Registry checksum unchanged, nothing to sync.")
+            _set_state_value(state, "etag", download["etag"])
+            _set_state_value(state, "last_modified", download["last_modified"])
+            state.commit()
+            return stats
+
+        known = state.execute("SELECT COUNT(*) FROM row_hashes").fetchone()[0]
+        state.execute("CREATE TEMP TABLE IF NOT EXISTS seen (regcode TEXT PRIMARY KEY)")
+        state.execute("DELETE FROM seen")
+
+        conn = pymysql.connect(**DB_CONFIG)
+        cursor = conn.cursor()
+        try:
+            require_registry_schema(cursor)
+            batch = []
+            batches_since_commit = 0
+
+            with open_registry_stream(REGISTRY_DOWNLOAD_FILE) as csv_stream:
+                reader = csv.DictReader(csv_stream, delimiter=';', quotechar='"')
+                for row in reader:
+                    values = registry_row_values(row)
+                    if values is None:
+                        continue
+
+                    reg_nr = values[2]
+                    state.execute("INSERT OR IGNORE INTO seen (regcode) VALUES (?)", (reg_nr,))
+
+                    digest = registry_row_digest(values)
+                    stored = state.execute("SELECT digest FROM row_hashes WHERE regcode = ?", (reg_nr,)).fetchone()
+                    if stored is None:
+                        stats["inserted"] += 1
+                    elif stored[0] != digest:
+                        stats["changed"] += 1
+                    else:
+                        stats["unchanged"] += 1
+                        continue
+
+                    batch.append((values, digest))
+                    if len(batch) < batch_size:
+                        continue
+
+                    _flush_sync_batch(cursor, state, batch)
+                    batch = []
+
+                    batches_since_commit += 1
+                    if batches_since_commit >= commit_every:
+                        # Commit MySQL before the hashes so a crash only causes rows to be rewritten
+                        conn.commit()
+                        state.commit()
+                        batches_since_commit = 0
+
+            if batch:
+                _flush_sync_batch(cursor, state, batch)
+            conn.commit()
+            state.commit()
+
+            # Rows we have hashes for that are no longer in the register
+            removed = [r[0] for r in state.execute(
+                "SELECT regcode FROM row_hashes WHERE regcode NOT IN (SELECT regcode FROM seen)"
+            )]
+            if removed and len(removed) > known * SYNC_MAX_DELETE_FRACTION:
+                print(f"Refusing to deregister {len(removed)} of {known} leads; the download may be truncated.")
+                removed = []
+
+            for start in range(0, len(removed), batch_size):
+                chunk = removed[start:start + batch_size]
+                placeholders = ", ".join(["%s"] * len(chunk))
+                # Never delete: saved leads and campaign history reference the lead and would cascade with it
+                cursor.execute(
+                    f"UPDATE leads SET deregistered_at = NOW() "
+                    f"WHERE registration_number IN ({placeholders}) AND deregistered_at IS NULL",
+                    chunk
+                )
+                conn.commit()
+                # Forgetting the hash means the lead is written, and its mark cleared, if it comes back
+                state.executemany("DELETE FROM row_hashes WHERE regcode = ?", [(reg_nr,) for reg_nr in chunk])
+                state.commit()
+            stats["deregistered"] = len(removed)
+        finally:
+            cursor.close()
+            conn.close()
+
+        write_registry_checksum(download["checksum"], REGISTRY_CHECKSUM_FILE)
+        _set_state_value(state, "etag", download["etag"])
+        _set_state_value(state, "last_modified", download["last_modified"])
+        state.commit()
+    finally:
+        state.close()
+        if os.path.exists(REGISTRY_DOWNLOAD_FILE):
+            os.remove(REGISTRY_DOWNLOAD_FILE)
+
+    print(f"Sync complete. {stats['inserted']} inserted, {stats['changed']} changed, "
+          f"{stats['deregistered']} deregistered, {stats['unchanged']} unchanged.")
+    return stats
+
+
+class RegcodeIndex:
+    """
+    Compact set of registration numbers, used to join a dataset onto the leads
+
+    Latvian registration numbers are 11 digits, so they are kept as a sorted
+    array of 64-bit integers (8 bytes each) and looked up with a binary
+    search. The few that aren't numeric go into a regular set.
+    """
+
+    def __init__(self, regcodes):
+        numeric = array('q')
+        other = set()
+        for regcode in regcodes:
+            if regcode is None:
+                continue
+            regcode = str(regcode).strip()
+            if regcode.isdigit() and len(regcode) < 19 and not regcode.startswith('0'):
+                numeric.append(int(regcode))
+            elif regcode:
+                other.add(regcode)
+        self._numeric = array('q', sorted(numeric))
+        self._other = frozenset(other)
+
+    @classmethod
+    def from_leads(cls, conn):
+        """Build the index from leads.registration_number, streaming the rows"""
+        cursor = conn.cursor(pymysql.cursors.SSCursor)
+        try:
+            cursor.execute("SELECT registration_number FROM leads")
+            return cls(row[0] for row in cursor)
+        finally:
+            cursor.close()
+
+    def __contains__(self, regcode):
+        regcode = regcode.strip()
+        if regcode.isdigit() and len(regcode) < 19 and not regcode.startswith('0'):
+            value = int(regcode)
+            position = bisect_left(self._numeric, value)
+            return position < len(self._numeric) and self._numeric[position] == value
+        return regcode in self._other
+
+    def __len__(self):
+        return len(self._numeric) + len(self._other)
+
+
+def beneficial_owner_values(row):
+    """
+    Convert a beneficial owners CSV row into the values inserted into the owners table
+
+    Args:
+        row (dict): Row from csv.DictReader over the beneficial owners dataset
+
+    Returns:
+        tuple: (reg_nr, owner_id, forename, surname, nationality, residence,
+        birth_date, registered_on), or None if the row has no registration number
+    """
+    reg_nr = (row.get("legal_entity_registration_number") or "").strip()
+    if not reg_nr:
+        return None
+
+    return (
+        reg_nr,
+        row.get("id") or None,
+        row.get("forename") or None,
+        row.get("surname") or None,
+        row.get("nationality") or None,
+        row.get("residence") or None,
+        row.get("birth_date") or None,
+        row.get("registered_on") or None,
+    )
+
+
+def _read_owner_rows(path, index, stats=None):
+    # Rows of the downloaded file that belong to one of our leads
+    with open_registry_stream(path) as csv_stream:
+        reader = csv.DictReader(csv_stream, delimiter=';', quotechar='"')
+        for row in reader:
+            values = beneficial_owner_values(row)
+            if values is None:
+                continue
+            if values[0] not in index:
+                if stats is not None:
+                    stats["skipped"] += 1
+                continue
+            yield values
+
+
+def _flush_owner_deletes(cursor, regcodes):
+    placeholders = ", ".join(["%s"] * len(regcodes))
+    cursor.execute(f"DELETE FROM beneficial_owners WHERE registration_number IN ({placeholders})", regcodes)
+
+
+def sync_beneficial_owners(url=BENEFICIAL_OWNERS_URL, batch_size=IMPORT_BATCH_SIZE, commit_every=IMPORT_COMMIT_EVERY):
+    """
+    Incrementally sync the beneficial_owners table with the beneficial owners dataset
+
+    Works like sync_registry(): the file is only downloaded when the server
+    reports a change and only processed when its checksum changed. Owners
+    are compared per legal entity, so only the owners of entities whose set
+    of owners changed are rewritten.
+
+    Only owners of entities in the leads table are imported. The join uses a
+    RegcodeIndex of the leads (8 bytes per lead) and one hash per entity
+    instead of a database lookup per row. The file is read twice: once to
+    hash the owners of every entity, and once to write the changed ones in
+    batched multi-row INSERTs.
+
+    Args:
+        url (str): Beneficial owners dataset URL
+        batch_size (int): Number of rows per multi-row INSERT
+        commit_every (int): Number of batches between commits
 
+    Returns:
+        dict: Counts of 'inserted', 'changed', 'deleted' and 'unchanged' entities,
+        'owners' written and rows 'skipped' because their entity isn't a lead
+    """
+    stats = {"inserted": 0, "changed": 0, "deleted": 0, "unchanged": 0, "owners": 0, "skipped": 0}
+    state = open_sync_state(OWNERS_STATE_DB)
+
+    try:
+        download = download_registry_if_changed(state, url, OWNERS_DOWNLOAD_FILE)
+        if download is None:
+            print("Beneficial owners not modified since last sync.")
+            return stats
+
+        has_row_hashes = state.execute("SELECT 1 FROM row_hashes LIMIT 1").fetchone() is not None
+        if has_row_hashes and download["checksum"] == read_registry_checksum(OWNERS_CHECKSUM_FILE):
+            print("Beneficial owners checksum unchanged, nothing to sync.")
+            _set_state_value(state, "etag", download["etag"])
+            _set_state_value(state, "last_modified", download["last_modified"])
+            state.commit()
+            return stats
+
+        conn = pymysql.connect(**DB_CONFIG)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(BENEFICIAL_OWNERS_TABLE)
+            index = RegcodeIndex.from_leads(conn)
+            print(f"Joining beneficial owners onto {len(index)} leads")
+
+            # First pass: one order-independent hash per entity, the sum of its row hashes
+            entity_digests = {}
+            for values in _read_owner_rows(OWNERS_DOWNLOAD_FILE, index, stats):
+                row_digest = int(registry_row_digest(values), 16)
+                entity_digests[values[0]] = (entity_digests.get(values[0], 0) + row_digest) % (1 << 128)
+
+            changed = set()
+            for reg_nr, digest in entity_digests.items():
+                stored = state.execute("SELECT digest FROM row_hashes WHERE regcode = ?", (reg_nr,)).fetchone()
+                if stored is None:
+                    stats["inserted"] += 1
+                elif stored[0] != f"{digest:032x}":
+                    stats["changed"] += 1
+                else:
+                    stats["unchanged"] += 1
+                    continue
+                changed.add(reg_nr)
+
+            # Entities we have owners for that no longer have any
+            known = state.execute("SELECT COUNT(*) FROM row_hashes").fetchone()[0]
+            removed = [r[0] for r in state.execute("SELECT regcode FROM row_hashes") if r[0] not in entity_digests]
+            if removed and len(removed) > known * SYNC_MAX_DELETE_FRACTION:
+                print(f"Refusing to delete the owners of {len(removed)} of {known} entities; "
+                      f"the download may be truncated.")
+                removed = []
+
+            # Clear the old owners of every changed or removed entity...
+            stale = sorted(changed) + removed
+            for start in range(0, len(stale), batch_size):
+                _flush_owner_deletes(cursor, stale[start:start + batch_size])
+
+            # ...then the second pass writes the current owners of the changed ones
+            batch = []
+            batches_since_commit = 0
+            for values in _read_owner_rows(OWNERS_DOWNLOAD_FILE, index):
+                if values[0] not in changed:
+                    continue
+                batch.append(values)
+                if len(batch) < batch_size:
+                    continue
+
+                cursor.executemany(BENEFICIAL_OWNERS_INSERT_QUERY, batch)
+                stats["owners"] += len(batch)
+                batch = []
 
-def search_business_online(business_name, reg_type):
+                batches_since_commit += 1
+                if batches_since_commit >= commit_every:
+                    conn.commit()
+                    batches_since_commit = 0
+
+            if batch:
+                cursor.executemany(BENEFICIAL_OWNERS_INSERT_QUERY, batch)
+                stats["owners"] += len(batch)
+            conn.commit()
+            stats["deleted"] = len(removed)
+
+            # Only record the new hashes once MySQL has everything, so an interrupted sync is redone
+            state.executemany(
+                "INSERT OR REPLACE INTO row_hashes (regcode, digest) VALUES (?, ?)",
+                [(reg_nr, f"{entity_digests[reg_nr]:032x}") for reg_nr in changed]
+            )
+            state.executemany("DELETE FROM row_hashes WHERE regcode = ?", [(reg_nr,) for reg_nr in removed])
+            state.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+        write_registry_checksum(download["checksum"], OWNERS_CHECKSUM_FILE)
+        _set_state_value(state, "etag", download["etag"])
+        _set_state_value(state, "last_modified", download["last_modified"])
+        state.commit()
+    finally:
+        state.close()
+        if os.path.exists(OWNERS_DOWNLOAD_FILE):
+            os.remove(OWNERS_DOWNLOAD_FILE)
+
+    print(f"Beneficial owners sync complete. {stats['inserted']} new, {stats['changed']} changed, "
+          f"{stats['deleted']} removed and {stats['unchanged']} unchanged entities; "
+          f"{stats['owners']} owners written, {stats['skipped']} rows of entities that aren't leads skipped.")
+    return stats
+
+
+def search_business_online(business_name, reg_type, client=None, verify_pool=None, website_budget=None,
+                           social_budget=None, provider=None, domain_memo=None):
     """
     Search for a business online to find social media profiles and website.
     
+    Runs the business through every stage of the enrichment pipeline.
+    
     Args:
         business_name (str): The name of the business
         reg_type (str): The registration type (e.g., SIA)
+        client (HttpClient): Pooled HTTP client to fetch with, the shared default if None
+        verify_pool (Executor): Optional executor used to verify candidates concurrently
+        website_budget (VerificationBudget): Limits on verified websites (candidates, bytes, deadline)
+        social_budget (VerificationBudget): Limits on verified profiles per social media platform
+        provider (SearchProvider): Search provider to discover candidates with, Bing's HTML results if None
+        domain_memo (DomainMemo): Website pages and exclusions shared across searches, a new in-memory one if None
     
     Returns:
         dict: A dictionary containing found social media profiles and website URL
     """
-    results = {
-        'website': None,
-        'social_media': {
-            'facebook': None,
-            'instagram': None,
-            'linkedin': None,
-            'twitter': None
-        }
-    }
-    
-    # Create search queries based on business name and registration type
-    search_queries = [
-        f"{business_name} {reg_type} official website",
-        f"{business_name} {reg_type} contact",
-        f"{business_name} {reg_type} social media"
-    ]
-    
-    # Add the queries without registration type for broader results
-    search_queries.append(f"{business_name} official website")
-    
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    
-    # Social media domain patterns to look for
-    social_media_patterns = {
-        'facebook': r'facebook\.com/[^/"\s\?&#]+',
-        'instagram': r'instagram\.com/[^/"\s\?&#]+',
-        'linkedin': r'linkedin\.com/(?:company|in)/[^/"\s\?&#]+',
-        'twitter': r'(?:twitter\.com|x\.com)/[^/"\s\?&#]+'
-    }
-    
-    # Website pattern (simple pattern, can be improved)
-    website_pattern = rf'{re.escape(business_name.lower())}\.(?:com|lv|eu|net|org|io)'
-    
-    # Exclude patterns for directory/registry sites
-    exclude_patterns = ['lursoft.lv', 'firmas.lv', 'kontakti.lv', 'balticmarket.com', 'company-information', 'wiki', 'facebook.com/pages']
-    
-    # Store potential websites with confidence scores
-    potential_websites = []
-    
-    # Store potential social media profiles
-    potential_social_media = {
-        'facebook': [],
-        'instagram': [],
-        'linkedin': [],
-        'twitter': []
-    }
-    
-    for query in search_queries:
-        # Use Bing search (less restrictive than Google for automated queries)
-        search_url = f"https://www.bing.com/search?q={query.replace(' ', '+')}"
-        
+    work = LeadWork(business_name, reg_type)
+    for work in run_pipeline([work], client, verify_pool, queue_size=0, website_budget=website_budget,
+                             social_budget=social_budget, provider=provider, domain_memo=domain_memo):
+        if work.error is not None:
+            raise RuntimeError(work.error)
+    return work.result
+
+
+# Enrichment results are written back in batches of this many leads...
+RESULT_FLUSH_SIZE = 200
+# ...or at least this often (in seconds) while results keep coming in
+RESULT_FLUSH_INTERVAL = 30
+
+ONLINE_PRESENCE_COLUMNS = ('website', 'facebook', 'linkedin', 'instagram', 'twitter')
+
+
+def online_presence_values(online_data):
+    """
+    Flatten search_business_online results into the leads table's columns
+
+    Returns:
+        tuple: (website, facebook, linkedin, instagram, twitter)
+    """
+    social_media = online_data.get('social_media', {})
+    return (
+        online_data.get('website'),
+        social_media.get('facebook'),
+        social_media.get('linkedin'),
+        social_media.get('instagram'),
+        social_media.get('twitter'),
+    )
+
+
+def confidence_score_value(online_data):
+    """
+    Confidence of a search_business_online result as the leads table stores it
+
+    Returns:
+        int: 0 to 100, or None if the result has no confidence
+    """
+    confidence = online_data.get('confidence')
+    if confidence is None:
+        return None
+    return max(0, min(100, round(confidence * 100)))
+
+
+class EnrichmentResultSink:
+    """
+    Buffers enrichment results and writes them to the leads table in batches
+
+    Holds one connection for its whole lifetime. Buffered results are loaded
+    into a temporary staging table with a multi-row INSERT and applied with a
+    single UPDATE joined on registration_number, once flush_size results are
+    buffered or flush_interval seconds have passed. A lead gets a new
+    confidence_score and last_verified_at only when its search found
+    something or was conclusive, so a blocked search neither zeroes its score
+    nor postpones its next one; a lead that is verified again keeps the
+    website and profiles found before where nothing was found now. Safe to
+    share between worker threads. With complete_jobs=True the matching rows in
+    the enrichment job queue are marked done in the same transaction, so a
+    crash never loses results of jobs that are recorded as finished, and jobs
+    whose search was inconclusive go back to pending with the retry backoff
+    of a failed one. Only then is a lead's website and profiles cleared, once
+    a conclusive search found nothing for the second time in a row: the site
+    is gone, not just blocked.
+
+    Use it as a context manager so remaining results are flushed on exit:
+
+        with EnrichmentResultSink() as sink:
+            sink.add(reg_nr, online_data)
+    """
+
+    def __init__(self, flush_size=RESULT_FLUSH_SIZE, flush_interval=RESULT_FLUSH_INTERVAL, db_config=None,
+                 complete_jobs=False):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        # Also mark the leads' enrichment jobs done, in the same transaction as their results
+        self.complete_jobs = complete_jobs
+        self.conn = pymysql.connect(**(db_config or DB_CONFIG))
+        self.written = 0
+        self._buffer = {}
+        self._lock = threading.RLock()
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, reg_nr, online_data):
+        """
+        Buffer the online presence found for a lead, flushing if the batch is due
+
+        Args:
+            reg_nr (str): Registration number of the lead
+            online_data (dict): Result of search_business_online()
+        """
+        with self._lock:
+            # A later result for the same lead replaces the earlier one
+            self._buffer[reg_nr] = online_presence_values(online_data) + (
+                confidence_score_value(online_data), 1 if online_data.get('conclusive') else 0
+            )
+            if len(self._buffer) >= self.flush_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        """Write all buffered results in one transaction"""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._buffer:
+                return
+
+            rows = [(reg_nr,) + values for reg_nr, values in self._buffer.items()]
+            columns = ', '.join(ONLINE_PRESENCE_COLUMNS)
+            # A search that comes up empty (e.g. blocked) doesn't erase what an earlier one found
+            assignments = ', '.join(f"l.{column} = COALESCE(s.{column}, l.{column})"
+                                    for column in ONLINE_PRESENCE_COLUMNS)
+            found = ' OR '.join(f"s.{column} IS NOT NULL" for column in ONLINE_PRESENCE_COLUMNS)
+            # Only a search that found something or could have found everything says how the lead stands
+            settled = f"({found} OR s.conclusive = 1)"
+
+            # Reconnect if the server dropped us while workers were busy
+            self.conn.ping(reconnect=True)
+            cursor = self.conn.cursor()
+            try:
+                with metrics.span('db_write', table='leads'):
+                    # Temporary tables are per connection, so (re)create it on every flush
+                    cursor.execute("""
+                        CREATE TEMPORARY TABLE IF NOT EXISTS lead_enrichment_staging (
+                            registration_number VARCHAR(255) PRIMARY KEY,
+                            website VARCHAR(255) NULL,
+                            facebook VARCHAR(255) NULL,
+                            linkedin VARCHAR(255) NULL,
+                            instagram VARCHAR(255) NULL,
+                            twitter VARCHAR(255) NULL,
+                            confidence_score TINYINT UNSIGNED NULL,
+                            conclusive TINYINT NOT NULL DEFAULT 0
+                        )
+                    """)
+                    cursor.execute("DELETE FROM lead_enrichment_staging")
+                    cursor.executemany(
+                        f"INSERT INTO lead_enrichment_staging (registration_number, {columns}, confidence_score, "
+                        f"conclusive) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                        rows
+                    )
+                    cursor.execute(f"""
+                        UPDATE leads l
+                        JOIN lead_enrichment_staging s ON l.registration_number = s.registration_number
+                        SET {assignments},
+                            l.confidence_score = IF({settled}, s.confidence_score, l.confidence_score),
+                            l.last_verified_at = IF({settled}, NOW(), l.last_verified_at)
+                    """)
+                    if self.complete_jobs:
+                        clear = ', '.join(f"l.{column} = NULL" for column in ONLINE_PRESENCE_COLUMNS)
+                        # The job still has the outcome of the previous search: a second conclusive search
+                        # that finds nothing means the old website and profiles are gone
+                        cursor.execute(f"""
+                            UPDATE leads l
+                            JOIN lead_enrichment_staging s ON l.registration_number = s.registration_number
+                            JOIN lead_enrichment_jobs j ON j.registration_number = s.registration_number
+                            SET {clear}
+                            WHERE s.conclusive = 1 AND NOT ({found}) AND j.outcome = 'not_found'
+                        """)
+                        # Inconclusive searches are retried like failed ones, see EnrichmentQueue.fail()
+                        cursor.execute(f"""
+                            UPDATE lead_enrichment_jobs j
+                            JOIN lead_enrichment_staging s ON j.registration_number = s.registration_number
+                            SET j.status = IF({settled}, 'done', IF(j.attempts >= %s, 'failed', 'pending')),
+                                j.outcome = IF({found}, 'found',
+                                               IF(s.conclusive = 1, 'not_found', IF(j.attempts >= %s, 'error', j.outcome))),
+                                j.next_attempt_at = IF({settled}, j.next_attempt_at,
+                                                       NOW() + INTERVAL (%s * POW(2, j.attempts - 1)) SECOND),
+                                j.lease_owner = NULL,
+                                j.lease_expires_at = NULL,
+                                j.last_error = IF({settled}, NULL, 'inconclusive search')
+                        """, (JOB_MAX_ATTEMPTS, JOB_MAX_ATTEMPTS, JOB_RETRY_BACKOFF))
+                    self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+            metrics.inc('db_rows_written', len(rows), table='leads')
+            self.written += len(rows)
+            self._buffer.clear()
+
+    def close(self):
         try:
-            response = requests.get(search_url, headers=headers)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Extract all links from the search results
-                links = soup.find_all('a', href=True)
-                for link in links:
-                    href = link['href']
-                    
-                    # Skip excluded sites
-                    if any(pattern in href.lower() for pattern in exclude_patterns):
-                        continue
-                    
-                    # Check for social media profiles
-                    for platform, pattern in social_media_patterns.items():
-                        match = re.search(pattern, href, re.IGNORECASE)
-                        if match:
-                            full_url = match.group(0)
-                            if not full_url.startswith('http'):
-                                full_url = f"https://{full_url}"
-                                
-                            # Add to potential social media with priority
-                            # Priority depends on the search query - first query has highest priority
-                            priority = len(search_queries) - search_queries.index(query)
-                            
-                            # Higher priority if link text contains business name
-                            link_text = link.text.lower()
-                            if business_name.lower() in link_text:
-                                priority += 2
-                                
-                            potential_social_media[platform].append({
-                                'url': full_url,
-                                'priority': priority,
-                                'link_text': link_text
-                            })
-                    
-                    # Check for potential website
-                    # First check if there's a domain that matches the business name
-                    website_match = re.search(website_pattern, href, re.IGNORECASE)
-                    if website_match and not any(ex in href.lower() for ex in exclude_patterns):
-                        # Extract the full domain
-                        full_domain_match = re.search(r'https?://[^/\s]+', href)
-                        if full_domain_match:
-                            potential_websites.append({
-                                'url': full_domain_match.group(0),
-                                'priority': 3,  # High priority for direct name matches
-                                'link_text': link.text
-                            })
-                    # As a fallback, look for any link that might be a corporate website
-                    elif business_name.lower() in href.lower() and not any(sm in href.lower() for sm in ['facebook', 'instagram', 'linkedin', 'twitter', 'x.com'] + exclude_patterns):
-                        full_domain_match = re.search(r'https?://[^/\s]+', href)
-                        if full_domain_match:
-                            potential_websites.append({
-                                'url': full_domain_match.group(0),
-                                'priority': 2,  # Medium priority for partial name matches
-                                'link_text': link.text
-                            })
-                    # Consider links where the text strongly matches the business name
-                    elif business_name.lower() in link.text.lower() and re.search(r'https?://[^/\s]+', href) and not any(ex in href.lower() for ex in exclude_patterns + ['facebook', 'instagram', 'linkedin', 'twitter', 'x.com']):
-                        full_domain_match = re.search(r'https?://[^/\s]+', href)
-                        if full_domain_match:
-                            potential_websites.append({
-                                'url': full_domain_match.group(0),
-                                'priority': 2,  # Medium priority for name in link text
-                                'link_text': link.text
-                            })
-                    # Collect other domain results from top search results
-                    elif re.search(r'https?://[^/\s]+', href) and not any(pattern in href.lower() for pattern in exclude_patterns + ['facebook', 'instagram', 'linkedin', 'twitter', 'x.com', 'bing', 'google', 'yahoo']):
-                        full_domain_match = re.search(r'https?://[^/\s]+', href)
-                        if full_domain_match:
-                            # Don't include search engines or common sites
-                            domain = full_domain_match.group(0).lower()
-                            if not any(site in domain for site in ['google', 'bing', 'yahoo', 'wikipedia', 'youtube']):
-                                potential_websites.append({
-                                    'url': full_domain_match.group(0),
-                                    'priority': 1,  # Low priority for general results
-                                    'link_text': link.text
-                                })
-            
-            # Prevent rate limiting by adding a small delay between requests
-            time.sleep(random.uniform(1.0, 3.0))
-            
-        except Exception as e:
-            print(f"Error searching for {query}: {str(e)}")
-    
-    # Process websites
-    # Remove duplicates and sort by priority
-    unique_websites = []
-    seen_domains = set()
-    
-    for site in sorted(potential_websites, key=lambda x: x['priority'], reverse=True):
-        domain = re.sub(r'https?://', '', site['url'].lower())
-        domain = re.sub(r'^www\.', '', domain)  # Remove www prefix
-        domain = re.sub(r'/.*$', '', domain)  # Remove everything after domain
-        
-        if domain not in seen_domains:
-            seen_domains.add(domain)
-            unique_websites.append(site)
-    
-    print(f"Found {len(unique_websites)} unique potential websites")
-    
-    # Verify top 3 website candidates
-    verified_websites = []
-    
-    for i, site in enumerate(unique_websites[:5]):  # Check top 5 sites
-        if i >= 5:  # Limit to top 5 to avoid too many requests
-            break
-        
-        print(f"Verifying website {i+1}/{min(5, len(unique_websites))}: {site['url']}")
-        print(f"  Link text: {site['link_text']}")
-        
-        confidence = verify_website_ownership(site['url'], business_name, reg_type)
-        verified_websites.append({
-            'url': site['url'],
-            'confidence': confidence,
-            'priority': site['priority']
-        })
-        print(f"  Confidence: {confidence:.2f}")
-    
-    # Choose the best website based on verification score and priority
-    if verified_websites:
-        # First check if any site has high confidence
-        high_confidence_sites = [site for site in verified_websites if site['confidence'] > 0.6]
-        if high_confidence_sites:
-            best_site = max(high_confidence_sites, key=lambda x: (x['confidence'], x['priority']))
-            results['website'] = best_site['url']
-            print(f"Selected website with high confidence {best_site['confidence']:.2f}: {best_site['url']}")
-        else:
-            # Fall back to highest scoring site if it has minimum confidence
-            best_site = max(verified_websites, key=lambda x: (x['confidence'], x['priority']))
-            if best_site['confidence'] > 0.2:  # Lower minimum threshold
-                results['website'] = best_site['url']
-                print(f"Selected website with moderate confidence {best_site['confidence']:.2f}: {best_site['url']}")
-            else:
-                print("No website passed the minimum confidence threshold")
-    
-    # Process social media
-    # For each platform, deduplicate and verify
-    for platform in potential_social_media:
-        if not potential_social_media[platform]:
-            continue
-            
-        # Remove duplicates
-        unique_urls = []
-        seen_urls = set()
-        
-        for profile in sorted(potential_social_media[platform], key=lambda x: x['priority'], reverse=True):
-            # Normalize URL for comparison
-            normalized_url = re.sub(r'https?://(www\.)?', '', profile['url'].lower())
-            normalized_url = re.sub(r'/+$', '', normalized_url)  # Remove trailing slashes
-            normalized_url = re.sub(r'\?.*$', '', normalized_url)  # Remove query parameters
-            
-            if normalized_url not in seen_urls:
-                seen_urls.add(normalized_url)
-                unique_urls.append(profile)
-        
-        if unique_urls:
-            print(f"Found {len(unique_urls)} unique {platform} profiles")
-            
-            # Check top 3 profiles
-            for i, profile in enumerate(unique_urls[:3]):
-                if i >= 3:  # Limit to top 3
-                    break
-                
-                print(f"Checking {platform} profile {i+1}/{min(3, len(unique_urls))}: {profile['url']}")
-                print(f"  Link text: {profile['link_text']}")
-                
-                try:
-                    confidence = verify_social_media(profile['url'], business_name, reg_type)
-                    print(f"  Confidence: {confidence:.2f}")
-                    
-                    # Add if confidence meets threshold
-                    if confidence > 0.4:
-                        results['social_media'][platform] = profile['url']
-                        print(f"Selected {platform} profile with confidence {confidence:.2f}")
-                        break  # Found a good profile, stop checking others
-                except Exception as e:
-                    print(f"Error verifying {platform} profile: {str(e)}")
-                    # Default to using the top profile if verification fails
-                    results['social_media'][platform] = profile['url']
-                    print(f"Selected {platform} profile (verification failed)")
-                    break
-    
-    # Clean up social media URLs - make sure they have proper http prefix
-    for platform in results['social_media']:
-        if results['social_media'][platform] and not results['social_media'][platform].startswith('http'):
-            results['social_media'][platform] = 'https://' + results['social_media'][platform]
-    
-    # Clean up results - remove None values from social media dict
-    results['social_media'] = {k: v for k, v in results['social_media'].items() if v is not None}
-    
-    return results
+            self.flush()
+        finally:
+            self.conn.close()
+
+
+# Leased jobs not finished within this many seconds are handed to another worker
+JOB_LEASE_SECONDS = 15 * 60
+# Failed jobs are retried after JOB_RETRY_BACKOFF * 2^(attempts - 1) seconds...
+JOB_RETRY_BACKOFF = 10 * 60
+# ...until they have been attempted this many times
+JOB_MAX_ATTEMPTS = 3
+# Leads verified longer ago than this are searched again...
+STALE_AFTER_DAYS = 180
+# ...and leads found with a confidence_score below LOW_CONFIDENCE_SCORE already after this many days
+LOW_CONFIDENCE_AFTER_DAYS = 30
+LOW_CONFIDENCE_SCORE = 40
+
+ENRICHMENT_JOBS_TABLE = """
+    CREATE TABLE IF NOT EXISTS lead_enrichment_jobs (
+        registration_number VARCHAR(255) NOT NULL PRIMARY KEY,
+        status VARCHAR(16) NOT NULL DEFAULT 'pending',
+        attempts INT UNSIGNED NOT NULL DEFAULT 0,
+        last_attempt_at TIMESTAMP NULL,
+        next_attempt_at TIMESTAMP NULL,
+        lease_owner VARCHAR(64) NULL,
+        lease_expires_at TIMESTAMP NULL,
+        outcome VARCHAR(16) NULL,
+        last_error TEXT NULL,
+        priority INT NOT NULL DEFAULT 0,
+        active TINYINT NULL,
+        INDEX idx_lead_enrichment_jobs_status (status, next_attempt_at),
+        INDEX idx_lead_enrichment_jobs_owner (lease_owner),
+        INDEX idx_lead_enrichment_jobs_priority (status, priority)
+    )
+"""
+
+
+class LeadPriority:
+    """
+    Order in which queued leads are searched, so search quota goes to the leads that matter
+
+    A job's priority is the sum of:
+
+    - never_verified if the lead was never searched;
+    - per_stale_day for every day since it was last verified, up to max_stale_days;
+    - per_missing_point for every point its confidence_score is below 100
+      (a lead without a score, or whose last search found nothing, adds nothing);
+    - active_boost if its company is active in the register snapshot.
+
+    With the defaults never-verified leads always come first, then the
+    stalest ones, with low confidence and active companies moving a lead up
+    by up to 200 and 100 days respectively.
+    """
+
+    def __init__(self, never_verified=1000, per_stale_day=1, max_stale_days=365, per_missing_point=2,
+                 active_boost=100):
+        """
+        Args:
+            never_verified (int): Priority of a lead that was never searched
+            per_stale_day (int): Priority per day since the last verification...
+            max_stale_days (int): ...counting at most this many days
+            per_missing_point (int): Priority per confidence_score point below 100
+            active_boost (int): Priority added for active companies
+        """
+        # Whole numbers only, they are written into the SQL
+        self.never_verified = int(never_verified)
+        self.per_stale_day = int(per_stale_day)
+        self.max_stale_days = int(max_stale_days)
+        self.per_missing_point = int(per_missing_point)
+        self.active_boost = int(active_boost)
+
+    def sql(self):
+        """The priority as an SQL expression over leads l and lead_enrichment_jobs j"""
+        # Leads verified before confidence was recorded have only their job's last attempt
+        verified_at = "COALESCE(l.last_verified_at, j.last_attempt_at)"
+        return f"""
+            IF({verified_at} IS NULL, {self.never_verified},
+               LEAST(TIMESTAMPDIFF(DAY, {verified_at}, NOW()), {self.max_stale_days}) * {self.per_stale_day})
+            + IF(j.outcome = 'not_found', 0, 100 - COALESCE(l.confidence_score, 100)) * {self.per_missing_point}
+            + IF(j.active = 1, {self.active_boost}, 0)
+        """
+
+
+DEFAULT_LEAD_PRIORITY = LeadPriority()
+
+
+class EnrichmentQueue:
+    """
+    Durable queue of leads waiting for online presence enrichment
+
+    Backed by the lead_enrichment_jobs table, with one row per lead holding
+    its status (pending, leased, done or failed), attempt count, last attempt
+    time and outcome. Workers lease batches of jobs; a lease that isn't
+    completed in time (because the worker crashed) expires and the jobs are
+    handed out again. Failed jobs are retried with exponential backoff up to
+    max_attempts times. Leads whose job is done, including those where
+    nothing was found, are only picked up again by enqueue_stale() once their
+    verification is stale. Jobs are leased highest priority first, as set by
+    prioritize().
+    """
+
+    def __init__(self, conn=None, lease_seconds=JOB_LEASE_SECONDS, retry_backoff=JOB_RETRY_BACKOFF,
+                 max_attempts=JOB_MAX_ATTEMPTS, shard=0, shard_count=1, priority=None):
+        """
+        Args:
+            conn: pymysql connection to use, a new one is opened if None
+            lease_seconds (int): How long a worker may hold leased jobs
+            retry_backoff (int): Base delay in seconds before retrying a failed job
+            max_attempts (int): Attempts after which a job is marked failed
+            shard (int): Only lease jobs whose registration number hashes to this shard...
+            shard_count (int): ...out of this many shards
+            priority (LeadPriority): How prioritize() orders the jobs, DEFAULT_LEAD_PRIORITY if None
+        """
+        self.conn = conn or pymysql.connect(**DB_CONFIG)
+        self.lease_seconds = lease_seconds
+        self.retry_backoff = retry_backoff
+        self.max_attempts = max_attempts
+        self.shard = shard
+        self.shard_count = shard_count
+        self.priority = priority or DEFAULT_LEAD_PRIORITY
+        # Identifies this worker's leases
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        cursor = self.conn.cursor()
+        cursor.execute(ENRICHMENT_JOBS_TABLE)
+        cursor.execute("SHOW COLUMNS FROM lead_enrichment_jobs LIKE 'priority'")
+        if cursor.fetchone() is None:
+            # The table was created before jobs were prioritized
+            cursor.execute("""
+                ALTER TABLE lead_enrichment_jobs
+                    ADD COLUMN priority INT NOT NULL DEFAULT 0,
+                    ADD COLUMN active TINYINT NULL,
+                    ADD INDEX idx_lead_enrichment_jobs_priority (status, priority)
+            """)
+        self.conn.commit()
+        cursor.close()
+
+    def enqueue_missing(self):
+        """
+        Add a job for every lead without any online presence that has no job yet
+
+        Returns:
+            int: Number of jobs added
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            INSERT IGNORE INTO lead_enrichment_jobs (registration_number)
+            SELECT registration_number
+            FROM leads
+            WHERE registration_number IS NOT NULL AND deregistered_at IS NULL
+                  AND website IS NULL AND facebook IS NULL AND linkedin IS NULL
+                  AND instagram IS NULL AND twitter IS NULL
+        """)
+        added = cursor.rowcount
+        self.conn.commit()
+        cursor.close()
+        return added
+
+    def enqueue(self, registration_numbers, batch_size=IMPORT_BATCH_SIZE):
+        """
+        Add a job for the given leads, if they have no online presence and no job yet
+
+        Args:
+            registration_numbers (iterable): Registration numbers to queue
+            batch_size (int): Registration numbers per statement
+
+        Returns:
+            int: Number of jobs added
+        """
+        registration_numbers = list(registration_numbers)
+        added = 0
+        cursor = self.conn.cursor()
+        for start in range(0, len(registration_numbers), batch_size):
+            chunk = registration_numbers[start:start + batch_size]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(f"""
+                INSERT IGNORE INTO lead_enrichment_jobs (registration_number)
+                SELECT registration_number
+                FROM leads
+                WHERE registration_number IN ({placeholders}) AND deregistered_at IS NULL
+                      AND website IS NULL AND facebook IS NULL AND linkedin IS NULL
+                      AND instagram IS NULL AND twitter IS NULL
+            """, chunk)
+            added += cursor.rowcount
+        self.conn.commit()
+        cursor.close()
+        return added
+
+    def enqueue_stale(self, stale_after_days=STALE_AFTER_DAYS, low_confidence_after_days=LOW_CONFIDENCE_AFTER_DAYS,
+                      low_confidence_score=LOW_CONFIDENCE_SCORE):
+        """
+        Queue finished leads again once their verification is stale
+
+        Args:
+            stale_after_days (int): Days after which every lead is verified again
+            low_confidence_after_days (int): Days after which a lead found with low confidence is verified again
+            low_confidence_score (int): confidence_score below which a found lead counts as low confidence
+
+        Returns:
+            int: Number of jobs queued again
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            UPDATE lead_enrichment_jobs j
+            JOIN leads l ON l.registration_number = j.registration_number
+            SET j.status = 'pending',
+                j.attempts = 0,
+                j.next_attempt_at = NULL,
+                j.last_error = NULL
+            WHERE j.status IN ('done', 'failed') AND l.deregistered_at IS NULL
+              AND (COALESCE(l.last_verified_at, j.last_attempt_at) < NOW() - INTERVAL %s DAY
+                   OR (l.confidence_score > 0 AND l.confidence_score < %s
+                       AND COALESCE(l.last_verified_at, j.last_attempt_at) < NOW() - INTERVAL %s DAY))
+        """, (stale_after_days, low_confidence_score, low_confidence_after_days))
+        requeued = cursor.rowcount
+        self.conn.commit()
+        cursor.close()
+        return requeued
+
+    def prioritize(self, snapshot_path=REGISTER_SNAPSHOT_DIR, batch_size=IMPORT_BATCH_SIZE):
+        """
+        Compute the priority of every pending job
+
+        Jobs whose company isn't known to be active or not yet are looked up
+        in the register snapshot first, if there is one.
+
+        Args:
+            snapshot_path (str): Register snapshot directory, None to skip the lookup
+            batch_size (int): Registration numbers per statement
+
+        Returns:
+            int: Number of pending jobs
+        """
+        cursor = self.conn.cursor()
+        if snapshot_path is not None and os.path.exists(os.path.join(snapshot_path, 'meta.json')):
+            cursor.execute("""
+                SELECT registration_number FROM lead_enrichment_jobs
+                WHERE status = 'pending' AND active IS NULL
+            """)
+            unknown = [reg_nr for (reg_nr,) in cursor.fetchall()]
+            found = {1: [], 0: []}
+            with RegisterSnapshot(snapshot_path) as snapshot:
+                for reg_nr in unknown:
+                    row = snapshot.lookup(reg_nr)
+                    # Leads that aren't in the register stay unknown
+                    if row is not None:
+                        found[int(snapshot.is_active(row))].append(reg_nr)
+            for active, registration_numbers in found.items():
+                for start in range(0, len(registration_numbers), batch_size):
+                    chunk = registration_numbers[start:start + batch_size]
+                    placeholders = ", ".join(["%s"] * len(chunk))
+                    cursor.execute(
+                        f"UPDATE lead_enrichment_jobs SET active = %s WHERE registration_number IN ({placeholders})",
+                        [active] + chunk
+                    )
+            self.conn.commit()
+
+        cursor.execute(f"""
+            UPDATE lead_enrichment_jobs j
+            JOIN leads l ON l.registration_number = j.registration_number
+            SET j.priority = {self.priority.sql()}
+            WHERE j.status = 'pending'
+        """)
+        self.conn.commit()
+        cursor.execute("SELECT COUNT(*) FROM lead_enrichment_jobs WHERE status = 'pending'")
+        (pending,) = cursor.fetchone()
+        cursor.close()
+        return pending
+
+    def lease(self, count):
+        """
+        Lease up to `count` jobs that are due, highest priority first, including jobs whose lease expired
+
+        Args:
+            count (int): Maximum number of jobs to lease
+
+        Returns:
+            list: (business_name, reg_type, registration_number) tuples
+        """
+        cursor = self.conn.cursor()
+        # Claim the rows in one statement so concurrent workers never lease the same job
+        with metrics.span('db_write', table='lead_enrichment_jobs'):
+            cursor.execute("""
+                UPDATE lead_enrichment_jobs
+                SET status = 'leased',
+                    lease_owner = %s,
+                    lease_expires_at = NOW() + INTERVAL %s SECOND,
+                    attempts = attempts + 1,
+                    last_attempt_at = NOW()
+                WHERE ((status = 'pending' AND (next_attempt_at IS NULL OR next_attempt_at <= NOW()))
+                       OR (status = 'leased' AND lease_expires_at < NOW()))
+                  AND CRC32(registration_number) %% %s = %s
+                  AND EXISTS (SELECT 1 FROM leads l
+                              WHERE l.registration_number = lead_enrichment_jobs.registration_number
+                                    AND l.deregistered_at IS NULL)
+                ORDER BY priority DESC, attempts, next_attempt_at
+                LIMIT %s
+            """, (self.owner, self.lease_seconds, self.shard_count, self.shard, count))
+            self.conn.commit()
+
+        cursor.execute("""
+            SELECT l.business_name, l.reg_type, j.registration_number
+            FROM lead_enrichment_jobs j
+            JOIN leads l ON l.registration_number = j.registration_number AND l.deregistered_at IS NULL
+            WHERE j.lease_owner = %s AND j.status = 'leased'
+        """, (self.owner,))
+        jobs = cursor.fetchall()
+        cursor.close()
+        return list(jobs)
+
+    def fail(self, reg_nr, error):
+        """
+        Record a failed attempt, scheduling a retry or giving up after max_attempts
+
+        Args:
+            reg_nr (str): Registration number of the lead
+            error (str): Description of what went wrong
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            UPDATE lead_enrichment_jobs
+            SET status = IF(attempts >= %s, 'failed', 'pending'),
+                outcome = IF(attempts >= %s, 'error', outcome),
+                next_attempt_at = NOW() + INTERVAL (%s * POW(2, attempts - 1)) SECOND,
+                lease_owner = NULL,
+                lease_expires_at = NULL,
+                last_error = %s
+            WHERE registration_number = %s AND lease_owner = %s
+        """, (self.max_attempts, self.max_attempts, self.retry_backoff, str(error)[:1000], reg_nr, self.owner))
+        self.conn.commit()
+        cursor.close()
+
+    def release(self):
+        """Hand this worker's unfinished jobs back without counting the attempt"""
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            UPDATE lead_enrichment_jobs
+            SET status = 'pending',
+                attempts = GREATEST(attempts, 1) - 1,
+                lease_owner = NULL,
+                lease_expires_at = NULL
+            WHERE lease_owner = %s AND status = 'leased'
+        """, (self.owner,))
+        self.conn.commit()
+        cursor.close()
+
+    def stats(self):
+        """Return the number of jobs per status"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT status, COUNT(*) FROM lead_enrichment_jobs GROUP BY status")
+        counts = dict(cursor.fetchall())
+        cursor.close()
+        return counts
+
+
+def snapshot_registry(source=REGISTRY_URL, path=REGISTER_SNAPSHOT_DIR):
+    """
+    Convert the register into a columnar snapshot for fast offline re-processing
+
+    Args:
+        source (str): URL of the register or path to a local copy of it
+        path (str): Snapshot directory to write
+
+    Returns:
+        int: Number of rows in the snapshot
+    """
+    with open_registry_stream(source) as csv_stream:
+        rows = build_snapshot(csv_stream, path)
+    print(f"Snapshot of {rows} rows written to {path}")
+    return rows
+
+
+def enqueue_snapshot_selection(reg_type=None, founded_after=None, active=True, path=REGISTER_SNAPSHOT_DIR):
+    """
+    Queue enrichment jobs for the leads selected from the register snapshot
+
+    For example, all active SIAs founded after 2015 that have no website or
+    social media profile yet: enqueue_snapshot_selection('SIA', 2015).
+
+    Args:
+        reg_type (str): Register type to select, None for every type
+        founded_after (int): Only leads registered after this year, None for any
+        active (bool): Only leads that aren't closed or terminated, None for all
+        path (str): Snapshot directory written by snapshot_registry()
+
+    Returns:
+        int: Number of jobs added
+    """
+    with RegisterSnapshot(path) as snapshot:
+        rows = snapshot.select(reg_type=reg_type, active=active, founded_after=founded_after)
+        registration_numbers = [snapshot.value('regcode', row) for row in rows]
+    print(f"Selected {len(registration_numbers)} rows from the register snapshot")
+
+    conn = pymysql.connect(**DB_CONFIG)
+    try:
+        added = EnrichmentQueue(conn).enqueue(registration_numbers)
+    finally:
+        conn.close()
+    print(f"Queued {added} leads without online presence for enrichment")
+    return added
 
 
 def update_business_online_presence(business_name, reg_type, reg_nr, online_data):
     """
     Update the database with the found online presence data for a business
+
+    For more than a handful of businesses use an EnrichmentResultSink, which
+    batches the writes over one connection.
     
     Args:
         business_name (str): Business name
@@ -495,21 +1260,15 @@ def update_business_online_presence(business_name, reg_type, reg_nr, online_data
     conn = pymysql.connect(**DB_CONFIG)
     cursor = conn.cursor()
     
-    website = online_data.get('website')
-    
-    # Extract individual social media URLs
-    facebook = online_data.get('social_media', {}).get('facebook')
-    linkedin = online_data.get('social_media', {}).get('linkedin')
-    instagram = online_data.get('social_media', {}).get('instagram')
-    twitter = online_data.get('social_media', {}).get('twitter')
-    
     update_query = """
         UPDATE leads
-        SET website = %s, facebook = %s, linkedin = %s, instagram = %s, twitter = %s
+        SET website = COALESCE(%s, website), facebook = COALESCE(%s, facebook), linkedin = COALESCE(%s, linkedin),
+            instagram = COALESCE(%s, instagram), twitter = COALESCE(%s, twitter),
+            confidence_score = %s, last_verified_at = NOW()
         WHERE registration_number = %s
     """
     
-    cursor.execute(update_query, (website, facebook, linkedin, instagram, twitter, reg_nr))
+    cursor.execute(update_query, online_presence_values(online_data) + (confidence_score_value(online_data), reg_nr))
     conn.commit()
     cursor.close()
     conn.close()
@@ -518,35 +1277,20 @@ def update_business_online_presence(business_name, reg_type, reg_nr, online_data
 def import_csv_to_db(csv_file_like):
     conn = pymysql.connect(**DB_CONFIG)
     cursor = conn.cursor()
+    require_registry_schema(cursor)
 
     reader = csv.DictReader(csv_file_like, delimiter=';', quotechar='"')
 
-    insert_query = """
-        INSERT INTO leads (business_name, reg_type, registration_number, address, founded_date)
-        VALUES (%s, %s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE
-            business_name = VALUES(business_name),
-            reg_type = VALUES(reg_type),
-            registration_number = VALUES(registration_number),
-            address = VALUES(address),
-            founded_date = VALUES(founded_date)
-    """
-
     for i, row in enumerate(reader):
         if i >= 20:
             break
 
-        name = row.get("name_in_quotes")
-        reg_type = row.get("type")
-        reg_nr = row.get("regcode")
-        address = row.get("address")
-        raw_founded_date = row.get("registered")
-        founded_date = raw_founded_date if raw_founded_date else None
-
-        if not name or not reg_nr:
+        values = registry_row_values(row)
+        if values is None:
             continue
 
-        cursor.execute(insert_query, (name, reg_type, reg_nr, address, founded_date))
+        name, reg_type, reg_nr, address, founded_date = values
+        cursor.execute(REGISTRY_INSERT_QUERY, values)
         
         # Optionally, search for online presence for each business
         # Uncomment the following lines to enable online searching during import
@@ -560,63 +1304,407 @@ def import_csv_to_db(csv_file_like):
     print("Import complete.")
 
 
-def search_businesses_online(limit=10):
+def stream_import_csv_to_db(csv_file_like, batch_size=IMPORT_BATCH_SIZE, commit_every=IMPORT_COMMIT_EVERY):
     """
-    Search for businesses' online presence from the database
-    
+    Import the whole register, writing rows in multi-row batches as they are parsed
+
+    Only one batch of rows is held in memory at a time, so memory use does not
+    grow with the size of the register.
+
     Args:
-        limit (int): Maximum number of businesses to process
+        csv_file_like: Text stream of the register, e.g. from open_registry_stream()
+        batch_size (int): Number of rows per multi-row INSERT
+        commit_every (int): Number of batches between commits
+
+    Returns:
+        int: Number of rows written
+    """
+    reader = csv.DictReader(csv_file_like, delimiter=';', quotechar='"')
+    return import_registry_rows(reader, batch_size, commit_every)
+
+
+def import_snapshot_to_db(path=REGISTER_SNAPSHOT_DIR, rows=None, batch_size=IMPORT_BATCH_SIZE,
+                          commit_every=IMPORT_COMMIT_EVERY):
+    """
+    Import the register from a columnar snapshot instead of the CSV
+
+    Args:
+        path (str): Snapshot directory written by snapshot_registry()
+        rows (iterable): Row numbers to import, e.g. from RegisterSnapshot.select(); all rows if None
+        batch_size (int): Number of rows per multi-row INSERT
+        commit_every (int): Number of batches between commits
+
+    Returns:
+        int: Number of rows written
+    """
+    with RegisterSnapshot(path) as snapshot:
+        return import_registry_rows(snapshot.iter_rows(rows), batch_size, commit_every)
+
+
+def import_registry_rows(rows, batch_size=IMPORT_BATCH_SIZE, commit_every=IMPORT_COMMIT_EVERY):
+    """
+    Write register rows to the leads table in multi-row batches
+
+    Args:
+        rows (iterable): Rows as dicts with the register's column names
+        batch_size (int): Number of rows per multi-row INSERT
+        commit_every (int): Number of batches between commits
+
+    Returns:
+        int: Number of rows written
     """
     conn = pymysql.connect(**DB_CONFIG)
     cursor = conn.cursor()
+
+    batch = []
+    batches_since_commit = 0
+    total = 0
+
+    try:
+        require_registry_schema(cursor)
+        for row in rows:
+            values = registry_row_values(row)
+            if values is None:
+                continue
+
+            batch.append(values)
+            if len(batch) < batch_size:
+                continue
+
+            # pymysql rewrites INSERT ... VALUES with executemany into a single multi-row statement
+            cursor.executemany(REGISTRY_INSERT_QUERY, batch)
+            total += len(batch)
+            batch = []
+
+            batches_since_commit += 1
+            if batches_since_commit >= commit_every:
+                conn.commit()
+                batches_since_commit = 0
+                print(f"Imported {total} rows...")
+
+        if batch:
+            cursor.executemany(REGISTRY_INSERT_QUERY, batch)
+            total += len(batch)
+
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+    print(f"Import complete. {total} rows written.")
+    return total
+
+
+def enrich_businesses_concurrently(businesses, workers=8, verify_workers=16, client=None, domain_memo=None):
+    """
+    Run search_business_online for many businesses at once
+
+    Businesses are searched in a bounded pool of worker threads and their
+    candidate websites and profiles are verified in a second pool, so a slow
+    site only holds up its own business. All workers share one HttpClient, so
+    connections are reused and requests to the same host are paced by its
+    RequestScheduler instead of fixed sleeps.
+
+    Args:
+        businesses (iterable): (business_name, reg_type, registration_number) tuples
+        workers (int): Maximum number of businesses searched at once
+        verify_workers (int): Maximum number of candidate verifications at once
+        client (HttpClient): Pooled HTTP client to fetch with, the shared default if None
+        domain_memo (DomainMemo): Website pages and exclusions shared by the searches, a new in-memory one if None
+
+    Yields:
+        tuple: (business, online_data) in completion order
+    """
+    if domain_memo is None:
+        domain_memo = DomainMemo(path=None)
+    # One provider for the whole run, so leads with the same name share their searches
+    provider = BingHtmlProvider(client) if client is not None else None
+    with ThreadPoolExecutor(max_workers=verify_workers) as verify_pool, \
+            ThreadPoolExecutor(max_workers=workers) as search_pool:
+        futures = {
+            search_pool.submit(search_business_online, business[0], business[1], client, verify_pool,
+                               provider=provider, domain_memo=domain_memo): business
+            for business in businesses
+        }
+        for future in as_completed(futures):
+            business = futures[future]
+            try:
+                online_data = future.result()
+            except Exception as e:
+                print(f"Error searching for {business[0]}: {str(e)}")
+                continue
+            yield business, online_data
+
+
+def drain_enrichment_queue(queue, sink, limit=None, workers=1, batch_size=None, progress=None, domain_memo=None):
+    """
+    Lease jobs from the enrichment queue, search them and checkpoint the results
+
+    Args:
+        queue (EnrichmentQueue): Queue to take jobs from
+        sink (EnrichmentResultSink): Sink with complete_jobs=True to write results to
+        limit (int): Maximum number of businesses to process, None to drain the queue
+        workers (int): Number of businesses to search concurrently (1 searches them one by one)
+        batch_size (int): Jobs leased (and checkpointed) at a time, defaults to 4 per worker
+        progress (callable): Called with 'found', 'not_found' or 'error' for every processed lead
+        domain_memo (DomainMemo): Website pages and exclusions shared by all batches, a new in-memory one if None
+
+    Returns:
+        int: Number of leases processed
+    """
+    if batch_size is None:
+        batch_size = max(1, workers * 4)
+    if domain_memo is None:
+        domain_memo = DomainMemo(path=None)
     
-    # Select businesses without website information
-    query = """
-        SELECT business_name, reg_type, registration_number
-        FROM leads
-        WHERE website IS NULL AND facebook IS NULL AND linkedin IS NULL 
-              AND instagram IS NULL AND twitter IS NULL
-        LIMIT %s
+    processed = 0
+    try:
+        while limit is None or processed < limit:
+            count = batch_size if limit is None else min(batch_size, limit - processed)
+            businesses = queue.lease(count)
+            if not businesses:
+                break
+            
+            if workers > 1:
+                results = enrich_businesses_concurrently(businesses, workers=workers, verify_workers=workers * 2,
+                                                         domain_memo=domain_memo)
+            else:
+                results = _search_businesses_sequentially(businesses, domain_memo)
+            
+            finished = set()
+            for business, online_data in results:
+                name, reg_type, reg_nr = business
+                sink.add(reg_nr, online_data)
+                finished.add(reg_nr)
+                
+                # Print found results
+                print(f"Results for: {name} ({reg_type})")
+                if online_data['website']:
+                    print(f"  Website: {online_data['website']}")
+                
+                # Print individual social media accounts
+                if online_data['social_media']:
+                    print("  Social media:")
+                    for platform, url in online_data['social_media'].items():
+                        print(f"    {platform.capitalize()}: {url}")
+                
+                if progress is not None:
+                    if online_data['website'] or online_data['social_media']:
+                        progress('found')
+                    else:
+                        # An inconclusive search goes back to the queue, like a failed one
+                        progress('not_found' if online_data.get('conclusive') else 'error')
+            
+            # Checkpoint: results and job completion are committed together
+            sink.flush()
+            for name, reg_type, reg_nr in businesses:
+                if reg_nr not in finished:
+                    queue.fail(reg_nr, "search failed")
+                    if progress is not None:
+                        progress('error')
+            processed += len(businesses)
+    except KeyboardInterrupt:
+        # Keep what's finished and hand the rest of the batch back for the next run
+        sink.flush()
+        queue.release()
+        raise
+    
+    return processed
+
+
+def prepare_enrichment_queue(queue):
+    """
+    Queue new and stale leads and prioritize everything that is pending
+
+    Args:
+        queue (EnrichmentQueue): Queue to fill
     """
+    added = queue.enqueue_missing()
+    if added:
+        print(f"Queued {added} new leads for enrichment")
+    requeued = queue.enqueue_stale()
+    if requeued:
+        print(f"Queued {requeued} leads with stale or low confidence results again")
+    pending = queue.prioritize()
+    print(f"Prioritized {pending} pending leads")
+
+
+def search_businesses_online(limit=10, workers=1, batch_size=None, priority=None):
+    """
+    Search for businesses' online presence from the database
     
-    cursor.execute(query, (limit,))
-    businesses = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    Work is taken from the durable enrichment queue, so leads already searched
+    (even without results) are skipped until their result is stale, and an
+    interrupted run resumes where it stopped. Leads are searched in priority
+    order: never verified first, then stale and low confidence ones. Results
+    are checkpointed after every batch.
     
-    for business in businesses:
-        name, reg_type, reg_nr = business
-        print(f"Searching online presence for: {name} ({reg_type})")
-        
-        online_data = search_business_online(name, reg_type)
-        update_business_online_presence(name, reg_type, reg_nr, online_data)
-        
-        # Print found results
-        if online_data['website']:
-            print(f"  Website: {online_data['website']}")
-        
-        # Print individual social media accounts
-        if online_data['social_media']:
-            print(f"  Social media:")
-            for platform, url in online_data['social_media'].items():
-                print(f"    {platform.capitalize()}: {url}")
+    Args:
+        limit (int): Maximum number of businesses to process
+        workers (int): Number of businesses to search concurrently (1 searches them one by one)
+        batch_size (int): Jobs leased (and checkpointed) at a time, defaults to 4 per worker
+        priority (LeadPriority): How to order the leads, DEFAULT_LEAD_PRIORITY if None
+    """
+    # One connection serves the queue and the batched write-back
+    with EnrichmentResultSink(complete_jobs=True) as sink:
+        queue = EnrichmentQueue(sink.conn, priority=priority)
+        prepare_enrichment_queue(queue)
         
-        # Be polite to search engines
-        time.sleep(random.uniform(2.0, 5.0))
+        drain_enrichment_queue(queue, sink, limit, workers, batch_size, domain_memo=get_default_domain_memo())
+    
+    print(f"Online search complete. {sink.written} leads updated. Queue: {queue.stats()}")
+
+
+def _enrichment_worker_process(shard, shard_count, threads, limit, progress_queue):
+    # Every process has its own metrics, exported under its shard number
+    metrics.configure_from_env(process_index=shard)
+    # Each process gets its own pooled client, paced at its share of the per-host rate limits
+    set_default_client(HttpClient(
+        scheduler=RequestScheduler(budget_share=1.0 / shard_count),
+        cache=FetchCache(),
+    ))
+    
+    def report(event):
+        progress_queue.put((shard, event))
+    
+    try:
+        with EnrichmentResultSink(complete_jobs=True) as sink:
+            queue = EnrichmentQueue(sink.conn, shard=shard, shard_count=shard_count)
+            drain_enrichment_queue(queue, sink, limit, threads, progress=report, domain_memo=get_default_domain_memo())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        progress_queue.put((shard, 'exit'))
+
+
+def run_enrichment_workers(processes, limit=None, threads=8, report_interval=10, priority=None):
+    """
+    Drain the enrichment queue with several worker processes
+
+    Jobs are sharded across processes by a hash of registration_number, so
+    no two processes ever lease the same lead. Each process runs its own
+    pooled, multi-threaded network I/O, and the per-host rate limits are
+    split between the processes so together they stay within one budget.
+    Aggregate progress is printed every report_interval seconds.
+
+    Args:
+        processes (int): Number of worker processes
+        limit (int): Maximum number of businesses per process, None to drain the queue
+        threads (int): Businesses searched concurrently within each process
+        report_interval (float): Seconds between progress reports
+        priority (LeadPriority): How to order the leads, DEFAULT_LEAD_PRIORITY if None
+    """
+    # Enqueue and prioritize once up front instead of racing from every worker
+    conn = pymysql.connect(**DB_CONFIG)
+    queue = EnrichmentQueue(conn, priority=priority)
+    prepare_enrichment_queue(queue)
+    
+    progress_queue = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=_enrichment_worker_process,
+            args=(shard, processes, threads, limit, progress_queue),
+            name=f"enrichment-worker-{shard}",
+        )
+        for shard in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
     
-    print("Online search complete.")
+    totals = {'found': 0, 'not_found': 0, 'error': 0}
+    exited = set()
+    started = time.monotonic()
+    last_report = started
+    
+    def print_progress():
+        done = sum(totals.values())
+        minutes = max(time.monotonic() - started, 1e-9) / 60
+        print(f"[progress] {done} leads ({totals['found']} found, {totals['not_found']} not found, "
+              f"{totals['error']} errors), {done / minutes:.1f} leads/min, "
+              f"{processes - len(exited)} workers running")
+    
+    try:
+        while len(exited) < processes:
+            try:
+                shard, event = progress_queue.get(timeout=1)
+            except queue_module.Empty:
+                # A worker that died without reporting still counts as finished
+                exited.update(shard for shard, worker in enumerate(workers) if not worker.is_alive())
+                shard, event = None, None
+            if event == 'exit':
+                exited.add(shard)
+            elif event in totals:
+                totals[event] += 1
+            
+            if time.monotonic() - last_report >= report_interval:
+                print_progress()
+                last_report = time.monotonic()
+    except KeyboardInterrupt:
+        print("Stopping workers, finished work is saved...")
+    finally:
+        for worker in workers:
+            worker.join()
+    
+    print_progress()
+    print(f"Queue: {queue.stats()}")
+    conn.close()
+
+
+def _search_businesses_sequentially(businesses, domain_memo=None):
+    # One business at a time per stage, but searching the next one overlaps with scoring the current one
+    for work in run_pipeline(businesses, domain_memo=domain_memo):
+        if work.error is not None:
+            print(f"Error searching for {work.business[0]}: {work.error}")
+            continue
+        yield work.business, work.result
 
 
 if __name__ == "__main__":
+    # Business names are printed as they are, whatever the console's encoding
+    sys.stdout.reconfigure(encoding='utf-8')
+    # The worker processes set up their own exports
+    if len(sys.argv) < 2 or sys.argv[1] != "workers":
+        metrics.configure_from_env()
     try:
         # Default behavior: import data
         if len(sys.argv) == 1:
             csv_data = download_csv_data()
             import_csv_to_db(csv_data)
+        # Stream the full register (from the URL or a local file) in batches
+        elif sys.argv[1] == "stream":
+            source = sys.argv[2] if len(sys.argv) > 2 else REGISTRY_URL
+            with open_registry_stream(source) as csv_stream:
+                stream_import_csv_to_db(csv_stream)
+        # Only write rows that changed since the last sync
+        elif sys.argv[1] == "sync":
+            sync_registry()
+        # Convert the register into a columnar snapshot
+        elif sys.argv[1] == "snapshot":
+            snapshot_registry(sys.argv[2] if len(sys.argv) > 2 else REGISTRY_URL)
+        # Re-import the leads table from the snapshot
+        elif sys.argv[1] == "snapshot-import":
+            import_snapshot_to_db()
+        # Queue leads selected from the snapshot, e.g. "select SIA 2015"
+        elif sys.argv[1] == "select":
+            reg_type = sys.argv[2] if len(sys.argv) > 2 else None
+            founded_after = int(sys.argv[3]) if len(sys.argv) > 3 else None
+            enqueue_snapshot_selection(reg_type, founded_after)
+        # Join the beneficial owners dataset onto the leads
+        elif sys.argv[1] == "owners":
+            sync_beneficial_owners()
         # New command line option to search online
         elif len(sys.argv) > 1 and sys.argv[1] == "search":
             limit = int(sys.argv[2]) if len(sys.argv) > 2 else 10
-            search_businesses_online(limit)
+            workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+            search_businesses_online(limit, workers)
+        # Drain the enrichment queue with N sharded worker processes
+        elif sys.argv[1] == "workers":
+            processes = int(sys.argv[2]) if len(sys.argv) > 2 else multiprocessing.cpu_count()
+            limit = int(sys.argv[3]) if len(sys.argv) > 3 else None
+            threads = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+            run_enrichment_workers(processes, limit, threads)
+    except KeyboardInterrupt:
+        print("Interrupted. Finished work has been saved, run the same command again to resume.")
     except Exception as e:
         print("Error occurred:")
         traceback.print_exc()
\ No newline at end of file
@@ -0,0 +1,157 @@
+"""
+Classification of search result links into social profiles and website candidates
+
+Each href is lowercased and matched against a few precompiled patterns
+exactly once, and comes out as excluded, as one or more social media
+profiles, and/or as a website candidate with a priority tier.
+
+Run it directly to benchmark the classifier against saved result pages:
+
+    python link_classifier.py "Business Name" SIA saved_page.html [...]
+"""
+
+import re
+import sys
+import time
+
+# Directory/registry sites and other links that are never the business itself
+EXCLUDE_PATTERNS = ['lursoft.lv', 'firmas.lv', 'kontakti.lv', 'balticmarket.com', 'company-information', 'wiki', 'facebook.com/pages']
+EXCLUDE_RE = re.compile('|'.join(re.escape(pattern) for pattern in EXCLUDE_PATTERNS))
+
+# Social media profile URLs; the lookbehind keeps e.g. dropbox.com from matching x.com
+SOCIAL_PROFILE_RE = re.compile(
+    r'(?<![a-z0-9-])(?:'
+    r'(?P<facebook>facebook\.com/[^/"\s\?&#]+)'
+    r'|(?P<instagram>instagram\.com/[^/"\s\?&#]+)'
+    r'|(?P<linkedin>linkedin\.com/(?:company|in)/[^/"\s\?&#]+)'
+    r'|(?P<twitter>(?:twitter\.com|x\.com)/[^/"\s\?&#]+)'
+    r')',
+    re.IGNORECASE
+)
+SOCIAL_PLATFORMS = ('facebook', 'instagram', 'linkedin', 'twitter')
+
+# Links mentioning a social network anywhere are never website candidates
+SOCIAL_MENTION_RE = re.compile(r'facebook|instagram|linkedin|twitter|(?<![a-z0-9-])x\.com')
+SEARCH_ENGINE_RE = re.compile(r'bing|google|yahoo')
+# Common sites that show up in every result page
+COMMON_SITE_RE = re.compile(r'wikipedia|youtube')
+ORIGIN_RE = re.compile(r'https?://[^/\s]+')
+
+# Website candidate tiers, higher is more likely to be the business
+TIER_DOMAIN_NAME = 3  # Domain named after the business
+TIER_NAME_MATCH = 2  # Business name in the URL or in the link text
+TIER_GENERAL = 1  # Any other result
+
+
+class LinkClassification:
+    """
+    How a search result link was classified
+
+    Attributes:
+        social (dict): Platform name to profile URL for every social profile in the link
+        website_tier (int): Website candidate tier, 0 if the link is not a candidate
+        website_url (str): Origin (scheme and host) of the candidate website
+    """
+
+    __slots__ = ('social', 'website_tier', 'website_url')
+
+    def __init__(self, social, website_tier=0, website_url=None):
+        self.social = social
+        self.website_tier = website_tier
+        self.website_url = website_url
+
+
+def extract_social_profiles(href):
+    """
+    Find social media profile URLs in a link
+
+    Args:
+        href (str): Link target
+
+    Returns:
+        dict: Platform name to https:// profile URL, first match per platform
+    """
+    profiles = {}
+    for match in SOCIAL_PROFILE_RE.finditer(href):
+        platform = match.lastgroup
+        if platform not in profiles:
+            profiles[platform] = f"https://{match.group(platform)}"
+    return profiles
+
+
+def classify_link(href, link_text, matcher):
+    """
+    Classify a search result link for a business
+
+    Args:
+        href (str): Link target
+        link_text (str): Text of the link
+        matcher (BusinessMatcher): Matcher for the business being searched
+
+    Returns:
+        LinkClassification, or None if the link is excluded
+    """
+    href_lower = href.lower()
+    if EXCLUDE_RE.search(href_lower):
+        return None
+
+    classification = LinkClassification(extract_social_profiles(href))
+
+    origin_match = ORIGIN_RE.search(href)
+    mentions_social = SOCIAL_MENTION_RE.search(href_lower) is not None
+
+    # Only the first rule that applies decides the tier, even if the link has no usable origin
+    if matcher.website_pattern.search(href):
+        tier = TIER_DOMAIN_NAME
+    elif matcher.name in href_lower and not mentions_social:
+        tier = TIER_NAME_MATCH
+    elif matcher.name in link_text.lower() and origin_match and not mentions_social:
+        tier = TIER_NAME_MATCH
+    elif origin_match and not mentions_social and not SEARCH_ENGINE_RE.search(href_lower):
+        tier = TIER_GENERAL if not COMMON_SITE_RE.search(origin_match.group(0).lower()) else 0
+    else:
+        tier = 0
+
+    if tier and origin_match:
+        classification.website_tier = tier
+        classification.website_url = origin_match.group(0)
+
+    return classification
+
+
+def _benchmark(business_name, reg_type, paths, repeats=20):
+    from bs4 import BeautifulSoup
+    from name_matcher import BusinessMatcher
+
+    matcher = BusinessMatcher(business_name, reg_type)
+    links = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            soup = BeautifulSoup(f.read(), 'html.parser')
+        links.extend((a['href'], a.text) for a in soup.find_all('a', href=True))
+
+    counts = {'excluded': 0, 'social': 0, 'website': 0}
+    for href, text in links:
+        classification = classify_link(href, text, matcher)
+        if classification is None:
+            counts['excluded'] += 1
+            continue
+        counts['social'] += len(classification.social)
+        counts['website'] += 1 if classification.website_tier else 0
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for href, text in links:
+            classify_link(href, text, matcher)
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(links)} links from {len(paths)} pages: {counts}")
+    if links:
+        print(f"{elapsed / (repeats * len(links)) * 1e6:.2f} us per link")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print(__doc__)
+        sys.exit(1)
+    _benchmark(sys.argv[1], sys.argv[2], sys.argv[3:])
@@ -0,0 +1,487 @@
+"""
+Timing spans, counters, structured event logs and profiling for the enrichment pipeline
+
+Everything is recorded in one process-wide Metrics registry:
+
+    span('fetch')                 times a block into the fetchr_span_seconds histogram
+    inc('http_requests', host=…)  bumps a labelled counter
+    observe('stage_seconds', …)   adds a sample to any histogram
+
+The registry is exported in the Prometheus/OpenMetrics text format, to a
+file rewritten every few seconds and/or an HTTP endpoint:
+
+    write_openmetrics(path)  /  start_file_export(path)  /  serve_metrics(port)
+
+log_event() writes structured events (one JSON object per line) through the
+fetchr.events logger once configure_event_log() has been called, and a
+LeadProfiler installed with set_default_profiler() dumps a cProfile (or
+pyinstrument) profile of every Nth lead per pipeline stage.
+
+configure_from_env() sets all of this up from environment variables, see
+its docstring. Only the standard library is needed; pyinstrument is used
+when asked for and installed.
+"""
+
+import atexit
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRIC_PREFIX = 'fetchr'
+# Upper bounds, in seconds, of the histogram buckets
+SPAN_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Distinct hosts given their own label; the rest are counted as "other" so the export stays small
+MAX_HOST_LABELS = 200
+# Seconds between rewrites of the metrics file
+DEFAULT_EXPORT_INTERVAL = 15
+DEFAULT_METRICS_PORT = 9464
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+EVENT_LOGGER = logging.getLogger('fetchr.events')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Metrics:
+    """
+    Registry of labelled counters and histograms
+
+    Safe to share between threads. Counter and histogram names are given
+    without the fetchr_ prefix and the _total/_seconds-style suffixes are
+    part of the name, e.g. inc('http_requests') exports fetchr_http_requests_total.
+    """
+
+    def __init__(self, buckets=SPAN_BUCKETS, max_host_labels=MAX_HOST_LABELS):
+        """
+        Args:
+            buckets (tuple): Upper bounds of the histogram buckets, in seconds
+            max_host_labels (int): Distinct hosts host_label() passes through before answering "other"
+        """
+        self.buckets = tuple(buckets)
+        self.max_host_labels = max_host_labels
+        self._lock = threading.Lock()
+        self._counters = {}
+        # (name, labels) to [bucket counts..., count, sum]
+        self._histograms = {}
+        self._hosts = set()
+
+    def inc(self, name, amount=1, **labels):
+        """
+        Add to a counter
+
+        Args:
+            name (str): Counter name, exported as fetchr_<name>_total
+            amount (float): Amount to add
+            **labels: Label values of the series
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        """
+        Add a sample to a histogram
+
+        Args:
+            name (str): Histogram name, exported as fetchr_<name>
+            seconds (float): Observed value
+            **labels: Label values of the series
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    @contextmanager
+    def span(self, name, **labels):
+        """
+        Time a block into the span_seconds histogram
+
+        Blocks that raise are recorded with outcome="error". With the event
+        log at DEBUG level every span is also logged.
+
+        Args:
+            name (str): Span name, e.g. 'search', 'fetch', 'parse', 'score', 'db_write'
+            **labels: Extra label values
+        """
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            yield
+        except BaseException:
+            outcome = 'error'
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe('span_seconds', seconds, span=name, outcome=outcome, **labels)
+            if EVENT_LOGGER.isEnabledFor(logging.DEBUG):
+                log_event('span', logging.DEBUG, span=name, seconds=round(seconds, 6), outcome=outcome, **labels)
+
+    def host_label(self, host):
+        """Label value for a host, "other" once max_host_labels distinct hosts were seen"""
+        with self._lock:
+            if host in self._hosts:
+                return host
+            if len(self._hosts) < self.max_host_labels:
+                self._hosts.add(host)
+                return host
+        return 'other'
+
+    def snapshot(self):
+        """
+        Current values, for reports and progress output
+
+        Returns:
+            dict: 'counters' maps (name, labels) to values, 'histograms' maps (name, labels) to (count, sum)
+        """
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'histograms': {key: (histogram[-2], histogram[-1]) for key, histogram in self._histograms.items()},
+            }
+
+    def to_openmetrics(self):
+        """
+        Render every series in the OpenMetrics text format
+
+        Returns:
+            str: Exposition text, ending with # EOF
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(histogram)) for key, histogram in self._histograms.items())
+
+        lines = []
+        family = None
+        for (name, labels), value in counters:
+            if name != family:
+                family = name
+                lines.append(f"# TYPE {METRIC_PREFIX}_{name} counter")
+            lines.append(f"{METRIC_PREFIX}_{name}_total{_format_labels(labels)} {value}")
+
+        family = None
+        for (name, labels), histogram in histograms:
+            metric = f"{METRIC_PREFIX}_{name}"
+            if name != family:
+                family = name
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{metric}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram[-2]}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {histogram[-2]}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {histogram[-1]:.6f}")
+
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._hosts.clear()
+
+
+class LeadProfiler:
+    """
+    Profiles one in every N leads, separately for each pipeline stage
+
+    Each stage counts the leads it handles, and every Nth one is run under
+    cProfile (or pyinstrument) in the stage's thread. The profile is written
+    to <directory>/<stage>-<pid>-<lead number>.prof (.html for pyinstrument);
+    open .prof files with `python -m pstats` or snakeviz. Work a stage hands
+    to other threads, like concurrent candidate fetches, isn't included.
+
+    Only one stage is profiled at a time: Python 3.12+ refuses a second
+    profiler while one is active. A lead that comes up while another stage
+    is being profiled isn't counted, so that stage's next lead is profiled.
+    """
+
+    def __init__(self, every, directory, engine='cprofile'):
+        """
+        Args:
+            every (int): Profile every Nth lead of each stage
+            directory (str): Directory to write the profiles to
+            engine (str): 'cprofile', or 'pyinstrument' if it is installed
+        """
+        self.every = max(1, every)
+        self.directory = directory
+        self.engine = engine
+        if engine == 'pyinstrument':
+            try:
+                import pyinstrument  # noqa: F401
+            except ImportError:
+                print("pyinstrument is not installed, profiling with cProfile")
+                self.engine = 'cprofile'
+        os.makedirs(directory, exist_ok=True)
+        self._counts = {}
+        self._lock = threading.Lock()
+        # Held while a lead is being profiled, in whichever stage's thread
+        self._active = threading.Lock()
+
+    @contextmanager
+    def lead(self, stage):
+        """
+        Wrap the work of a stage on one lead, profiling it if it is the Nth
+
+        Args:
+            stage (str): Stage name, used for the count and the file name
+        """
+        with self._lock:
+            count = self._counts[stage] = self._counts.get(stage, 0) + 1
+        if count % self.every:
+            yield
+            return
+        if not self._active.acquire(blocking=False):
+            with self._lock:
+                self._counts[stage] -= 1
+            yield
+            return
+
+        path = os.path.join(self.directory, f"{stage}-{os.getpid()}-{count}")
+        try:
+            if self.engine == 'pyinstrument':
+                from pyinstrument import Profiler
+                profiler = Profiler()
+                profiler.start()
+                try:
+                    yield
+                finally:
+                    profiler.stop()
+                    with open(path + '.html', 'w', encoding='utf-8') as f:
+                        f.write(profiler.output_html())
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    yield
+                finally:
+                    profiler.disable()
+                    profiler.dump_stats(path + '.prof')
+        finally:
+            self._active.release()
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, with the fields passed to log_event()"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'event': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_event_log(path=None, level=logging.INFO):
+    """
+    Send structured events to a JSON lines file, or to stderr
+
+    Args:
+        path (str): File to append to, None for stderr
+        level (int): Lowest level logged; DEBUG also logs every span
+    """
+    handler = logging.FileHandler(path, encoding='utf-8') if path else logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    EVENT_LOGGER.addHandler(handler)
+    EVENT_LOGGER.setLevel(level)
+    # Don't repeat the events in whatever the root logger prints
+    EVENT_LOGGER.propagate = False
+
+
+def log_event(event, level=logging.INFO, **fields):
+    """
+    Log a structured event
+
+    Args:
+        event (str): Event name, e.g. 'lead'
+        level (int): Logging level
+        **fields: Fields of the event, anything JSON-serializable
+    """
+    if EVENT_LOGGER.isEnabledFor(level):
+        EVENT_LOGGER.log(level, event, extra={'fields': fields})
+
+
+_default_metrics = Metrics()
+_default_profiler = None
+_default_lock = threading.Lock()
+
+
+def get_default_metrics():
+    """Return the registry everything in this process records to"""
+    return _default_metrics
+
+
+def set_default_metrics(registry):
+    """Replace the default registry, e.g. with a fresh one per benchmark run"""
+    global _default_metrics
+    with _default_lock:
+        _default_metrics = registry
+
+
+def set_default_profiler(profiler):
+    """Install a LeadProfiler for the pipeline stages, None to stop profiling"""
+    global _default_profiler
+    with _default_lock:
+        _default_profiler = profiler
+
+
+def span(name, **labels):
+    """Time a block into the default registry, see Metrics.span"""
+    return _default_metrics.span(name, **labels)
+
+
+def inc(name, amount=1, **labels):
+    """Add to a counter of the default registry, see Metrics.inc"""
+    _default_metrics.inc(name, amount, **labels)
+
+
+def observe(name, seconds, **labels):
+    """Add a histogram sample to the default registry, see Metrics.observe"""
+    _default_metrics.observe(name, seconds, **labels)
+
+
+def host_label(host):
+    """Label value for a host in the default registry, see Metrics.host_label"""
+    return _default_metrics.host_label(host)
+
+
+def profile_lead(stage):
+    """Context for the work of a stage on one lead, profiled if a LeadProfiler is installed and it's due"""
+    profiler = _default_profiler
+    return profiler.lead(stage) if profiler is not None else nullcontext()
+
+
+def write_openmetrics(path, registry=None):
+    """
+    Write the metrics to a file, replacing it atomically so scrapers never read half of it
+
+    Args:
+        path (str): File to write, e.g. for node_exporter's textfile collector
+        registry (Metrics): Registry to export, the default one if None
+    """
+    registry = registry or _default_metrics
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(registry.to_openmetrics())
+    os.replace(temp_path, path)
+
+
+def start_file_export(path, interval=DEFAULT_EXPORT_INTERVAL):
+    """
+    Rewrite the metrics file every interval seconds, and once more at exit
+
+    Args:
+        path (str): File to write
+        interval (float): Seconds between writes
+
+    Returns:
+        threading.Event: Set it to stop the exporter
+    """
+    stopped = threading.Event()
+
+    def export():
+        while not stopped.wait(interval):
+            write_openmetrics(path)
+
+    threading.Thread(target=export, name='metrics-export', daemon=True).start()
+    atexit.register(write_openmetrics, path)
+    return stopped
+
+
+def serve_metrics(port=DEFAULT_METRICS_PORT, host='127.0.0.1'):
+    """
+    Serve the metrics at http://host:port/metrics from a background thread
+
+    Args:
+        port (int): Port to listen on
+        host (str): Interface to listen on
+
+    Returns:
+        ThreadingHTTPServer: Call shutdown() on it to stop serving
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = _default_metrics.to_openmetrics().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', OPENMETRICS_CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+
+def configure_from_env(process_index=None):
+    """
+    Set up exports, event logging and profiling from environment variables
+
+        METRICS_FILE      OpenMetrics file rewritten every METRICS_INTERVAL seconds (default 15)
+        METRICS_PORT      serve /metrics on this port
+        EVENT_LOG         JSON lines event log file, "-" for stderr
+        EVENT_LOG_LEVEL   INFO (the default, one event per lead) or DEBUG (also every span)
+        PROFILE_EVERY     profile every Nth lead of each stage into PROFILE_DIR (default data/profiles)
+        PROFILER          cprofile (the default) or pyinstrument
+
+    Args:
+        process_index (int): Index of a worker process; its metrics file gets a .<index> suffix
+            and it serves on METRICS_PORT + index, so workers don't collide
+    """
+    metrics_file = os.getenv('METRICS_FILE')
+    if metrics_file:
+        if process_index is not None:
+            metrics_file = f"{metrics_file}.{process_index}"
+        start_file_export(metrics_file, float(os.getenv('METRICS_INTERVAL', DEFAULT_EXPORT_INTERVAL)))
+
+    metrics_port = os.getenv('METRICS_PORT')
+    if metrics_port:
+        port = int(metrics_port) + (process_index or 0)
+        serve_metrics(port)
+        print(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+
+    event_log = os.getenv('EVENT_LOG')
+    if event_log:
+        level = getattr(logging, os.getenv('EVENT_LOG_LEVEL', 'INFO').upper(), logging.INFO)
+        configure_event_log(None if event_log == '-' else event_log, level)
+
+    profile_every = os.getenv('PROFILE_EVERY')
+    if profile_every:
+        directory = os.getenv('PROFILE_DIR') or os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "data", "profiles")
+        set_default_profiler(LeadProfiler(int(profile_every), directory, os.getenv('PROFILER', 'cprofile')))
@@ -0,0 +1,128 @@
+"""
+Per-business matcher for finding a business name in page text
+
+Everything derived from the business name (the cleaned name, its words and
+the name/registration type proximity pattern) is computed once per lead and
+reused for every candidate page and link, instead of being rebuilt by each
+verifier for each candidate.
+"""
+
+import re
+
+SENTENCE_SPLIT = re.compile(r'[.!?]')
+
+
+class TextMatch:
+    """
+    Result of scanning a text for a business
+
+    Attributes:
+        full_name (bool): The cleaned business name appears in the text
+        token_hits (int): Number of significant name words (longer than 3 characters) in the text
+        token_coverage (bool): At least half of the name's words were hit
+        reg_type_near (bool): The name appears right next to the registration type
+    """
+
+    __slots__ = ('full_name', 'token_hits', 'token_coverage', 'reg_type_near')
+
+    def __init__(self, full_name, token_hits, token_coverage, reg_type_near):
+        self.full_name = full_name
+        self.token_hits = token_hits
+        self.token_coverage = token_coverage
+        self.reg_type_near = reg_type_near
+
+
+class BusinessMatcher:
+    """
+    Compiled lookups for one business, built once per lead
+
+    Attributes:
+        name (str): Lowercased business name as given
+        clean_name (str): Lowercased name with punctuation removed
+        words (list): Words of the cleaned name
+        reg_type (str): Lowercased registration type, '' if unknown
+    """
+
+    def __init__(self, business_name, reg_type):
+        self.name = business_name.lower()
+        self.clean_name = re.sub(r'[^\w\s]', '', self.name).strip()
+        self.words = self.clean_name.split()
+        # Short words like "un" or "sia" match almost any page, so only longer ones count towards coverage
+        self.significant_words = [word for word in self.words if len(word) > 3]
+        self.half_words = len(self.words) / 2
+        self.reg_type = (reg_type or '').lower()
+
+        name = re.escape(self.clean_name)
+        reg = re.escape(self.reg_type)
+        self.proximity_pattern = re.compile(
+            rf"{name}\s*[,.-]?\s*{reg}|{reg}\s*[,.-]?\s*{name}|{name}\s+{reg}"
+        )
+
+        # Domains named exactly after the business, e.g. macovel.lv
+        self.website_pattern = re.compile(rf'{re.escape(self.name)}\.(?:com|lv|eu|net|org|io)', re.IGNORECASE)
+
+    def has_name(self, text):
+        return self.clean_name in text
+
+    def token_hits(self, text):
+        return sum(1 for word in self.significant_words if word in text)
+
+    def has_token_coverage(self, text):
+        """At least half of the name's words appear in the text"""
+        return self.token_hits(text) >= self.half_words
+
+    def has_reg_type_near_name(self, text):
+        """
+        Check whether the name and registration type appear next to each other
+
+        Args:
+            text (str): Lowercased text with whitespace collapsed to single spaces
+        """
+        return self.proximity_pattern.search(text) is not None
+
+    def mentions_name_and_reg_type(self, text):
+        return self.clean_name in text and self.reg_type in text
+
+    def has_name_and_reg_type_in_sentence(self, text):
+        """Check whether one sentence of the text mentions both the name and the registration type"""
+        if self.reg_type not in text:
+            return False
+        return any(self.mentions_name_and_reg_type(sentence) for sentence in SENTENCE_SPLIT.split(text))
+
+    def username_score(self, username):
+        """
+        Score a social media username against the business name
+
+        Args:
+            username (str): Lowercased username taken from a profile URL
+
+        Returns:
+            float: 0.7 if it contains enough of the name, 0.6 if it matches the
+            initials, otherwise None
+        """
+        name_parts_in_username = sum(1 for word in self.significant_words if word in username)
+        if name_parts_in_username >= max(1, len(self.words) / 3):
+            return 0.7
+
+        if len(username) >= 2 and all(username.startswith(word[0]) for word in self.words[:len(username)]):
+            return 0.6
+
+        return None
+
+    def scan(self, text, normalized_text=None):
+        """
+        Match the business against a lowercased text
+
+        Args:
+            text (str): Lowercased text to scan
+            normalized_text (str): The same text with whitespace collapsed, computed if None
+
+        Returns:
+            TextMatch
+        """
+        full_name = self.clean_name in text
+        token_hits = self.token_hits(text)
+        if normalized_text is None:
+            normalized_text = ' '.join(text.split())
+        reg_type_near = self.proximity_pattern.search(normalized_text) is not None
+        return TextMatch(full_name, token_hits, token_hits >= self.half_words, reg_type_near)
@@ -0,0 +1,204 @@
+"""
+Single-pass extraction of the page features the verifiers score on
+
+Instead of building a BeautifulSoup tree and walking it several times, the
+page is tokenized once and every feature is collected from the same stream
+of parser events: the title, the meta description, the text of
+footer/contact/about and legal/contact blocks, and the full text. lxml is
+used as the tokenizer when it is installed, with the standard library's
+html.parser as a fallback.
+"""
+
+from html.parser import HTMLParser
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# Elements that never have content or an end tag
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+    'param', 'source', 'track', 'wbr',
+])
+# Text inside these elements is not part of the visible page text
+SKIPPED_TEXT_ELEMENTS = frozenset(['script', 'style', 'template'])
+
+# Blocks whose class mentions one of these words are collected separately
+FOOTER_BLOCK_TAGS = frozenset(['footer', 'div'])
+FOOTER_BLOCK_CLASSES = ('footer', 'contact', 'about')
+LEGAL_BLOCK_TAGS = frozenset(['div', 'section', 'p'])
+LEGAL_BLOCK_CLASSES = ('legal', 'contact')
+
+
+class PageFeatures:
+    """
+    Features of a fetched page, all lowercased
+
+    Attributes:
+        title (str): Text of the first <title>, or None
+        meta_description (str): Content of <meta name="description">, or None
+        text (str): Visible text of the whole page
+        footer_blocks (list): Text of footer/contact/about blocks
+        legal_blocks (list): Text of legal/contact blocks
+    """
+
+    __slots__ = ('title', 'meta_description', 'text', 'footer_blocks', 'legal_blocks')
+
+    def __init__(self, title=None, meta_description=None, text='', footer_blocks=None, legal_blocks=None):
+        self.title = title
+        self.meta_description = meta_description
+        self.text = text
+        self.footer_blocks = footer_blocks or []
+        self.legal_blocks = legal_blocks or []
+
+
+class _Block:
+    __slots__ = ('tag', 'kinds', 'parts')
+
+    def __init__(self, tag, kinds):
+        self.tag = tag
+        self.kinds = kinds
+        self.parts = []
+
+
+class _FeatureCollector:
+    """Parser target that builds PageFeatures from start/end/data events"""
+
+    def __init__(self):
+        self.text_parts = []
+        self.title_parts = None
+        self.title_done = False
+        self.meta_description = None
+        self.footer_blocks = []
+        self.legal_blocks = []
+        # Every open element, innermost last, with the blocks being captured
+        self.stack = []
+        self.open_blocks = []
+        self.skip_depth = 0
+
+    def start(self, tag, attrib):
+        tag = tag.lower()
+        if tag == 'meta':
+            if self.meta_description is None and attrib.get('name') == 'description':
+                self.meta_description = (attrib.get('content') or '').lower()
+            return
+        if tag in VOID_ELEMENTS:
+            return
+
+        block = None
+        class_attr = attrib.get('class')
+        if class_attr:
+            class_text = class_attr.lower()
+            kinds = []
+            if tag in FOOTER_BLOCK_TAGS and any(word in class_text for word in FOOTER_BLOCK_CLASSES):
+                kinds.append('footer')
+            if tag in LEGAL_BLOCK_TAGS and any(word in class_text for word in LEGAL_BLOCK_CLASSES):
+                kinds.append('legal')
+            if kinds:
+                block = _Block(tag, kinds)
+                self.open_blocks.append(block)
+
+        if tag in SKIPPED_TEXT_ELEMENTS:
+            self.skip_depth += 1
+        elif tag == 'title' and not self.title_done and self.title_parts is None:
+            self.title_parts = []
+
+        self.stack.append((tag, block))
+
+    def end(self, tag):
+        tag = tag.lower()
+        if tag in VOID_ELEMENTS:
+            return
+        # Close everything up to the matching start tag, ignoring stray end tags
+        if not any(open_tag == tag for open_tag, _ in self.stack):
+            return
+        while self.stack:
+            open_tag, block = self.stack.pop()
+            self._close(open_tag, block)
+            if open_tag == tag:
+                break
+
+    def _close(self, tag, block):
+        if tag in SKIPPED_TEXT_ELEMENTS:
+            self.skip_depth -= 1
+        elif tag == 'title' and self.title_parts is not None and not self.title_done:
+            self.title_done = True
+        if block is not None:
+            self.open_blocks.remove(block)
+            block_text = ''.join(block.parts).lower()
+            if 'footer' in block.kinds:
+                self.footer_blocks.append(block_text)
+            if 'legal' in block.kinds:
+                self.legal_blocks.append(block_text)
+
+    def data(self, data):
+        if self.skip_depth:
+            return
+        self.text_parts.append(data)
+        if self.title_parts is not None and not self.title_done:
+            self.title_parts.append(data)
+        for block in self.open_blocks:
+            block.parts.append(data)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        while self.stack:
+            open_tag, block = self.stack.pop()
+            self._close(open_tag, block)
+        return PageFeatures(
+            title=''.join(self.title_parts).lower() if self.title_parts is not None else None,
+            meta_description=self.meta_description,
+            text=''.join(self.text_parts).lower(),
+            footer_blocks=self.footer_blocks,
+            legal_blocks=self.legal_blocks,
+        )
+
+
+class _StdlibFeatureParser(HTMLParser):
+    """Feeds html.parser events into a _FeatureCollector"""
+
+    def __init__(self, collector):
+        super().__init__(convert_charrefs=True)
+        self.collector = collector
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag, {name: value for name, value in reversed(attrs)})
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        self.collector.end(tag)
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+
+def extract_page_features(html):
+    """
+    Extract the scoring features of a page in one pass over its HTML
+
+    Args:
+        html (str): Page source
+
+    Returns:
+        PageFeatures
+    """
+    collector = _FeatureCollector()
+
+    if etree is not None:
+        try:
+            parser = etree.HTMLParser(target=collector, recover=True)
+            return etree.fromstring(html, parser) if html.strip() else collector.close()
+        except (etree.LxmlError, ValueError):
+            # Fall back to html.parser for documents lxml refuses (e.g. with an encoding declaration)
+            collector = _FeatureCollector()
+
+    parser = _StdlibFeatureParser(collector)
+    parser.feed(html)
+    parser.close()
+    return collector.close()
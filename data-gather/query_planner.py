@@ -0,0 +1,267 @@
+"""
+Adaptive planning of the search queries sent per lead
+
+Every lead has the same few query templates. Their results overlap
+heavily, and search volume is the tightest rate limit we have. So instead
+of always sending all of them, the planner:
+
+- sends the most productive template first, learned from how many
+  website and social media candidates each template's results contained;
+- stops once a website named after the business and a profile on each of
+  the required social media platforms have been found.
+
+Yield statistics are kept in a small SQLite file shared by all worker
+processes, so the ordering is learned from our own data across runs.
+"""
+
+import atexit
+import os
+import random
+import sqlite3
+import threading
+
+from link_classifier import SOCIAL_PLATFORMS, TIER_DOMAIN_NAME, classify_link
+
+DEFAULT_STATS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "query_stats.sqlite")
+
+# Query templates in their original order, which also sets their link priority
+QUERY_TEMPLATES = (
+    ('official_website', "{name} {reg_type} official website"),
+    ('contact', "{name} {reg_type} contact"),
+    ('social_media', "{name} {reg_type} social media"),
+    # Without the registration type for broader results
+    ('official_website_no_type', "{name} official website"),
+)
+
+# Until a template has real data, its yield is pulled towards a prior that
+# keeps the original order; this many pseudo-queries worth of it
+PRIOR_QUERIES = 20
+# Share of leads whose queries are sent in random order, so every template keeps getting measured
+EXPLORE_RATE = 0.05
+# Pending statistics are written to the stats file after this many queries
+STATS_FLUSH_EVERY = 50
+# Platforms a lead needs a profile candidate on before the remaining queries are skipped. Few leads
+# turn up on all four, so requiring every platform would almost never stop early
+REQUIRED_PLATFORMS = ('facebook', 'linkedin')
+
+
+class SearchCoverage:
+    """
+    What the queries of one lead have found so far
+
+    Attributes:
+        website (bool): A website candidate with a domain named after the business was found
+        platforms (set): Social media platforms with at least one profile candidate
+        required_platforms (frozenset): Platforms that must be covered for the lead to be complete
+    """
+
+    def __init__(self, matcher, required_platforms=REQUIRED_PLATFORMS):
+        self.matcher = matcher
+        self.website = False
+        self.platforms = set()
+        self.required_platforms = frozenset(required_platforms)
+
+    def add(self, links):
+        """
+        Add the links of a query's results
+
+        Args:
+            links (list): (href, link text) pairs
+
+        Returns:
+            tuple: (website_hit, platforms_hit) found in these links
+        """
+        website_hit = False
+        platforms_hit = set()
+        for href, link_text in links:
+            classification = classify_link(href, link_text, self.matcher)
+            if classification is None:
+                continue
+            platforms_hit.update(classification.social)
+            # Review and directory pages with the name in their URL are on every result page,
+            # only a domain named after the business is worth stopping for
+            if classification.website_tier >= TIER_DOMAIN_NAME:
+                website_hit = True
+        self.website = self.website or website_hit
+        self.platforms.update(platforms_hit)
+        return website_hit, platforms_hit
+
+    @property
+    def complete(self):
+        return self.website and self.required_platforms <= self.platforms
+
+
+class QueryPlanner:
+    """
+    Orders the query templates by learned yield and decides when to stop
+
+    Safe to share between threads, and between processes using the same file.
+    """
+
+    def __init__(self, path=DEFAULT_STATS_PATH, early_stop=True, explore_rate=EXPLORE_RATE,
+                 required_platforms=REQUIRED_PLATFORMS):
+        """
+        Args:
+            path (str): SQLite file with the yield statistics, None to keep them in memory only
+            early_stop (bool): Skip the remaining queries once the lead is covered
+            explore_rate (float): Share of leads whose queries are sent in random order
+            required_platforms (iterable): Social media platforms that must be covered besides the website,
+                empty to stop at the first website named after the business
+        """
+        unknown = set(required_platforms) - set(SOCIAL_PLATFORMS)
+        if unknown:
+            raise ValueError(f"Unknown social media platforms: {', '.join(sorted(unknown))}")
+        self.path = path
+        self.early_stop = early_stop
+        self.required_platforms = tuple(required_platforms)
+        self.explore_rate = explore_rate
+        self._lock = threading.Lock()
+        self._totals = {name: [0, 0, 0, 0] for name, _ in QUERY_TEMPLATES}
+        self._pending = {name: [0, 0, 0, 0] for name, _ in QUERY_TEMPLATES}
+        self._pending_count = 0
+        self._db = None
+        if path is not None:
+            # Worker processes share the file, so wait for each other's writes instead of failing
+            self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS query_stats (
+                    template TEXT PRIMARY KEY,
+                    sent INTEGER NOT NULL DEFAULT 0,
+                    website_hits INTEGER NOT NULL DEFAULT 0,
+                    social_hits INTEGER NOT NULL DEFAULT 0,
+                    skipped INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self._db.commit()
+            self._load()
+
+    def _load(self):
+        # Caller must hold self._lock (or be __init__)
+        for template, sent, website_hits, social_hits, skipped in self._db.execute(
+            "SELECT template, sent, website_hits, social_hits, skipped FROM query_stats"
+        ):
+            if template in self._totals:
+                self._totals[template] = [sent, website_hits, social_hits, skipped]
+
+    def yield_of(self, template):
+        """
+        Expected number of coverage items (a website plus one per platform) a template's results hold
+
+        Args:
+            template (str): Template name
+
+        Returns:
+            float: Smoothed average over the queries sent with this template
+        """
+        rank = [name for name, _ in QUERY_TEMPLATES].index(template)
+        # Prior: a slightly lower yield for every later template, so ties keep the original order
+        prior = 1.0 - 0.05 * rank
+        with self._lock:
+            sent, website_hits, social_hits, _ = (
+                total + pending for total, pending in zip(self._totals[template], self._pending[template])
+            )
+        return (website_hits + social_hits + prior * PRIOR_QUERIES) / (sent + PRIOR_QUERIES)
+
+    def plan(self, query_count=len(QUERY_TEMPLATES)):
+        """
+        Order in which to send a lead's queries
+
+        Args:
+            query_count (int): Number of queries the lead has, in QUERY_TEMPLATES order
+
+        Returns:
+            list: Query indices, most productive first
+        """
+        order = list(range(query_count))
+        if random.random() < self.explore_rate:
+            random.shuffle(order)
+            return order
+        return sorted(order, key=lambda index: -self.yield_of(QUERY_TEMPLATES[index][0]))
+
+    def record(self, index, website_hit, platforms_hit):
+        """
+        Record what a sent query found
+
+        Args:
+            index (int): Query index, in QUERY_TEMPLATES order
+            website_hit (bool): Its results held a website candidate with a domain named after the business
+            platforms_hit (set): Social media platforms with a profile in its results
+        """
+        self._add(index, (1, 1 if website_hit else 0, len(platforms_hit), 0))
+
+    def record_skipped(self, index):
+        """Record a query that wasn't sent because the lead was already covered"""
+        self._add(index, (0, 0, 0, 1))
+
+    def _add(self, index, counts):
+        template = QUERY_TEMPLATES[index][0]
+        with self._lock:
+            pending = self._pending[template]
+            for i, count in enumerate(counts):
+                pending[i] += count
+            self._pending_count += 1
+            if self._pending_count >= STATS_FLUSH_EVERY:
+                self._flush()
+
+    def _flush(self):
+        # Caller must hold self._lock
+        if self._db is None:
+            for template, pending in self._pending.items():
+                self._totals[template] = [total + count for total, count in zip(self._totals[template], pending)]
+        else:
+            self._db.executemany("""
+                INSERT INTO query_stats (template, sent, website_hits, social_hits, skipped)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(template) DO UPDATE SET
+                    sent = sent + excluded.sent,
+                    website_hits = website_hits + excluded.website_hits,
+                    social_hits = social_hits + excluded.social_hits,
+                    skipped = skipped + excluded.skipped
+            """, [(template, *pending) for template, pending in self._pending.items() if any(pending)])
+            self._db.commit()
+            # Pick up what other processes learned in the meantime
+            self._load()
+        self._pending = {name: [0, 0, 0, 0] for name, _ in QUERY_TEMPLATES}
+        self._pending_count = 0
+
+    def stats(self):
+        """
+        Yield statistics per template
+
+        Returns:
+            dict: Template name to sent/website_hits/social_hits/skipped counts and the smoothed yield
+        """
+        with self._lock:
+            counts = {
+                name: [total + pending for total, pending in zip(self._totals[name], self._pending[name])]
+                for name, _ in QUERY_TEMPLATES
+            }
+        return {
+            name: {'sent': sent, 'website_hits': website_hits, 'social_hits': social_hits, 'skipped': skipped,
+                   'yield': round(self.yield_of(name), 3)}
+            for name, (sent, website_hits, social_hits, skipped) in counts.items()
+        }
+
+    def close(self):
+        with self._lock:
+            if self._pending_count:
+                self._flush()
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+_default_planner = None
+_default_planner_lock = threading.Lock()
+
+
+def get_default_planner():
+    """Return the planner shared by every pipeline that isn't given one"""
+    global _default_planner
+    with _default_planner_lock:
+        if _default_planner is None:
+            _default_planner = QueryPlanner()
+            # Don't lose the statistics gathered since the last flush
+            atexit.register(_default_planner.close)
+        return _default_planner
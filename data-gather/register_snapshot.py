@@ -0,0 +1,323 @@
+"""
+Compact columnar snapshot of the company register
+
+The register CSV is converted once into a directory of flat column files
+that are memory-mapped when read back, so re-deriving fields or selecting
+leads doesn't mean re-downloading and re-parsing the CSV into one dict per
+row:
+
+    <column>.data / <column>.offsets   text columns, UTF-8 bytes plus row offsets
+    <column>.codes                     low-cardinality columns, one byte per row
+                                       (the values are listed in meta.json)
+    founded_year.u8 / active.u8        derived one-byte columns used for filtering
+    regcode_index.keys / .rows         numeric regcodes, sorted, with their row numbers
+    meta.json                          row count, dictionaries and source checksum
+
+Filters run over whole one-byte columns at a time with bytes.translate()
+and big-integer AND, without a Python loop per row; rows are only decoded
+for the matches. Everything is standard library, since this has to run
+wherever the importer runs.
+"""
+
+import csv
+import json
+import mmap
+import os
+import re
+import shutil
+import sys
+from array import array
+from bisect import bisect_left
+
+SNAPSHOT_VERSION = 1
+
+# Columns of the register kept as text
+TEXT_COLUMNS = ('regcode', 'name_in_quotes', 'address', 'registered', 'terminated')
+# Columns with only a handful of distinct values, stored as one byte per row
+CODED_COLUMNS = ('type', 'closed')
+# founded_year is stored as the year minus this, 0 meaning unknown
+YEAR_BASE = 1800
+YEAR_PATTERN = re.compile(r'(1[89]\d\d|20\d\d)')
+
+
+def _founded_year_code(registered):
+    match = YEAR_PATTERN.search(registered or '')
+    return int(match.group(1)) - YEAR_BASE if match else 0
+
+
+def _numeric_regcode(regcode):
+    regcode = regcode.strip()
+    if regcode.isdigit() and len(regcode) < 19 and not regcode.startswith('0'):
+        return int(regcode)
+    return None
+
+
+def build_snapshot(csv_file_like, path, source_checksum=None):
+    """
+    Convert the register CSV into a columnar snapshot
+
+    The CSV is read once as a stream; text columns are written to disk as
+    they are parsed and only the per-row offsets and one-byte codes are
+    kept in memory. The snapshot is built next to path and moved into
+    place when complete, so readers never see half a snapshot.
+
+    Args:
+        csv_file_like: Text stream of the register, e.g. from open_registry_stream()
+        path (str): Directory to write the snapshot to, replaced if it exists
+        source_checksum (str): MD5 of the source file, stored for reference
+
+    Returns:
+        int: Number of rows in the snapshot
+    """
+    building = path + '.building'
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+
+    data_files = {column: open(os.path.join(building, f"{column}.data"), 'wb') for column in TEXT_COLUMNS}
+    offsets = {column: array('Q', [0]) for column in TEXT_COLUMNS}
+    codes = {column: array('B') for column in CODED_COLUMNS}
+    dictionaries = {column: {} for column in CODED_COLUMNS}
+    founded_year = array('B')
+    active = array('B')
+    index_keys = []
+
+    rows = 0
+    try:
+        reader = csv.DictReader(csv_file_like, delimiter=';', quotechar='"')
+        for row in reader:
+            for column in TEXT_COLUMNS:
+                encoded = (row.get(column) or '').encode('utf-8')
+                data_files[column].write(encoded)
+                offsets[column].append(offsets[column][-1] + len(encoded))
+
+            for column in CODED_COLUMNS:
+                value = row.get(column) or ''
+                dictionary = dictionaries[column]
+                code = dictionary.get(value)
+                if code is None:
+                    if len(dictionary) == 256:
+                        raise ValueError(f"Column {column} has too many distinct values for a one-byte code")
+                    code = dictionary[value] = len(dictionary)
+                codes[column].append(code)
+
+            founded_year.append(min(_founded_year_code(row.get('registered')), 255))
+            active.append(0 if (row.get('closed') or row.get('terminated')) else 1)
+
+            numeric = _numeric_regcode(row.get('regcode') or '')
+            if numeric is not None:
+                index_keys.append((numeric, rows))
+            rows += 1
+    finally:
+        for f in data_files.values():
+            f.close()
+
+    for column in TEXT_COLUMNS:
+        _write_array(os.path.join(building, f"{column}.offsets"), offsets[column])
+    for column in CODED_COLUMNS:
+        _write_array(os.path.join(building, f"{column}.codes"), codes[column])
+    _write_array(os.path.join(building, 'founded_year.u8'), founded_year)
+    _write_array(os.path.join(building, 'active.u8'), active)
+
+    index_keys.sort()
+    _write_array(os.path.join(building, 'regcode_index.keys'), array('q', (key for key, _ in index_keys)))
+    _write_array(os.path.join(building, 'regcode_index.rows'), array('Q', (row for _, row in index_keys)))
+
+    meta = {
+        'version': SNAPSHOT_VERSION,
+        'rows': rows,
+        'byteorder': sys.byteorder,
+        'source_checksum': source_checksum,
+        'dictionaries': {
+            column: sorted(dictionary, key=dictionary.get) for column, dictionary in dictionaries.items()
+        },
+    }
+    with open(os.path.join(building, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(building, path)
+    return rows
+
+
+def _write_array(path, values):
+    with open(path, 'wb') as f:
+        values.tofile(f)
+
+
+class RegisterSnapshot:
+    """
+    Read-only, memory-mapped view of a snapshot written by build_snapshot()
+
+    Column files are mapped, not read, so opening a snapshot is instant and
+    the operating system pages in only what a query touches.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Snapshot directory
+        """
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {self.meta.get('version')}, rebuild the snapshot")
+        if self.meta['byteorder'] != sys.byteorder:
+            raise ValueError("Snapshot was written on a machine with a different byte order, rebuild it")
+
+        self.rows = self.meta['rows']
+        self.dictionaries = self.meta['dictionaries']
+        self._maps = []
+        self._data = {column: self._map(f"{column}.data", 'B') for column in TEXT_COLUMNS}
+        self._offsets = {column: self._map(f"{column}.offsets", 'Q') for column in TEXT_COLUMNS}
+        self._codes = {column: self._map(f"{column}.codes", 'B') for column in CODED_COLUMNS}
+        self._founded_year = self._map('founded_year.u8', 'B')
+        self._active = self._map('active.u8', 'B')
+        self._index_keys = self._map('regcode_index.keys', 'q')
+        self._index_rows = self._map('regcode_index.rows', 'Q')
+
+    def _map(self, name, typecode):
+        with open(os.path.join(self.path, name), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # mmap refuses empty files
+                return memoryview(b'').cast(typecode)
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return memoryview(mapped).cast(typecode)
+
+    def close(self):
+        for views in (self._data, self._offsets, self._codes):
+            for view in views.values():
+                view.release()
+        for view in (self._founded_year, self._active, self._index_keys, self._index_rows):
+            view.release()
+        for mapped in self._maps:
+            mapped.close()
+        self._maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return self.rows
+
+    def value(self, column, row):
+        """
+        Get one value of a row
+
+        Args:
+            column (str): Column name, one of TEXT_COLUMNS or CODED_COLUMNS
+            row (int): Row number
+
+        Returns:
+            str: The value as it was in the CSV, '' if it was empty
+        """
+        if column in self._codes:
+            return self.dictionaries[column][self._codes[column][row]]
+        offsets = self._offsets[column]
+        return bytes(self._data[column][offsets[row]:offsets[row + 1]]).decode('utf-8')
+
+    def row(self, row):
+        """Return a row as a dict with the register's column names, like csv.DictReader does"""
+        values = {column: self.value(column, row) for column in TEXT_COLUMNS}
+        for column in CODED_COLUMNS:
+            values[column] = self.dictionaries[column][self._codes[column][row]]
+        return values
+
+    def is_active(self, row):
+        """Whether a row's company is active, i.e. not closed or terminated"""
+        return bool(self._active[row])
+
+    def iter_rows(self, rows=None):
+        """
+        Iterate over rows as dicts
+
+        Args:
+            rows (iterable): Row numbers to return, e.g. from select(); every row if None
+
+        Yields:
+            dict: Row in the format of csv.DictReader over the register
+        """
+        for row in (range(self.rows) if rows is None else rows):
+            yield self.row(row)
+
+    def lookup(self, regcode):
+        """
+        Find the row of a registration number
+
+        Args:
+            regcode (str): Registration number
+
+        Returns:
+            int: Row number, or None if it isn't in the register
+        """
+        numeric = _numeric_regcode(regcode)
+        if numeric is not None:
+            position = bisect_left(self._index_keys, numeric)
+            if position < len(self._index_keys) and self._index_keys[position] == numeric:
+                return self._index_rows[position]
+            return None
+
+        # Registration numbers that aren't plain numbers are rare, scan for those
+        encoded = regcode.strip().encode('utf-8')
+        offsets = self._offsets['regcode']
+        data = self._data['regcode']
+        for row in range(self.rows):
+            if data[offsets[row]:offsets[row + 1]] == encoded:
+                return row
+        return None
+
+    def select(self, reg_type=None, active=None, founded_after=None, founded_before=None, closed=None):
+        """
+        Find the rows matching all given filters
+
+        Every filter is applied to a whole one-byte column in one go; only the
+        row numbers of the matches are materialized.
+
+        Args:
+            reg_type (str or iterable): Register type(s) to keep, e.g. 'SIA'
+            active (bool): Keep only rows that are (or aren't) active, i.e. not closed or terminated
+            founded_after (int): Keep rows registered after this year
+            founded_before (int): Keep rows registered before this year
+            closed (str or iterable): Values of the closed column to keep
+
+        Returns:
+            array: Matching row numbers in register order
+        """
+        masks = []
+        if reg_type is not None:
+            masks.append(self._code_mask('type', reg_type))
+        if closed is not None:
+            masks.append(self._code_mask('closed', closed))
+        if active is not None:
+            wanted = 1 if active else 0
+            masks.append(_translate(self._active, lambda value: value == wanted))
+        if founded_after is not None or founded_before is not None:
+            low = (founded_after + 1 - YEAR_BASE) if founded_after is not None else 1
+            high = (founded_before - 1 - YEAR_BASE) if founded_before is not None else 255
+            masks.append(_translate(self._founded_year, lambda value: value != 0 and low <= value <= high))
+
+        if not masks:
+            return array('Q', range(self.rows))
+
+        combined = int.from_bytes(masks[0], 'little')
+        for mask in masks[1:]:
+            combined &= int.from_bytes(mask, 'little')
+        combined = combined.to_bytes(self.rows, 'little')
+        return array('Q', (match.start() for match in re.finditer(b'\x01', combined)))
+
+    def _code_mask(self, column, values):
+        if isinstance(values, str):
+            values = [values]
+        dictionary = self.dictionaries[column]
+        wanted = {dictionary.index(value) for value in values if value in dictionary}
+        return _translate(self._codes[column], lambda code: code in wanted)
+
+
+def _translate(column, keep):
+    # One pass in C: map every byte of the column to 1 if keep(byte) else 0
+    table = bytes(1 if keep(value) else 0 for value in range(256))
+    return bytes(column).translate(table)
@@ -0,0 +1,374 @@
+"""
+Search providers the enrichment pipeline discovers candidate links with
+
+A provider turns a query into the links of its result page, as (href, link
+text) pairs. The pipeline only ever sees those pairs, so providers can be
+switched without touching link classification or scoring:
+
+    BingHtmlProvider        scrapes Bing's HTML result pages (the default)
+    BingApiProvider         Bing Web Search API
+    GoogleCustomSearchProvider
+                            Google Custom Search JSON API
+    ReplayProvider          serves result pages recorded by BingHtmlProvider from disk
+
+Every provider deduplicates queries: results are memoized, and a query that
+is already in flight for another lead waits for that request instead of
+sending its own. search_many() runs the queries of a lead concurrently.
+
+Recorded pages can also be served over HTTP, for load-testing the whole
+fetch path offline:
+
+    python search_providers.py serve data/search_pages [port]
+
+and then BingHtmlProvider(base_url='http://127.0.0.1:8765/search').
+"""
+
+import hashlib
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from bs4 import BeautifulSoup
+
+import metrics
+from fetcher import get_default_client, http_get
+
+BING_SEARCH_URL = "https://www.bing.com/search"
+BING_API_URL = "https://api.bing.microsoft.com/v7.0/search"
+GOOGLE_CSE_URL = "https://www.googleapis.com/customsearch/v1"
+
+# Distinct queries whose results are kept for deduplication
+DEFAULT_MEMO_SIZE = 10000
+# Queries of one lead sent at the same time
+DEFAULT_QUERY_CONCURRENCY = 4
+DEFAULT_REPLAY_PORT = 8765
+# Captcha and bot challenge pages, which Bing serves with status 200 instead of results
+CHALLENGE_RE = re.compile(r'/turing/captcha|b_captcha|captcha-container|cf-challenge|challenge-form', re.IGNORECASE)
+
+
+def normalize_query(query):
+    """Casefold a query and collapse its whitespace, so trivially different queries dedupe"""
+    return ' '.join(query.split()).casefold()
+
+
+def query_key(query):
+    """Stable file name friendly key of a query, used for recorded pages"""
+    return hashlib.sha1(normalize_query(query).encode('utf-8')).hexdigest()
+
+
+def parse_result_links(html):
+    """
+    Extract every link of a result page
+
+    Args:
+        html (str): Result page source
+
+    Returns:
+        list: (href, link text) pairs in page order
+    """
+    with metrics.span('parse', page='results'):
+        soup = BeautifulSoup(html, 'html.parser')
+        return [(link['href'], link.text) for link in soup.find_all('a', href=True)]
+
+
+class SearchProvider:
+    """
+    Base class of the search providers
+
+    Subclasses implement _search(query), returning the (href, link text)
+    pairs of the results, or None if the provider had no usable answer.
+    """
+
+    def __init__(self, memo_size=DEFAULT_MEMO_SIZE, concurrency=DEFAULT_QUERY_CONCURRENCY):
+        """
+        Args:
+            memo_size (int): Distinct queries whose results are remembered, 0 to disable
+            concurrency (int): Queries search_many() sends at the same time
+        """
+        self.memo_size = memo_size
+        self.concurrency = concurrency
+        self.queries_sent = 0
+        self.queries_deduplicated = 0
+        self._memo = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _search(self, query):
+        raise NotImplementedError
+
+    def search(self, query):
+        """
+        Get the result links of a query
+
+        Args:
+            query (str): Search query
+
+        Returns:
+            list: (href, link text) pairs, or None if the search failed
+        """
+        key = normalize_query(query)
+        provider = type(self).__name__
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                self.queries_deduplicated += 1
+                metrics.inc('search_queries', provider=provider, outcome='deduplicated')
+                return self._memo[key]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+            else:
+                self.queries_deduplicated += 1
+
+        if not owner:
+            metrics.inc('search_queries', provider=provider, outcome='deduplicated')
+            return future.result()
+
+        try:
+            with metrics.span('search', provider=provider):
+                links = self._search(query)
+        except BaseException as e:
+            metrics.inc('search_queries', provider=provider, outcome='error')
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+
+        metrics.inc('search_queries', provider=provider, outcome='sent' if links is not None else 'failed')
+        with self._lock:
+            self.queries_sent += 1
+            del self._inflight[key]
+            # Failed searches are not remembered, the next lead may have more luck
+            if links is not None and self.memo_size:
+                self._memo[key] = links
+                if len(self._memo) > self.memo_size:
+                    self._memo.popitem(last=False)
+        future.set_result(links)
+        return links
+
+    def search_many(self, queries):
+        """
+        Run several queries concurrently
+
+        Args:
+            queries (list): Search queries
+
+        Returns:
+            list: For every query, its (href, link text) pairs, or the exception it raised
+        """
+        if len(queries) <= 1 or self.concurrency <= 1:
+            return [self._search_or_error(query) for query in queries]
+
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='search')
+        return list(self._pool.map(self._search_or_error, queries))
+
+    def _search_or_error(self, query):
+        try:
+            return self.search(query)
+        except Exception as e:
+            return e
+
+    def stats(self):
+        return {'sent': self.queries_sent, 'deduplicated': self.queries_deduplicated}
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+
+class BingHtmlProvider(SearchProvider):
+    """Scrapes Bing's HTML result pages through the shared HttpClient"""
+
+    def __init__(self, client=None, base_url=BING_SEARCH_URL, record_dir=None, **kwargs):
+        """
+        Args:
+            client (HttpClient): Pooled HTTP client to fetch with, the shared default if None
+            base_url (str): Search URL, e.g. a local replay server
+            record_dir (str): Save every result page here for ReplayProvider, None to not record
+        """
+        super().__init__(**kwargs)
+        self.client = client
+        self.base_url = base_url
+        self.record_dir = record_dir
+        if record_dir:
+            os.makedirs(record_dir, exist_ok=True)
+
+    def search_url(self, query):
+        # urlencode percent-encodes diacritics, quotes and the like
+        return f"{self.base_url}?{urlencode({'q': query})}"
+
+    def _search(self, query):
+        url = self.search_url(query)
+        response = http_get(url, client=self.client)
+        if response.status_code != 200:
+            return None
+        links = parse_result_links(response.text) if not CHALLENGE_RE.search(response.text) else []
+        if not links:
+            # A block page, not a result page: keep it out of the fetch cache so the next run asks again
+            print(f"Search for {query!r} was answered with a challenge page or no links")
+            cache = (self.client or get_default_client()).cache
+            if cache is not None:
+                cache.delete(url)
+            return None
+        if self.record_dir:
+            with open(os.path.join(self.record_dir, f"{query_key(query)}.html"), 'w', encoding='utf-8') as f:
+                f.write(response.text)
+        return links
+
+
+class BingApiProvider(SearchProvider):
+    """Bing Web Search API (needs a subscription key)"""
+
+    def __init__(self, api_key, client=None, endpoint=BING_API_URL, count=50, market='lv-LV', **kwargs):
+        """
+        Args:
+            api_key (str): Ocp-Apim-Subscription-Key of the subscription
+            client (HttpClient): Pooled HTTP client to fetch with, the shared default if None
+            endpoint (str): API endpoint
+            count (int): Results per query
+            market (str): Market code of the results
+        """
+        super().__init__(**kwargs)
+        self.api_key = api_key
+        self.client = client
+        self.endpoint = endpoint
+        self.count = count
+        self.market = market
+
+    def _search(self, query):
+        url = f"{self.endpoint}?{urlencode({'q': query, 'count': self.count, 'mkt': self.market})}"
+        response = http_get(url, client=self.client, headers={'Ocp-Apim-Subscription-Key': self.api_key})
+        if response.status_code != 200:
+            return None
+        pages = response.json().get('webPages', {}).get('value', [])
+        return [(page['url'], page.get('name', '')) for page in pages if page.get('url')]
+
+
+class GoogleCustomSearchProvider(SearchProvider):
+    """Google Custom Search JSON API (needs an API key and a search engine ID)"""
+
+    def __init__(self, api_key, engine_id, client=None, endpoint=GOOGLE_CSE_URL, **kwargs):
+        """
+        Args:
+            api_key (str): API key
+            engine_id (str): Programmable Search Engine ID (cx)
+            client (HttpClient): Pooled HTTP client to fetch with, the shared default if None
+            endpoint (str): API endpoint
+        """
+        super().__init__(**kwargs)
+        self.api_key = api_key
+        self.engine_id = engine_id
+        self.client = client
+        self.endpoint = endpoint
+
+    def _search(self, query):
+        url = f"{self.endpoint}?{urlencode({'key': self.api_key, 'cx': self.engine_id, 'q': query})}"
+        response = http_get(url, client=self.client)
+        if response.status_code != 200:
+            return None
+        items = response.json().get('items', [])
+        return [(item['link'], item.get('title', '')) for item in items if item.get('link')]
+
+
+class ReplayProvider(SearchProvider):
+    """
+    Serves result pages recorded by BingHtmlProvider(record_dir=...) without any network access
+
+    Queries that were never recorded come back as an empty result page.
+    """
+
+    def __init__(self, directory, **kwargs):
+        """
+        Args:
+            directory (str): Directory of recorded pages
+        """
+        kwargs.setdefault('concurrency', 1)
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.missing = 0
+
+    def _search(self, query):
+        path = os.path.join(self.directory, f"{query_key(query)}.html")
+        try:
+            with open(path, encoding='utf-8') as f:
+                return parse_result_links(f.read())
+        except FileNotFoundError:
+            self.missing += 1
+            return []
+
+
+_default_provider = None
+_default_provider_lock = threading.Lock()
+
+
+def get_default_provider():
+    """Return the provider used by the pipeline when it isn't given one"""
+    global _default_provider
+    with _default_provider_lock:
+        if _default_provider is None:
+            _default_provider = BingHtmlProvider()
+        return _default_provider
+
+
+def set_default_provider(provider):
+    """Replace the default provider, e.g. with a ReplayProvider for offline runs"""
+    global _default_provider
+    with _default_provider_lock:
+        _default_provider = provider
+
+
+def make_replay_server(directory, host='127.0.0.1', port=DEFAULT_REPLAY_PORT):
+    """
+    Build an HTTP server that answers /search?q=... with recorded result pages
+
+    Args:
+        directory (str): Directory of pages recorded by BingHtmlProvider
+        host (str): Interface to listen on
+        port (int): Port to listen on, 0 for any free port
+
+    Returns:
+        ThreadingHTTPServer: Call serve_forever() on it, server_address has the port
+    """
+
+    class ReplayHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            query = parse_qs(parts.query).get('q', [''])[0]
+            path = os.path.join(directory, f"{query_key(query)}.html")
+            if parts.path != '/search' or not os.path.exists(path):
+                body = b'<html><body>No results</body></html>'
+            else:
+                with open(path, 'rb') as f:
+                    body = f.read()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), ReplayHandler)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "serve":
+        print(__doc__)
+        sys.exit(1)
+    server = make_replay_server(sys.argv[2], port=int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_REPLAY_PORT)
+    host, port = server.server_address[:2]
+    print(f"Serving recorded result pages from {sys.argv[2]} on http://{host}:{port}/search")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
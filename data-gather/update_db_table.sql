@@ -5,12 +5,76 @@ ADD COLUMN IF NOT EXISTS website VARCHAR(255) NULL,
 ADD COLUMN IF NOT EXISTS facebook VARCHAR(255) NULL,
 ADD COLUMN IF NOT EXISTS linkedin VARCHAR(255) NULL,
 ADD COLUMN IF NOT EXISTS instagram VARCHAR(255) NULL,
-ADD COLUMN IF NOT EXISTS twitter VARCHAR(255) NULL;
+ADD COLUMN IF NOT EXISTS twitter VARCHAR(255) NULL,
+-- Set by the registry sync when a company drops out of the register
+ADD COLUMN IF NOT EXISTS deregistered_at TIMESTAMP NULL;
 
 -- Create indexes for better query performance if they don't exist yet
 CREATE INDEX IF NOT EXISTS idx_website ON leads(website);
 CREATE INDEX IF NOT EXISTS idx_registration_number ON leads(registration_number);
 
+-- The registry importer upserts on registration_number, so it must be unique.
+-- Merge duplicates left by earlier imports into the oldest lead first (the
+-- backend migration add_unique_registration_number_to_leads_table does the same)
+CREATE TEMPORARY TABLE lead_duplicates AS
+SELECT l.id AS duplicate_id, k.keep_id
+FROM leads l
+JOIN (
+    SELECT registration_number, MIN(id) AS keep_id
+    FROM leads
+    WHERE registration_number IS NOT NULL
+    GROUP BY registration_number
+    HAVING COUNT(*) > 1
+) k ON k.registration_number = l.registration_number AND l.id <> k.keep_id;
+
+UPDATE IGNORE saved_leads t JOIN lead_duplicates ld ON t.lead_id = ld.duplicate_id SET t.lead_id = ld.keep_id;
+UPDATE IGNORE campaign_lead t JOIN lead_duplicates ld ON t.lead_id = ld.duplicate_id SET t.lead_id = ld.keep_id;
+UPDATE IGNORE campaign_leads t JOIN lead_duplicates ld ON t.lead_id = ld.duplicate_id SET t.lead_id = ld.keep_id;
+UPDATE IGNORE email_opens t JOIN lead_duplicates ld ON t.lead_id = ld.duplicate_id SET t.lead_id = ld.keep_id;
+DELETE l FROM leads l JOIN lead_duplicates ld ON l.id = ld.duplicate_id;
+DROP TEMPORARY TABLE lead_duplicates;
+
+CREATE UNIQUE INDEX IF NOT EXISTS leads_registration_number_unique ON leads(registration_number);
+
+-- Durable enrichment job queue (leads_importer.py also creates it on first use)
+CREATE TABLE IF NOT EXISTS lead_enrichment_jobs (
+    registration_number VARCHAR(255) NOT NULL PRIMARY KEY,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    attempts INT UNSIGNED NOT NULL DEFAULT 0,
+    last_attempt_at TIMESTAMP NULL,
+    next_attempt_at TIMESTAMP NULL,
+    lease_owner VARCHAR(64) NULL,
+    lease_expires_at TIMESTAMP NULL,
+    outcome VARCHAR(16) NULL,
+    last_error TEXT NULL,
+    -- Set by LeadPriority before leasing, highest first; active is the lead's status in the register
+    priority INT NOT NULL DEFAULT 0,
+    active TINYINT NULL,
+    INDEX idx_lead_enrichment_jobs_status (status, next_attempt_at),
+    INDEX idx_lead_enrichment_jobs_owner (lease_owner),
+    INDEX idx_lead_enrichment_jobs_priority (status, priority)
+);
+
+-- Queues created before jobs were prioritized
+ALTER TABLE lead_enrichment_jobs
+ADD COLUMN IF NOT EXISTS priority INT NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS active TINYINT NULL,
+ADD INDEX IF NOT EXISTS idx_lead_enrichment_jobs_priority (status, priority);
+
+-- Beneficial owners of the leads (leads_importer.py also creates it on first use)
+CREATE TABLE IF NOT EXISTS beneficial_owners (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    registration_number VARCHAR(255) NOT NULL,
+    owner_id VARCHAR(64) NULL,
+    forename VARCHAR(255) NULL,
+    surname VARCHAR(255) NULL,
+    nationality VARCHAR(8) NULL,
+    residence VARCHAR(8) NULL,
+    birth_date DATE NULL,
+    registered_on DATE NULL,
+    INDEX idx_beneficial_owners_registration_number (registration_number)
+);
+
 -- Sample query to find businesses with social media presence
 -- SELECT business_name, reg_type, website, facebook, linkedin, instagram, twitter
 -- FROM leads 